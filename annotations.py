@@ -0,0 +1,201 @@
+"""Batched output of the scene annotations of rendered samples.
+
+Every render worker accumulates the annotations of its samples (shapes,
+materials, pixel coordinates of the objects, segmentation colors and latents)
+in memory and flushes them in chunks, either as columnar NPZ files or as JSON
+lines, to the ``annotations`` folder of the view. Once all workers are done,
+``merge`` combines the chunks into a single file sorted by sample index:
+
+    python annotations.py --folder ${OUTPUT_FOLDER}/m1/annotations
+
+Merged JSON lines come with an index of byte offsets, so that single records
+can be read with ``read_record`` without parsing the whole file.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import os
+import glob
+import json
+import numpy as np
+
+FORMATS = ["npz", "jsonl"]
+
+# number of samples kept in memory before a chunk is written
+FLUSH_EVERY = 10000
+
+CHUNK_SUFFIX = ".part"
+MERGED_NAME = "annotations"
+COLUMNS = ["index", "shapes", "materials", "pixel_coords", "segmentation_colors", "latents"]
+
+
+def _write_atomic(path, write):
+    # chunks are written under a temporary name, so that merge never reads a partial file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class AnnotationSink:
+    """Accumulate the annotations of rendered samples and write them in chunks.
+
+    Args:
+        folder: Folder of the chunks, shared by all workers of a view.
+        worker: Name of the worker, unique among the workers writing to `folder`.
+        format: "npz" for columnar arrays or "jsonl" for one JSON record per sample.
+        flush_every: Number of samples per chunk.
+    """
+
+    def __init__(self, folder, worker, format="npz", flush_every=FLUSH_EVERY):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown annotation format {format}, expected one of {FORMATS}")
+        self.folder = folder
+        self.worker = worker
+        self.format = format
+        self.flush_every = flush_every
+        self.n_chunks = 0
+        self.records = {column: [] for column in COLUMNS}
+        os.makedirs(folder, exist_ok=True)
+
+    def __len__(self):
+        return len(self.records["index"])
+
+    def add(self, index, shapes, materials, pixel_coords, segmentation_colors, latents):
+        """Add the annotation of a sample.
+
+        Args:
+            index: Index of the sample.
+            shapes: Shape of each object.
+            materials: Material of each object.
+            pixel_coords: Pixel x, y and depth of each object, of shape (n_objects, 3).
+            segmentation_colors: RGBA color of the background and of each
+                object in the segmentation masks, of shape (n_objects + 1, 4).
+            latents: Latents of the sample, on the Blender support.
+        """
+
+        values = [int(index), list(shapes), list(materials), np.asarray(pixel_coords, dtype=np.float32),
+                  np.asarray(segmentation_colors, dtype=np.float32), np.asarray(latents, dtype=np.float32)]
+        for column, value in zip(COLUMNS, values):
+            self.records[column].append(value)
+        if len(self) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the accumulated annotations as a new chunk."""
+
+        if len(self) == 0:
+            return
+        path = os.path.join(self.folder, f"{self.worker}_{self.n_chunks:05d}{CHUNK_SUFFIX}.{self.format}")
+        if self.format == "npz":
+            arrays = {column: np.array(values) for column, values in self.records.items()}
+            _write_atomic(path, lambda f: np.savez(f, **arrays))
+        else:
+            lines = "".join(
+                json.dumps({column: values[k].tolist() if isinstance(values[k], np.ndarray) else values[k]
+                            for column, values in self.records.items()}, separators=(",", ":")) + "\n"
+                for k in range(len(self))
+            )
+            _write_atomic(path, lambda f: f.write(lines.encode()))
+        self.n_chunks += 1
+        self.records = {column: [] for column in COLUMNS}
+
+    def close(self):
+        self.flush()
+
+
+def merge(folder, format="npz", remove_chunks=True):
+    """Combine the chunks of all workers into one file sorted by sample index.
+
+    Samples annotated several times, e.g. after a re-render, keep their last
+    annotation. Returns the path of the merged file.
+    """
+
+    chunks = sorted(sorted(glob.glob(os.path.join(folder, f"*{CHUNK_SUFFIX}.{format}"))), key=os.path.getmtime)
+    path = os.path.join(folder, f"{MERGED_NAME}.{format}")
+    previous = [path] if os.path.exists(path) else []
+
+    if format == "npz":
+        parts = []
+        for chunk in previous + chunks:
+            with np.load(chunk) as data:
+                parts.append({column: data[column] for column in COLUMNS})
+        if len(parts) == 0:
+            return None
+        merged = {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+        # last occurrence of every index, in index order
+        reversed_index = merged["index"][::-1]
+        _, last = np.unique(reversed_index, return_index=True)
+        keep = len(reversed_index) - 1 - last
+        _write_atomic(path, lambda f: np.savez(f, **{column: values[keep] for column, values in merged.items()}))
+    else:
+        # only the positions of the records are held in memory, the records are copied in index order
+        locations = {}
+        for chunk in previous + chunks:
+            with open(chunk, "rb") as f:
+                offset = 0
+                for line in f:
+                    locations[json.loads(line)["index"]] = (chunk, offset, len(line))
+                    offset += len(line)
+        if len(locations) == 0:
+            return None
+        indices = np.array(sorted(locations), dtype=np.int64)
+        offsets = np.zeros(len(indices), dtype=np.int64)
+
+        def write(out):
+            handles = {}
+            try:
+                position = 0
+                for k, index in enumerate(indices):
+                    chunk, offset, length = locations[int(index)]
+                    if chunk not in handles:
+                        handles[chunk] = open(chunk, "rb")
+                    handles[chunk].seek(offset)
+                    out.write(handles[chunk].read(length))
+                    offsets[k] = position
+                    position += length
+            finally:
+                for handle in handles.values():
+                    handle.close()
+
+        _write_atomic(path, write)
+        np.savez(os.path.join(folder, f"{MERGED_NAME}_offsets.npz"), index=indices, offset=offsets)
+
+    if remove_chunks:
+        for chunk in chunks:
+            os.remove(chunk)
+    return path
+
+
+def load(folder):
+    """Read the merged NPZ annotations of a folder as a dictionary of arrays."""
+
+    with np.load(os.path.join(folder, f"{MERGED_NAME}.npz")) as data:
+        return {column: data[column] for column in COLUMNS}
+
+
+def read_record(folder, index):
+    """Read the annotation of one sample from the merged JSON lines of a folder."""
+
+    with np.load(os.path.join(folder, f"{MERGED_NAME}_offsets.npz")) as data:
+        indices, offsets = data["index"], data["offset"]
+    k = np.searchsorted(indices, index)
+    if k == len(indices) or indices[k] != index:
+        raise KeyError(f"No annotation of sample {index} in {folder}")
+    with open(os.path.join(folder, f"{MERGED_NAME}.jsonl"), "rb") as f:
+        f.seek(offsets[k])
+        return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge the annotation chunks written by the render workers.")
+    parser.add_argument("--folder", required=True, type=str, nargs="+", help="annotation folders, e.g. m1/annotations")
+    parser.add_argument("--format", default="npz", choices=FORMATS)
+    parser.add_argument("--keep-chunks", action="store_true")
+    args = parser.parse_args()
+
+    for folder in args.folder:
+        path = merge(folder, args.format, remove_chunks=not args.keep_chunks)
+        print(f"Merged the annotations of {folder} into {path}" if path is not None else f"No annotations in {folder}")
@@ -0,0 +1,286 @@
+"""Benchmark cases of the samplers, coordinate transforms and latent generators.
+
+Every case is a function registered with ``benchmark`` that takes its
+parameters, prepares its inputs and returns the callable to time. The
+parameter grids cover sizes from 10^3 to 10^6 rows, and 10^7 rows with
+``--full``.
+"""
+
+import os
+import sys
+import itertools
+import subprocess
+import tempfile
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_PATH)
+
+import numpy as np
+import torch
+import spaces
+import spaces_utils
+import latent_spaces
+import latent_io
+import memory_profile
+import vmf
+
+SIZES = [10**3, 10**5, 10**6]
+FULL_SIZES = SIZES + [10**7]
+DIMS = [1, 8]
+
+CASES = {}
+
+# peak resident memory of the processes started by the external cases, in bytes, see run_external
+external_peak_rss = 0
+
+
+def grid(**axes):
+    """All combinations of the given parameter values, as a list of dictionaries."""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def benchmark(family, params, full_params=None, repeats=None, warmup=True, external=False):
+    """Register a benchmark family with its parameter grid, and a larger grid for ``--full``.
+
+    ``repeats`` overrides the number of timed runs, and ``warmup`` runs the case once before timing it.
+    ``external`` marks cases running their code in a child process with ``run_external``, whose peak
+    memory is reported instead of the increase in the benchmark process.
+    """
+
+    def register(fn):
+        CASES[family] = {"fn": fn, "params": params, "full_params": full_params or params, "repeats": repeats,
+                         "warmup": warmup, "external": external}
+        return fn
+
+    return register
+
+
+def run_external(command, **kwargs):
+    """Run a command from the root of the repository like ``subprocess.run``, recording the peak memory of its process.
+
+    The peak is read from the process itself, see ``memory_profile.run_process``.
+    """
+    global external_peak_rss
+    result, peak = memory_profile.run_process(command, cwd=BASE_PATH, **kwargs)
+    external_peak_rss = max(external_peak_rss, peak)
+    return result
+
+
+def case_name(family, params):
+    return f"{family}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+def cases(full=False):
+    """Names of all cases, with their family and parameters."""
+    return {
+        case_name(family, params): (family, params)
+        for family, case in CASES.items()
+        for params in (case["full_params"] if full else case["params"])
+    }
+
+
+# samplers of the box space, as used by the generators
+
+
+@benchmark("nbox.uniform", grid(size=SIZES, dim=DIMS), grid(size=FULL_SIZES, dim=DIMS))
+def nbox_uniform(size, dim):
+    space = spaces.NBoxSpace(dim)
+    return lambda: space.uniform(size)
+
+
+@benchmark("nbox.uniform_around", grid(size=SIZES, dim=DIMS), grid(size=FULL_SIZES, dim=DIMS))
+def nbox_uniform_around(size, dim):
+    # conditional uniform around the marginal samples, with rejection at the border of the box
+    space = spaces.NBoxSpace(dim)
+    mean = space.uniform(size)
+    return lambda: space.uniform(size, mean=mean, a=-0.1, b=0.1)
+
+
+@benchmark("nbox.normal", grid(size=SIZES, dim=DIMS), grid(size=FULL_SIZES, dim=DIMS))
+def nbox_normal(size, dim):
+    space = spaces.NBoxSpace(dim)
+    mean = space.uniform(size)
+    return lambda: space.normal(mean, 1.0, size)
+
+
+@benchmark("nbox.laplace", grid(size=SIZES, dim=DIMS), grid(size=FULL_SIZES, dim=DIMS))
+def nbox_laplace(size, dim):
+    space = spaces.NBoxSpace(dim)
+    mean = space.uniform(size)
+    return lambda: space.laplace(mean, 1.0, size)
+
+
+@benchmark("nbox.multinomial", grid(size=SIZES, classes=[3, 8]), grid(size=FULL_SIZES, classes=[3, 8]))
+def nbox_multinomial(size, classes):
+    space = spaces.NBoxSpace(1)
+    mean = torch.zeros(size)
+    return lambda: space.multinomial(mean, classes, size)
+
+
+@benchmark("nbox.multinomial_transition", grid(size=SIZES), grid(size=FULL_SIZES))
+def nbox_multinomial_transition(size):
+    space = spaces.NBoxSpace(1)
+    transition = np.full((8, 8), 1.0) + 7 * np.eye(8)
+    given = torch.randint(0, 8, (size,))
+    return lambda: space.multinomial(given, 8, size, transition=transition / transition.sum(1, keepdims=True))
+
+
+@benchmark("truncated_rejection_resampling", grid(size=SIZES, dim=DIMS), grid(size=FULL_SIZES, dim=DIMS))
+def truncated_rejection(size, dim):
+    # a standard normal truncated to [-1, 1] rejects about a third of the draws
+    sampler = lambda s: torch.randn((s, dim))
+    return lambda: spaces_utils.truncated_rejection_resampling(sampler, -1.0, 1.0, size, dim)
+
+
+# samplers of the sphere space
+
+
+@benchmark("nsphere.normal", grid(size=SIZES, dim=[3, 8]), grid(size=FULL_SIZES, dim=[3, 8]))
+def nsphere_normal(size, dim):
+    space = spaces.NSphereSpace(dim)
+    mean = space.uniform(size)
+    return lambda: space.normal(mean, 0.5, size)
+
+
+@benchmark("nsphere.von_mises_fisher", grid(size=SIZES, dim=[3, 8]), grid(size=FULL_SIZES, dim=[3, 8]))
+def nsphere_von_mises_fisher(size, dim):
+    space = spaces.NSphereSpace(dim)
+    mean = space.uniform(size)
+    return lambda: space.von_mises_fisher(mean, 10.0, size)
+
+
+@benchmark("vmf.sample_vMF", grid(size=SIZES, dim=[3, 8]), grid(size=SIZES, dim=[3, 8]))
+def vmf_sample(size, dim):
+    mu = np.random.normal(size=(size, dim))
+    mu /= np.linalg.norm(mu, axis=1, keepdims=True)
+    return lambda: vmf.sample_vMF(mu, 10.0, size)
+
+
+# designs of the marginals
+
+
+@benchmark("design_points", grid(size=SIZES, dim=[8], design=spaces_utils.DESIGNS),
+           grid(size=FULL_SIZES, dim=[8], design=spaces_utils.DESIGNS))
+def design_points(size, dim, design):
+    return lambda: spaces_utils.design_points(size, dim, design=design, total=size)
+
+
+# product of the latent spaces of the generator
+
+
+def product_space(n_blocks):
+    # uniform marginals and normal conditionals, as in generate_clevr_dataset_latents.py
+    marginal = lambda space, mean, params, size, device: space.uniform(size, device, mean=mean, a=params["a"], b=params["b"])
+    conditional = lambda space, mean, params, size, device: space.normal(mean, params["std"], size, device)
+    latent_list = [latent_spaces.LatentSpace(spaces.NBoxSpace(1), marginal, conditional) for _ in range(n_blocks)]
+    return (
+        latent_spaces.ProductLatentSpace(latent_list),
+        dict(enumerate([{"a": -1.0, "b": 1.0}] * n_blocks)),
+        dict(enumerate([{"std": 0.1}] * n_blocks)),
+    )
+
+
+@benchmark("product.sample_marginal", grid(size=SIZES, blocks=[4, 16]), grid(size=FULL_SIZES, blocks=[4, 16]))
+def product_sample_marginal(size, blocks):
+    s, params_marginal, _ = product_space(blocks)
+    means = torch.zeros(size, blocks)
+    return lambda: s.sample_marginal(means=means, params=params_marginal, size=size, device="cpu")
+
+
+@benchmark("product.sample_views", grid(size=SIZES, blocks=[4, 16]), grid(size=FULL_SIZES, blocks=[4, 16]))
+def product_sample_views(size, blocks):
+    s, params_marginal, params_conditional = product_space(blocks)
+    anchors = s.sample_marginal(means=torch.zeros(size, blocks), params=params_marginal, size=size, device="cpu")
+    return lambda: s.sample_views(anchors, params_conditional, size, 1, device="cpu")
+
+
+# coordinate transforms
+
+
+@benchmark("spherical_to_cartesian", grid(size=SIZES, dim=[3, 8]), grid(size=FULL_SIZES, dim=[3, 8]))
+def spherical_to_cartesian(size, dim):
+    phi = np.random.uniform(0, np.pi, size=(size, dim - 1))
+    return lambda: spaces_utils.spherical_to_cartesian(1.0, phi)
+
+
+@benchmark("cartesian_to_spherical", grid(size=SIZES, dim=[3, 8]), grid(size=FULL_SIZES, dim=[3, 8]))
+def cartesian_to_spherical(size, dim):
+    x = np.random.normal(size=(size, dim))
+    return lambda: spaces_utils.cartesian_to_spherical(x)
+
+
+# import time of the entry points, and the heavy modules they must not load
+
+
+# entry point: modules it must not import
+LIGHT_IMPORTS = {
+    "generate_clevr_dataset_images": ["torch", "scipy", "pandas", "numpy", "latent_io", "render_cache",
+                                      "render_retry", "annotations", "camera", "resample"],
+    "render_stub": ["torch", "scipy", "pandas"],
+    "run_pipeline": ["torch", "scipy", "pandas"],
+    "verify_dataset": ["torch", "scipy", "pandas"],
+    "generate_clevr_dataset_latents": ["torch", "scipy", "pandas"],
+    "spaces_utils": ["torch", "scipy", "pandas"],
+    "spaces": ["scipy", "pandas"],
+    "latent_spaces": ["scipy", "pandas"],
+}
+
+
+@benchmark("import", grid(module=list(LIGHT_IMPORTS)), external=True)
+def import_module(module):
+    code = (f"import sys, {module}\n"
+            f"loaded = [m for m in {LIGHT_IMPORTS[module]!r} if m in sys.modules]\n"
+            f"sys.exit(f'{module} imports {{loaded}}' if loaded else 0)")
+
+    def run():
+        result = run_external([sys.executable, "-c", code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return run
+
+
+@benchmark("cli.help", grid(script=["generate_clevr_dataset_latents.py", "generate_clevr_dataset_images.py",
+                                    "run_pipeline.py", "verify_dataset.py"]), external=True)
+def cli_help(script):
+    return lambda: run_external([sys.executable, os.path.join(BASE_PATH, script), "--help"],
+                                stdout=subprocess.DEVNULL).check_returncode()
+
+
+# end-to-end latent generation, timed with the start-up of the interpreter
+
+
+def script(name, arguments):
+    def run():
+        with tempfile.TemporaryDirectory() as folder:
+            result = run_external(
+                [sys.executable, os.path.join(BASE_PATH, name), "--output-folder", folder] + arguments,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            raise RuntimeError(f"{name} exited with {result.returncode}: {error[-1] if error else ''}")
+    return run
+
+
+@benchmark("cli.latents", grid(n_pairs=[10**5]), grid(n_pairs=[10**5, 10**6]), repeats=1, warmup=False,
+           external=True)
+def cli_latents(n_pairs):
+    return script("generate_clevr_dataset_latents.py",
+                  ["--n-pairs", str(n_pairs), "--n-objects", "2", "--position", "--hue", "--seed", "0"])
+
+
+# all object classes drawn with the default noise, whose offsets wrap around the last class
+@benchmark("cli.latents_objects", grid(n_pairs=[10**5]), repeats=1, warmup=False, external=True)
+def cli_latents_objects(n_pairs):
+    weights = ["1"] * len(latent_io.SHAPE_NAMES)
+    return script("generate_clevr_dataset_latents.py",
+                  ["--n-pairs", str(n_pairs), "--n-objects", "1", "--position", "--object", "--object-weights", *weights,
+                   "--seed", "0"])
+
+
+@benchmark("cli.latents_causal", grid(n_points=[10**5]), grid(n_points=[10**5, 10**6]), repeats=1, warmup=False,
+           external=True)
+def cli_latents_causal(n_points):
+    return script("generate_clevr_dataset_latents_causal.py",
+                  ["--n-points", str(n_points), "--non-periodic-rotation-and-color", "--deterministic", "--debug"])
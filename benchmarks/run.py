@@ -0,0 +1,177 @@
+"""Run the benchmark cases and compare them with a stored baseline.
+
+    python benchmarks/run.py                       # run all cases and compare with the baseline
+    python benchmarks/run.py --filter nbox.normal  # only the cases whose name contains this string
+    python benchmarks/run.py --save-baseline       # record the results as the new baseline
+    python benchmarks/run.py --full                # also 10^7 rows and 10^6 generated pairs
+
+Every case runs in a fresh process, so that its memory is not inflated by the
+previous cases, and its wall time is the best of several repeats. Its memory
+is the peak increase of the resident memory during its first run or,
+for cases running a script, the peak resident memory of the script's process.
+A case regresses if its time or its memory exceeds the baseline by more than
+the threshold, if it fails, or if it has no baseline, in which case the exit
+code is 1. Failing cases are never stored in the baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import multiprocessing
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_PATH, "baselines", "baseline.json")
+
+# relative increase of the wall time and of the peak memory reported as a regression
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+# differences of the wall time below this many seconds are noise, not regressions
+MIN_TIME_DIFFERENCE = 0.005
+# differences of the peak memory below this many MiB are noise, e.g. of the allocator, not regressions
+MIN_MEMORY_DIFFERENCE = 4.0
+# seconds between two samples of the resident memory
+RSS_INTERVAL = 0.001
+
+
+def run_case(name, full, repeats):
+    # runs in its own process, see measure
+    import numpy as np
+    import torch
+    import cases
+    import memory_profile
+
+    family, params = cases.cases(full)[name]
+    case = cases.CASES[family]
+    repeats = case["repeats"] or repeats
+    # the same inputs and draws, e.g. of rejection sampling, in every run
+    torch.manual_seed(0)
+    np.random.seed(0)
+    fn = case["fn"](**params)
+
+    def call():
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    # the memory is measured on the first call, before the allocator keeps the memory it freed resident,
+    # and the memory held by this process, e.g. torch and the inputs of the case, is not counted
+    sampler = memory_profile.RSSSampler(RSS_INTERVAL)
+    sampler.start()
+    first = call()
+    rss_start, rss_peak = sampler.stop()
+    timings = [] if case["warmup"] else [first]
+    while len(timings) < repeats:
+        timings.append(call())
+    peak = cases.external_peak_rss if case["external"] else rss_peak - rss_start
+    return {"time": min(timings), "peak_rss_mb": peak / 2**20, "repeats": repeats, "threads": torch.get_num_threads()}
+
+
+def measure(name, full, repeats):
+    """Run a case in a fresh process; return its result, or its error."""
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        try:
+            return pool.apply(run_case, (name, full, repeats))
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+
+def machine():
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "python": platform.python_version()}
+
+
+def compare(results, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD,
+            min_time_difference=MIN_TIME_DIFFERENCE, min_memory_difference=MIN_MEMORY_DIFFERENCE):
+    """Names of the cases slower or heavier than their baseline, failing, or without a baseline."""
+
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if "error" in result or reference is None:
+            regressions.append(name)
+        elif (result["time"] > max(reference["time"] * (1 + time_threshold), reference["time"] + min_time_difference)
+              or result["peak_rss_mb"] > max(reference["peak_rss_mb"] * (1 + memory_threshold),
+                                             reference["peak_rss_mb"] + min_memory_difference)):
+            regressions.append(name)
+    return regressions
+
+
+def main(args):
+    sys.path.insert(0, BENCHMARK_PATH)
+    import cases
+
+    names = [name for name in cases.cases(args.full) if args.filter is None or args.filter in name]
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored["machine"] != machine():
+            print(f"The baseline was recorded on another machine ({stored['machine']['platform']}), "
+                  f"timings may not be comparable")
+
+    results = {}
+    print(f"{'case':60s} {'time':>10s} {'baseline':>10s} {'peak RSS':>10s} {'baseline':>10s}")
+    for name in names:
+        result = results[name] = measure(name, args.full, args.repeats)
+        reference = baseline.get(name, {})
+        if "error" in result:
+            print(f"{name:60s} failed: {result['error']}")
+            continue
+        reference_time = f"{reference['time']:.4f}s" if "time" in reference else "-"
+        reference_rss = f"{reference['peak_rss_mb']:.1f}MB" if "peak_rss_mb" in reference else "-"
+        print(f"{name:60s} {result['time']:9.4f}s {reference_time:>10s} {result['peak_rss_mb']:8.1f}MB {reference_rss:>10s}",
+              flush=True)
+
+    output = {"machine": machine(), "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
+    failed = [name for name, result in results.items() if "error" in result]
+    if args.save_baseline:
+        # cases that were not run keep their previous baseline, failing cases have none
+        output["results"] = {**baseline, **results}
+        for name in failed:
+            output["results"].pop(name)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=4, sort_keys=True)
+        print(f"Saved the baseline of {len(results) - len(failed)} cases to {args.baseline}")
+        if failed:
+            print(f"{len(failed)} failing cases were not saved:")
+            for name in failed:
+                print(f"  {name}")
+            sys.exit(1)
+        return
+
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold, args.min_time_difference,
+                          args.min_memory_difference)
+    if regressions:
+        print(f"{len(regressions)} failures, cases without a baseline or regressions of more than "
+              f"{100 * args.time_threshold:.0f}% in time or {100 * args.memory_threshold:.0f}% in memory:")
+        for name in regressions:
+            print(f"  {name}" + ("" if name in baseline else " (no baseline, record it with --save-baseline)"))
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks and compare them with a baseline.")
+    parser.add_argument("--filter", type=str, default=None, help="only run the cases whose name contains this string")
+    parser.add_argument("--full", action="store_true", help="also run the largest sizes")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline instead of comparing")
+    parser.add_argument("--output", type=str, default=None, help="also write the results to this JSON file")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD)
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument("--min-time-difference", type=float, default=MIN_TIME_DIFFERENCE,
+                        help="seconds below which a slowdown is not reported")
+    parser.add_argument("--min-memory-difference", type=float, default=MIN_MEMORY_DIFFERENCE,
+                        help="MiB below which an increase of the peak memory is not reported")
+    main(parser.parse_args())
@@ -0,0 +1,151 @@
+"""Projection of object positions through the camera of the base scene, without Blender.
+
+The camera is exported once from Blender with
+``generate_clevr_dataset_images.py --export-camera camera.json`` and the
+projection reproduces ``bpy_extras.object_utils.world_to_camera_view`` for
+whole batches of points, so that latents whose objects are not in frame can
+be rejected before rendering.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import json
+import numpy as np
+import latent_io
+
+# bounding radius of an object; shapes are loaded at a size of 1.5
+DEFAULT_OBJECT_RADIUS = 0.75
+
+
+def load_camera(path):
+    """Read a camera written by ``render_utils.export_camera``."""
+
+    with open(path, "r") as f:
+        return from_parameters(json.load(f))
+
+
+def from_parameters(parameters):
+    """Camera from the parameters of ``render_utils.camera_parameters``, e.g. inside Blender."""
+
+    camera = dict(parameters)
+    camera["world_to_camera"] = np.array(camera["world_to_camera"], dtype=np.float64)
+    camera["view_frame"] = np.array(camera["view_frame"], dtype=np.float64)
+    return camera
+
+
+def project(camera, points):
+    """Project world-space points to the image.
+
+    Args:
+        camera: Camera read with ``load_camera``.
+        points: Array of shape (..., 3).
+
+    Returns:
+        Pixel coordinates x and y (origin at the top left corner, as in
+        ``render_utils.get_camera_coords``) and the depth along the viewing
+        direction, each of shape (...).
+    """
+
+    points = np.asarray(points, dtype=np.float64)
+    rotation, translation = camera["world_to_camera"][:3, :3], camera["world_to_camera"][:3, 3]
+    local = points @ rotation.T + translation
+    depth = -local[..., 2]
+
+    # normalized coordinates in the view frame, scaled to the depth of each point for perspective cameras
+    frame = camera["view_frame"]
+    min_x, max_x = frame[2, 0], frame[1, 0]
+    min_y, max_y = frame[1, 1], frame[0, 1]
+    if camera["type"] != "ORTHO":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(depth != 0, depth / -frame[0, 2], np.nan)
+        min_x, max_x, min_y, max_y = min_x * ratio, max_x * ratio, min_y * ratio, max_y * ratio
+    x = (local[..., 0] - min_x) / (max_x - min_x)
+    y = (local[..., 1] - min_y) / (max_y - min_y)
+
+    width, height = camera["resolution"]
+    return x * width, height - y * height, depth
+
+
+def pixel_radius(camera, depth, radius):
+    """Approximate radius in pixels of a sphere of the given radius at the given depth."""
+
+    frame = camera["view_frame"]
+    extent = frame[1, 0] - frame[2, 0]
+    if camera["type"] != "ORTHO":
+        extent = extent * depth / -frame[0, 2]
+    return radius / extent * camera["resolution"][0]
+
+
+def in_frame(camera, centers, radius=DEFAULT_OBJECT_RADIUS, margin=0.0):
+    """Whether spheres around the given centers are entirely in front of the camera and in frame.
+
+    Args:
+        camera: Camera read with ``load_camera``.
+        centers: Array of shape (..., 3).
+        radius: Radius of the spheres, a scalar or of shape (...).
+        margin: Additional distance to the image border, in pixels.
+    """
+
+    x, y, depth = project(camera, centers)
+    width, height = camera["resolution"]
+    r = pixel_radius(camera, depth, radius) + margin
+    with np.errstate(invalid="ignore"):
+        return (
+            (depth - radius > camera["clip_start"]) & (depth + radius < camera["clip_end"])
+            & (x - r >= 0) & (x + r <= width) & (y - r >= 0) & (y + r <= height)
+        )
+
+
+def object_centers(latents, columns, n_objects, z_offset=DEFAULT_OBJECT_RADIUS):
+    """World-space centers of the objects of Blender latents, as placed by the renderer.
+
+    Args:
+        latents: Blender latents of shape (N, n_columns).
+        columns: Map of column names to positions, see ``latent_io.column_indices``.
+        n_objects: Number of objects per scene.
+        z_offset: Height of the object centers above their z position.
+
+    Returns:
+        Array of shape (N, n_objects, 3).
+    """
+
+    latents = np.asarray(latents)
+    centers = np.stack(
+        [latents[:, [columns[f"position_{axis}_object_{k}"] for k in range(n_objects)]] for axis in ["x", "y", "z"]],
+        axis=-1,
+    ).astype(np.float64)
+    centers[..., 2] += z_offset
+    return centers
+
+
+def frame_mask(camera, latents, columns, n_objects, radius=DEFAULT_OBJECT_RADIUS, margin=0.0):
+    """Whether all objects of each row of Blender latents are in frame.
+
+    The radius is either shared by all objects or given per object, with shape (N, n_objects).
+    """
+
+    # the renderer lifts all objects of a scene by half of the largest object
+    z_offset = np.max(radius, axis=-1, keepdims=True) if np.ndim(radius) else radius
+    centers = object_centers(latents, columns, n_objects, z_offset=z_offset)
+    return in_frame(camera, centers, radius, margin).all(axis=-1)
+
+
+if __name__ == "__main__":
+    # fraction of the latents of a folder whose objects are all in frame
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Count the samples of a latent folder whose objects are in frame.")
+    parser.add_argument("--camera", required=True, type=str)
+    parser.add_argument("--latent-folder", required=True, type=str)
+    parser.add_argument("--radius", default=DEFAULT_OBJECT_RADIUS, type=float)
+    args = parser.parse_args()
+
+    latents = latent_io.LatentDataset(args.latent_folder)
+    n_objects = latents.metadata["n_objects"] if latents.metadata is not None else (latents.shape[1] - 3) // 7
+    columns = latent_io.column_indices(latents.metadata, latents.shape[1], latents.filename)
+    camera = load_camera(args.camera)
+    n_in_frame = 0
+    for start in range(0, len(latents), latent_io.CHUNK_SIZE):
+        chunk = latents[start : start + latent_io.CHUNK_SIZE]
+        n_in_frame += int(frame_mask(camera, chunk, columns, n_objects, args.radius).sum())
+    print(f"{n_in_frame} / {len(latents)} samples in frame ({100 * n_in_frame / max(len(latents), 1):.1f}%)")
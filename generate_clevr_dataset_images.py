@@ -8,95 +8,433 @@ import sys
 sys.path.append('.')
 sys.path.append('../../')
 import os
-import numpy as np
+import math
 import argparse
 import pathlib
-import colorsys
 import site
-
-SPOT_POS=2
-SPOT_HUE=0
-BKG_HUE=1
-OBJECT_HUE=3
-OBJECT_POS=[6,7,8]
-OBJECT_ROT=[4,5]
-OBJECT_TYPE=9
-
-SHAPE_DICT={0:"Teapot",
-            1:"Armardillo",
-            2:"Bunny",
-            3:"Cow",
-            4:"Dragon",
-            5:"Head",
-            6:"Horse",
-            7:"Spot",
-            }
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# NumPy and the helper modules are imported by the code paths using them,
+# so that --help and the exports do not wait for what they do not use
 
 # fix the third rotation angle
 
 def main(args):
 
+    import latent_io
+
     # defining output folder from given path
     args.output_folder = pathlib.Path(args.output_folder).absolute()
 
+    # the camera only depends on the base scene and the render settings
+    if args.export_camera is not None:
+        initialize_renderer([latent_io.SHAPE_NAMES[0]], ["Rubber"], not args.no_spotlights)
+        render_utils.export_camera(args.export_camera)
+        print(f"Exported the camera to {args.export_camera}")
+        return
+
+    # the bounding radii of all shapes, loaded at their rendering size
+    if args.export_radii is not None:
+        shapes = list(latent_io.SHAPE_NAMES)
+        initialize_renderer(shapes, ["Rubber"] * len(shapes), not args.no_spotlights)
+        render_utils.export_object_radii(args.export_radii, shapes)
+        print(f"Exported the radii of the shapes to {args.export_radii}")
+        return
+
+    for folder in view_folders(args):
+        if folder != args.output_folder:
+            print(f"Rendering view {os.path.basename(folder)}")
+        render_view(args, folder)
+
+
+def view_folders(args):
+    """Folders of the views to render: the output folder is either a single view or,
+    with --views, the dataset folder holding m1..mK."""
+
+    import latent_io
+
+    output_folder = pathlib.Path(args.output_folder).absolute()
+    if args.views is None:
+        return [output_folder]
+    views = latent_io.view_names(output_folder) if args.views == ["all"] else args.views
+    if len(views) == 0:
+        raise ValueError(f"No view folders m1..mK found in {output_folder}")
+    return [output_folder / view for view in views]
+
+
+def batch_indices(args, folder, n_samples):
+    """Indices of the samples of the view in `folder` rendered by this batch, among the samples of the work list if any."""
+
+    import json
+    import numpy as np
+
+    candidates = np.arange(n_samples)
+    if args.worklist is not None:
+        with open(args.worklist, "r") as f:
+            worklist = json.load(f)
+        candidates = np.array(sorted(worklist.get(os.path.basename(os.path.normpath(folder)), [])), dtype=np.int64)
+        candidates = candidates[candidates < n_samples]
+    return np.array_split(candidates, args.n_batches)[args.batch_index]
+
+
+def render_view(args, folder):
+    """Render the samples of this batch for the latents stored in `folder`."""
+
+    import latent_io
+    import render_cache
+    import render_retry
+    import annotations
+
     # loading generative factors
-    latents_path = os.path.join(args.output_folder, "latents.npy")
-    if not os.path.exists(latents_path):
-        raise ValueError("Latents could not be found; run latent generation first")
-    latents = np.load(latents_path)
+    try:
+        latents = latent_io.LatentDataset(folder)
+    except FileNotFoundError:
+        raise ValueError(f"Latents could not be found in {folder}; run latent generation first")
     n_samples = latents.shape[0]
-    n_object = ((latents.shape[1]-3) // 7) 
-    n_diff_object = len(list(np.unique(latents[:,-1])))
+    metadata = latents.metadata
+    if metadata is not None:
+        n_object = metadata["n_objects"]
+    else:
+        n_object = ((latents.shape[1]-3) // 7) 
+    columns = latent_io.column_indices(metadata, latents.shape[1], latents.filename)
+    object_columns = [columns[f"object_object_{k}"] for k in range(n_object)]
 
     # setting the material name
-    if args.material_names is None:
-        args.material_names = ["Rubber"] * n_object 
-    elif args.material_names in ["Rubber","Crystal","Metallic"]: 
-        args.material_names = args.material_names * n_object
-    elif isinstance(args.material_names,list) and len(args.material_names) == n_object: 
+    material_names = args.material_names
+    if material_names is None:
+        material_names = ["Rubber"] * n_object 
+    elif material_names in ["Rubber","Crystal","Metallic"]: 
+        material_names = material_names * n_object
+    elif isinstance(material_names,list) and len(material_names) == n_object: 
         pass
     else: assert NotImplementedError("Material name should Rubber, Metallic or Crystal")
 
     # defining instance number for given batch
-    indices = np.array_split(np.arange(n_samples), args.n_batches)[args.batch_index]
-    print(indices)
+    indices = batch_indices(args, folder, n_samples)
+    if len(indices) == 0:
+        print("No samples to render in this batch")
+        return
     print(f"Rendering samples in range: {min(indices)} - {max(indices)}")
 
+    # only the rows of this batch are read from the memory-mapped latents
+    batch_latents = latent_io.read_rows(latents, indices)
+
     # defining image folder
-    output_image_folder = os.path.join(args.output_folder, "images")
+    output_image_folder = os.path.join(folder, "images")
+
+    # identical scenes, e.g. across views, are rendered once and then linked from the cache
+    cache = None
+    if args.cache_folder is not None:
+        decimals = render_cache.QUANTIZATION_DECIMALS if args.cache_decimals is None else args.cache_decimals
+        cache = render_cache.RenderCache(args.cache_folder, decimals=decimals)
+        settings = {"spotlights": not args.no_spotlights, "gpu": args.use_gpu, "blender": bpy.app.version_string}
+    os.makedirs(output_image_folder, exist_ok=True)
+
+    # scene annotations are accumulated and written in chunks by every worker, see annotations.merge
+    sink = None
+    if args.annotations is not None:
+        flush_every = annotations.FLUSH_EVERY if args.annotations_flush is None else args.annotations_flush
+        sink = annotations.AnnotationSink(
+            os.path.join(folder, "annotations"), f"batch_{args.batch_index:05d}", args.annotations, flush_every
+        )
+
+    # samples that keep failing are skipped and quarantined instead of stalling the batch
+    quarantine = args.quarantine if args.quarantine is not None else os.path.join(folder, "quarantine.jsonl")
+    failures = render_retry.FailureLog(quarantine, worker=f"batch {args.batch_index} (pid {os.getpid()})")
+    render_args = {"failures": failures, "max_retries": args.max_retries, "base_delay": args.retry_delay}
+
+    # samples left to render after skipping existing images and cache hits
+    pending = []
+    for i, idx in enumerate(indices):
+
+        current_latents = batch_latents[i]
+        shapes=[latent_io.SHAPE_NAMES[int(k)] for k in current_latents[object_columns]]
+        output_filename = os.path.join(
+            output_image_folder,
+            f"{str(idx).zfill(6)}.png",
+        )
+        if args.worklist is not None and os.path.exists(output_filename):
+            # listed images are broken and replaced
+            os.remove(output_filename)
+        if os.path.exists(output_filename):
+            print("Skipped file", output_filename)
+            continue
+        key = None
+        if cache is not None:
+            key = cache.key(current_latents, material_names, shapes, settings)
+            if args.worklist is not None:
+                # the cached render is the broken image itself when it was linked from the cache
+                if cache.evict(key):
+                    print("Evicted cached render of", output_filename)
+            elif cache.fetch(key, output_filename):
+                print("Linked cached render", output_filename)
+                continue
+        pending.append((current_latents, shapes, output_filename, key, idx))
 
     # image creation
-    for _, idx in enumerate(indices):
+    start = time.perf_counter()
+    if args.atlas > 0:
+        render_atlas(args, pending, columns, material_names, output_image_folder, cache, render_args, sink)
+    elif args.keyframe_batch > 0:
+        render_keyframed(args, pending, columns, material_names, output_image_folder, cache, render_args, sink)
+    else:
+        for sample in pending:
+            current_latents, shapes, output_filename, key, _ = sample
+
+            # creating default scene
+            scene = initialize_renderer(
+                shapes,
+                material_names,
+                not args.no_spotlights,
+                render_tile_size=256 if args.use_gpu else 64,
+                use_gpu=args.use_gpu,
+            )
 
-        shapes=[SHAPE_DICT[k] for k in idx[-n_object:]]
-        
-        # creating default scene
-        initialize_renderer(
+            print('getting into rendering')
+            rendered = render_sample(
+                current_latents,
+                columns,
+                material_names,
+                not args.no_spotlights,
+                output_filename,
+                args.save_scene,
+                render_args,
+            )
+            print('done with rendering')
+            if rendered and cache is not None:
+                cache.store(key, output_filename)
+            annotate_samples(sink, [sample], columns, material_names, scene)
+
+    if len(pending) > 0:
+        elapsed = time.perf_counter() - start
+        print(f"Rendered {len(pending)} images in {elapsed:.1f}s ({elapsed / len(pending):.2f}s per image)")
+        print(failures.report())
+    if cache is not None:
+        print(cache.report())
+    if sink is not None:
+        sink.close()
+
+    # lower resolutions of all images of the batch, including skipped and cached ones
+    if args.resolutions:
+        filenames = [os.path.join(output_image_folder, f"{str(idx).zfill(6)}.png") for idx in indices]
+        write_resolutions(output_image_folder, filenames, args.resolutions)
+
+
+def write_resolutions(output_image_folder, filenames, resolutions):
+    """Downsample rendered images to lower resolutions, each in a folder next to the image folder.
+
+    Only images missing at one of the resolutions are read, once for all resolutions."""
+
+    import resample
+
+    folders = [resample.resolution_folder(output_image_folder, size) for size in resolutions]
+    for resolution_folder in folders:
+        os.makedirs(resolution_folder, exist_ok=True)
+    start = time.perf_counter()
+    n_images = 0
+    for filename in filenames:
+        name = os.path.basename(filename)
+        targets = [os.path.join(resolution_folder, name) for resolution_folder in folders]
+        if not os.path.exists(filename) or all(os.path.exists(target) for target in targets):
+            continue
+        images = resample.resize_many(render_utils.load_pixels(filename), resolutions)
+        for target, image in zip(targets, images):
+            render_utils.save_pixels(target, image)
+        n_images += 1
+    if n_images > 0:
+        elapsed = time.perf_counter() - start
+        print(f"Resampled {n_images} images to {resolutions} in {elapsed:.1f}s ({1000 * elapsed / n_images:.1f}ms per image)")
+
+
+def shape_batches(pending, batch_size):
+    """Split samples into batches of at most `batch_size` samples with the same shapes."""
+
+    # the objects of a scene are fixed, so only samples with the same shapes can share a scene
+    groups = {}
+    for sample in pending:
+        groups.setdefault(tuple(sample[1]), []).append(sample)
+    for shapes, samples in groups.items():
+        for first in range(0, len(samples), batch_size):
+            yield list(shapes), samples[first : first + batch_size]
+
+
+def render_keyframed(args, pending, columns, material_names, output_image_folder, cache=None, render_args=None,
+                     sink=None):
+    """Render samples as frame-range animations instead of one render call each.
+
+    Samples sharing their shapes are keyframed into the same scene, one frame
+    per sample, and rendered as a single animation with persistent data, so
+    that the scene is loaded and synchronized once per animation rather than
+    once per image. Frames are written to a temporary folder and then moved to
+    the filename of their sample.
+    """
+
+    import shutil
+    import tempfile
+
+    for shapes, batch in shape_batches(pending, args.keyframe_batch):
+        start = time.perf_counter()
+        scene_info = initialize_renderer(
             shapes,
-            args.material_names,
+            material_names,
             not args.no_spotlights,
             render_tile_size=256 if args.use_gpu else 64,
             use_gpu=args.use_gpu,
         )
-        output_filename = os.path.join(
-            output_image_folder,
-            f"{str(idx).zfill(6)}.png",
+        for frame, (current_latents, _, _, _, _) in enumerate(batch, start=1):
+            update_objects_and_lights(current_latents, columns, material_names, not args.no_spotlights, keyframe=frame)
+            update_background(current_latents, columns, keyframe=frame)
+        render_utils.constant_interpolation(
+            list(bpy.data.objects) + list(bpy.data.lights)
+            + [m.node_tree for m in bpy.data.materials if m.node_tree is not None]
         )
-        if os.path.exists(output_filename):
-            print("Skipped file", output_filename)
+
+        scene = bpy.context.scene
+        scene.frame_start = 1
+        scene.frame_end = len(batch)
+        scene.render.use_persistent_data = True
+        frame_folder = tempfile.mkdtemp(prefix=".keyframes_", dir=output_image_folder)
+        scene.render.filepath = os.path.join(frame_folder, "frame_######")
+        setup = time.perf_counter() - start
+
+        rendered = render_utils.render_img([sample[2] for sample in batch], animation=True, **(render_args or {}))
+        for frame, (_, _, output_filename, key, _) in enumerate(batch, start=1):
+            if not rendered:
+                break
+            os.replace(scene.render.frame_path(frame=frame), output_filename)
+            if cache is not None:
+                cache.store(key, output_filename)
+        shutil.rmtree(frame_folder, ignore_errors=True)
+        annotate_samples(sink, batch, columns, material_names, scene_info)
+
+        if args.save_scene:
+            # just for debugging
+            bpy.ops.wm.save_as_mainfile(
+                filepath=f"scene_{os.path.basename(batch[0][2])}_keyframes.blend"
+            )
+        elapsed = time.perf_counter() - start
+        print(f"Rendered {len(batch)} frames of {', '.join(shapes)} in {elapsed:.1f}s "
+              f"({setup:.1f}s setup, {elapsed / len(batch):.2f}s per frame)")
+
+
+def annotate_samples(sink, samples, columns, material_names, scene_info):
+    """Add the annotations of the rendered samples to the sink, if any.
+
+    The pixel coordinates of the objects are projected with the camera of the
+    scene returned by ``initialize_renderer``."""
+
+    import numpy as np
+    import camera
+
+    if sink is None:
+        return
+    cam = camera.from_parameters(scene_info["camera"])
+    for current_latents, shapes, output_filename, _, idx in samples:
+        if not os.path.exists(output_filename):
+            # failed renders are not annotated
             continue
+        centers = camera.object_centers(
+            current_latents[None], columns, len(shapes), z_offset=scene_info["max_object_size"] / 2
+        )[0]
+        x, y, depth = camera.project(cam, centers)
+        sink.add(idx, shapes, material_names, np.stack([x, y, depth], axis=-1),
+                 scene_info["segmentation_colors"], current_latents)
+
+
+def render_atlas(args, pending, columns, material_names, output_image_folder, cache=None, render_args=None,
+                 sink=None):
+    """Render several samples with a single render call, one view layer per sample.
+
+    Samples sharing their shapes are set up in copies of the scene objects,
+    each copy in its own collection, and every view layer only includes the
+    collection of one sample. The base scene and its camera are shared, so
+    that one render call synchronizes, denoises and writes all samples. The
+    compositor writes the image of every layer, which is then moved to the
+    filename of its sample.
+    """
+
+    import shutil
+    import tempfile
+
+    n_verified = 0
+    for shapes, batch in shape_batches(pending, args.atlas):
+        start = time.perf_counter()
+        scene_info = initialize_renderer(
+            shapes,
+            material_names,
+            not args.no_spotlights,
+            render_tile_size=256 if args.use_gpu else 64,
+            use_gpu=args.use_gpu,
+        )
+
+        # the objects and spotlights set up for a sample are copied to the collection of that sample
+        template = [o for o in bpy.data.objects if "Object_" in o.name or o.name == "Ground"]
+        collections = []
+        for k, (current_latents, _, _, _, _) in enumerate(batch):
+            update_objects_and_lights(current_latents, columns, material_names, not args.no_spotlights)
+            update_background(current_latents, columns)
+            collections.append(render_utils.copy_to_collection(template, f"Sample_{k}"))
+        hidden = render_utils.move_to_collection(template, "Template")
+        layers = render_utils.isolated_view_layers(collections, hidden=[hidden])
+        frame_folder = tempfile.mkdtemp(prefix=".atlas_", dir=output_image_folder)
+        paths = render_utils.layer_file_outputs(layers, frame_folder)
+        setup = time.perf_counter() - start
+
+        rendered = render_utils.render_img([sample[2] for sample in batch], write_still=False, **(render_args or {}))
+        for path, (_, _, output_filename, key, _) in zip(paths, batch):
+            if not rendered:
+                break
+            os.replace(path, output_filename)
+            if cache is not None:
+                cache.store(key, output_filename)
+        shutil.rmtree(frame_folder, ignore_errors=True)
+        annotate_samples(sink, batch, columns, material_names, scene_info)
+
+        if args.save_scene:
+            # just for debugging
+            bpy.ops.wm.save_as_mainfile(
+                filepath=f"scene_{os.path.basename(batch[0][2])}_atlas.blend"
+            )
+        elapsed = time.perf_counter() - start
+        print(f"Rendered {len(batch)} samples of {', '.join(shapes)} in {elapsed:.1f}s "
+              f"({setup:.1f}s setup, {elapsed / len(batch):.2f}s per sample)")
+
+        # the first samples are rendered again on their own and compared
+        reference = batch[: max(0, args.atlas_verify - n_verified)] if rendered else []
+        if len(reference) > 0:
+            verify_atlas(args, reference, columns, material_names, output_image_folder)
+            n_verified += len(reference)
+
 
-        current_latents = latents[idx]
+def verify_atlas(args, samples, columns, material_names, output_image_folder):
+    """Render samples on their own and check that their atlas images match within tolerance."""
 
-        print('getting into rendering')
-        render_sample(
-            current_latents,
-            args.material_names,
+    import shutil
+    import tempfile
+    import numpy as np
+
+    reference_folder = tempfile.mkdtemp(prefix=".reference_", dir=output_image_folder)
+    for k, (current_latents, shapes, output_filename, _, _) in enumerate(samples):
+        reference_filename = os.path.join(reference_folder, f"{k}.png")
+        initialize_renderer(
+            shapes,
+            material_names,
             not args.no_spotlights,
-            output_filename,
-            args.save_scene,
+            render_tile_size=256 if args.use_gpu else 64,
+            use_gpu=args.use_gpu,
         )
-        print('done with rendering')
+        if not render_sample(current_latents, columns, material_names, not args.no_spotlights, reference_filename, False):
+            print(f"Atlas check {os.path.basename(output_filename)}: the single render failed")
+            continue
+        difference = np.abs(render_utils.load_pixels(output_filename) - render_utils.load_pixels(reference_filename))
+        print(f"Atlas check {os.path.basename(output_filename)}: mean difference {difference.mean():.4f}, "
+              f"max difference {difference.max():.4f}")
+        if difference.mean() > args.atlas_tolerance:
+            raise ValueError(
+                f"The atlas render of {output_filename} differs from its single render by {difference.mean():.4f} "
+                f"on average, more than --atlas-tolerance {args.atlas_tolerance}"
+            )
+    shutil.rmtree(reference_folder, ignore_errors=True)
 
 
 def initialize_renderer(
@@ -112,7 +450,10 @@ def initialize_renderer(
     render_max_bounces=8,
     ground_texture=None,
 ):
-    """Initialize renderer and base scene"""
+    """Initialize renderer and base scene.
+
+    Returns the segmentation colors of the background and of every object,
+    the largest object size and the camera parameters of the scene."""
 
     base_path = pathlib.Path(__file__).parent.absolute()
 
@@ -224,6 +565,12 @@ def initialize_renderer(
         segm_mat.append(segm_node_mat.copy())
         segm_color.append(list(segm_node_group_elems[i].color))
 
+    return {
+        "segmentation_colors": segm_color,
+        "max_object_size": max_object_height,
+        "camera": render_utils.camera_parameters(),
+    }
+
 
 def add_objects_and_lights(shape_names, material_names, add_lights, base_path):
     shapes_path = os.path.join(base_path, "data", "shapes")
@@ -248,11 +595,11 @@ def add_objects_and_lights(shape_names, material_names, add_lights, base_path):
             )
             spotlight_data.energy = 3000  # 10000, 10000 could be too bright
             spotlight_data.shadow_soft_size = 0.5
-            spotlight_data.spot_size = 35 / 180 * np.pi
+            spotlight_data.spot_size = 35 / 180 * math.pi
             spotlight_data.spot_blend = 0.1
             spotlight_data.falloff_type = "CONSTANT"
 
-            spotlight_data.contact_shadow_distance = np.sqrt(3) * 3
+            spotlight_data.contact_shadow_distance = math.sqrt(3) * 3
             # create new object with our light datablock
             spotlight_object = bpy.data.objects.new(
                 name=f"Spotlight_Object_{i}", object_data=spotlight_data
@@ -273,23 +620,24 @@ def add_objects_and_lights(shape_names, material_names, add_lights, base_path):
             dg.update()
 
 
-def update_objects_and_lights(latents, material_names, update_lights):
+def update_objects_and_lights(latents, columns, material_names, update_lights, keyframe=None):
     """Parse latents and update the object(s) position, rotation and color
-    as well as the spotlight's position and color."""
-    scene_latents = latents[[SPOT_HUE,SPOT_POS]]
-    objects_latents = latents[BKG_HUE+1:]
-
-    new_order=[]
-    for i in range(7):
-        new_order.append(list(np.arange(objects_latents.shape[-1])[i::len(material_names)]))
-    object_latents=np.array_split(object_latents[:,new_order],len(material_names))
+    as well as the spotlight's position and color.
+
+    The columns of the latents are looked up by name in ``columns``. If
+    ``keyframe`` is given, all updated properties are keyframed at that frame."""
+
+    import colorsys
+    import numpy as np
+
+    spot_hue = latents[columns["spot_hue_object_0"]]
+    spot_rotation = latents[columns["rotation_spot_object_0"]]
+
     max_object_size = max(
         [max(o.dimensions) for o in bpy.data.objects if "Object_" in o.name]
     )
 
-    for i, (object_latents, material_name) in enumerate(
-        zip(objects_latents, material_names)
-    ):
+    for i, material_name in enumerate(material_names):
         # find correct object name
         object_name = None
         for obj in bpy.data.objects:
@@ -301,64 +649,142 @@ def update_objects_and_lights(latents, material_names, update_lights):
         # update object location and rotation
         object = bpy.data.objects[object_name]
         object.location = (
-            object_latents[3],
-            object_latents[4],
-            object_latents[5] + max_object_size / 2,
+            latents[columns[f"position_x_object_{i}"]],
+            latents[columns[f"position_y_object_{i}"]],
+            latents[columns[f"position_z_object_{i}"]] + max_object_size / 2,
         )
 
-        object.rotation_euler = tuple(np.concatenate([object_latents[1:2],0.0],axis=-1))  # replace gamma angle
+        object.rotation_euler = (
+            latents[columns[f"rotation_object_alpha_object_{i}"]],
+            latents[columns[f"rotation_object_beta_object_{i}"]],
+            0.0,  # replace gamma angle
+        )
+        if keyframe is not None:
+            object.keyframe_insert("location", frame=keyframe)
+            object.keyframe_insert("rotation_euler", frame=keyframe)
 
         # update object color
         saturation=1.0
         value=1.0
         rgba_object = colorsys.hsv_to_rgb(
-            object_latents[0] / (2.0 * np.pi), saturation, value,
+            latents[columns[f"object_hue_object_{i}"]] / (2.0 * np.pi), saturation, value,
         ) + (1.0,)
 
         render_utils.change_material(
-            bpy.data.objects[object_name].data.materials[-1], Color=rgba_object
+            bpy.data.objects[object_name].data.materials[-1], keyframe=keyframe, Color=rgba_object
         )
 
         if update_lights:
             # update light color
             saturation=0.8
             value=1.0
-            rgb_light = colorsys.hsv_to_rgb(scene_latents[0] / (2.0 * np.pi), saturation,value)
+            rgb_light = colorsys.hsv_to_rgb(spot_hue / (2.0 * np.pi), saturation,value)
             bpy.data.objects[f"Spotlight_Object_{i}"].data.color = rgb_light
             # update light location
             bpy.data.objects[f"Spotlight_Object_{i}"].location = (
-                4 * np.sin(scene_latents[1]),
-                4 * np.cos(scene_latents[1]),
+                4 * np.sin(spot_rotation),
+                4 * np.cos(spot_rotation),
                 6 + max_object_size,
             )
+            if keyframe is not None:
+                bpy.data.objects[f"Spotlight_Object_{i}"].data.keyframe_insert("color", frame=keyframe)
+                bpy.data.objects[f"Spotlight_Object_{i}"].keyframe_insert("location", frame=keyframe)
 
 
-def render_sample(latents, material_names, include_lights, output_filename, save_scene):
-    """Update the scene based on the latents and render the scene and save as an image."""
+def update_background(latents, columns, keyframe=None):
+    """Set the ground color from the latents, keyframed at ``keyframe`` if given."""
+
+    import colorsys
+    import numpy as np
 
     # background saturation and value
     saturation = 0.6
     value = 1.0
 
+    rgba_background = colorsys.hsv_to_rgb(latents[columns["back_hue_object_0"]] / (2.0 * np.pi), saturation, value) + (1.0,) 
+    render_utils.change_material(
+        bpy.data.objects["Ground"].data.materials[-1], keyframe=keyframe, Color=rgba_background,
+    )
+
+
+def render_sample(latents, columns, material_names, include_lights, output_filename, save_scene, render_args=None):
+    """Update the scene based on the latents and render the scene and save as an image.
+
+    Returns whether the render succeeded, see ``render_utils.render_img``."""
+
     # set output path
     bpy.context.scene.render.filepath = output_filename
 
     # set objects and lights
-    update_objects_and_lights(latents, material_names, include_lights)
-
-    rgba_background = colorsys.hsv_to_rgb(latents[BKG_HUE] / (2.0 * np.pi), saturation, value) + (1.0,) 
-    render_utils.change_material(
-        bpy.data.objects["Ground"].data.materials[-1], Color=rgba_background,
-    )
+    update_objects_and_lights(latents, columns, material_names, include_lights)
+    update_background(latents, columns)
 
     # set scene background
-    bpy.ops.render.render(write_still=True)
+    rendered = render_utils.render_img([output_filename], **(render_args or {}))
+    if not rendered and os.path.exists(output_filename):
+        # a failed render must not leave an image that would be skipped as done
+        os.remove(output_filename)
 
     if save_scene:
         # just for debugging
         bpy.ops.wm.save_as_mainfile(
             filepath=f"scene_{os.path.basename(output_filename)}.blend"
         )
+    return rendered
+
+
+def build_parser():
+    """Command-line options of the renderer."""
+
+    import render_retry
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output-folder", required=True,type=str)
+    parser.add_argument("--n-batches", default=100,type=int)
+    parser.add_argument("--nlatents", default=9, type=int)
+    parser.add_argument("--batch-index", default=0, type=int)
+    parser.add_argument("--no-spotlights", action="store_true")
+    parser.add_argument("--use-gpu", action="store_true")
+    parser.add_argument("--material-names", nargs="+", type=str)
+    parser.add_argument("--shape-names", nargs="+", type=str)
+    parser.add_argument("--save-scene", action="store_true")
+    parser.add_argument("--no_range_change",action="store_true")
+    parser.add_argument("--cache-folder", type=str, default=None,
+                        help="content-addressed store of rendered scenes, shared between views, batches and datasets")
+    parser.add_argument("--cache-decimals", type=int, default=None,
+                        help="latents are rounded to this number of decimals to identify a scene, "
+                             "render_cache.QUANTIZATION_DECIMALS by default")
+    parser.add_argument("--export-camera", type=str, default=None,
+                        help="only write the camera of the base scene to this JSON file, for camera.py")
+    parser.add_argument("--export-radii", type=str, default=None,
+                        help="only write the bounding radius of every shape to this JSON file, for placement.py")
+    parser.add_argument("--views", nargs="+", type=str, default=None,
+                        help="render these view folders (e.g. m1 m2 m3, or all) of the dataset in --output-folder")
+    parser.add_argument("--worklist", type=str, default=None,
+                        help="only render again the samples listed for each view in this file, see verify_dataset.py")
+    parser.add_argument("--max-retries", type=int, default=render_retry.MAX_RETRIES,
+                        help="retries of a failed render before its samples are quarantined and skipped")
+    parser.add_argument("--retry-delay", type=float, default=render_retry.BASE_DELAY,
+                        help="seconds before the first retry, doubled for every further retry")
+    parser.add_argument("--quarantine", type=str, default=None,
+                        help="JSONL file recording the samples that failed, quarantine.jsonl in each view folder by default")
+    parser.add_argument("--annotations", type=str, default=None, choices=["npz", "jsonl"],
+                        help="write the scene annotations of the rendered samples in chunks of this format")
+    parser.add_argument("--annotations-flush", type=int, default=None,
+                        help="number of annotated samples per chunk, annotations.FLUSH_EVERY by default")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=None,
+                        help="also write every image downsampled to these sizes, in images_<size> folders")
+    parser.add_argument("--keyframe-batch", type=int, default=0,
+                        help="render up to this many samples with the same shapes as one keyframed animation, "
+                             "instead of one render call per sample")
+    parser.add_argument("--atlas", type=int, default=0,
+                        help="render up to this many samples with the same shapes in one render call, "
+                             "with one view layer per sample")
+    parser.add_argument("--atlas-verify", type=int, default=0,
+                        help="render this many of the atlas samples again on their own and compare the images")
+    parser.add_argument("--atlas-tolerance", type=float, default=0.01,
+                        help="largest mean absolute pixel difference, in [0, 1], accepted by --atlas-verify")
+    return parser
 
 
 if __name__ == "__main__":
@@ -382,17 +808,7 @@ if __name__ == "__main__":
                 print("\nERROR")
                 sys.exit(1)
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--output-folder", required=True,type=str)
-    parser.add_argument("--n-batches", default=100,type=int)
-    parser.add_argument("--nlatents", default=9, type=int)
-    parser.add_argument("--batch-index", default=0, type=int)
-    parser.add_argument("--no-spotlights", action="store_true")
-    parser.add_argument("--use-gpu", action="store_true")
-    parser.add_argument("--material-names", nargs="+", type=str)
-    parser.add_argument("--shape-names", nargs="+", type=str)
-    parser.add_argument("--save-scene", action="store_true")
-    parser.add_argument("--no_range_change",action="store_true")
+    parser = build_parser()
 
     if INSIDE_BLENDER:
         # Run normally
@@ -6,18 +6,223 @@ This code builds on the following projects:
 import sys
 sys.path.append('../../')
 import os
-import torch
-import spaces
-import latent_spaces
+import spaces_utils
+import latent_io
+import camera
+import placement
+import memory_profile
 import argparse
 import numpy as np
-import pandas as pd
 
 # make sure commands are consistent
 # only one object for fixed position
-# make sure the conditional multinomial gives right values
 # no multinomial noise is one object
-# max classes object 8
+
+# latents of each factor of variation, in sampling order
+FACTOR_LATENTS = {
+    "object": ["object"],
+    "position": ["position_x", "position_y", "position_z"],
+    "rotation": ["rotation_object_alpha", "rotation_object_beta", "rotation_spot"],
+    "hue": ["object_hue", "back_hue", "spot_hue"],
+}
+# number of redraws of the invalid samples before giving up
+MAX_RESAMPLING = 100
+# latents with one instance per object, the others describe the scene
+OBJECT_LATENTS = ["object", "position_x", "position_y", "position_z", "rotation_object_alpha", "rotation_object_beta", "object_hue"]
+
+
+def object_distribution(args):
+    """Sampler of the object classes and the optional transition matrix between views."""
+
+    # object classes are drawn from alias tables built once per distribution
+    n_shapes = len(latent_io.SHAPE_NAMES)
+    object_transition = None if args.object_transition is None else np.load(args.object_transition)
+    if object_transition is not None and object_transition.shape != (n_shapes, n_shapes):
+        raise ValueError(f"--object-transition must be a ({n_shapes}, {n_shapes}) matrix, got {object_transition.shape}")
+    object_dist = lambda space, mean, params, size, device: space.multinomial(mean, params["classes"], size, weights=params["weights"], uniform=params["uniform"],
+                                                                           transition=params.get("transition"), max_classes=n_shapes, unit=params.get("unit"), device=device)
+    return object_dist, object_transition
+
+
+def build_model(args, latent_list, object_dist, object_transition):
+    """Latent space and sampling parameters of every column, for latents partitioned into content, style and ms blocks."""
+
+    import spaces
+    import latent_spaces
+
+    latent_spaces_list={}
+    latent_blocks={}
+    params_marginal = {}
+    params_conditional = {}
+    design_columns = []
+    for part in ["content","style","ms"]:
+        if part != "ms": idx_marg, idx_cond = ("normal" if args.continuous_marginal == "normal" else "uniform"), ("normal" if args.continuous_conditional == "normal" else "uniform")
+        else: idx_marg, idx_cond = "delta", "delta"
+        dist = {"normal": lambda space, mean, params, size, device: space.normal(mean, params["std"], size, device),
+                "uniform" : lambda space, mean, params, size, device: space.uniform(size, device, mean=mean, a=params["a"], b=params["b"], unit=params.get("unit")),
+                "multinomial" : object_dist,
+                "delta":lambda space, mean, params, size, device: space.delta(size, device=device),}
+        
+        marginal, conditional = dist[idx_marg], dist[idx_cond]
+
+        for k in list(latent_list[part].keys()):
+            if k != "object":latent_list[part][k]=latent_spaces.LatentSpace(spaces.NBoxSpace(1,min_=args.min,max_=args.max),marginal,conditional)
+            else: latent_list[part][k]=latent_spaces.LatentSpace(spaces.NBoxSpace(1,min_=args.min,max_=args.max),object_dist,object_dist)
+
+            nb_instances = 1 if ((k not in OBJECT_LATENTS) or (args.n_objects ==1)) else args.n_objects
+            for tmp_idx in range(nb_instances):
+                latent_spaces_list[k+"_object_"+str(tmp_idx)]=latent_list[part][k]
+                latent_blocks[k+"_object_"+str(tmp_idx)]=part
+                if k == "object" or idx_marg == "uniform": design_columns.append(k+"_object_"+str(tmp_idx))
+                params_marginal[k+"_object_"+str(tmp_idx)]={"uniform":{"a":args.uniform_marginal_a,"b":args.uniform_marginal_b},
+                                        "normal":{"std":args.normal_marginal_std},
+                                        "multinomial":{"classes":args.n_objects if args.object_weights is None else len(args.object_weights),
+                                                       "uniform":args.object_weights is None,"weights":args.object_weights},
+                                        "delta":{}}[idx_marg if k != "object" else "multinomial"]
+                params_conditional[k+"_object_"+str(tmp_idx)]={"uniform":{"a":args.uniform_conditional_a if part=="content" else args.uniform_conditional_noise_a,"b":args.uniform_conditional_b if part=="content" else args.uniform_conditional_noise_b},
+                                        "normal":{"std":args.normal_conditional_std if part=="content" else args.normal_conditional_noise},
+                                        "multinomial":{"classes":args.multinomial_noise,"uniform":True,"weights":None,"transition":object_transition},
+                                        "delta":{}}[idx_cond if k != "object" else "multinomial"]
+
+    return latent_spaces_list, latent_blocks, params_marginal, params_conditional, design_columns
+
+
+def apply_design(args, params_marginal, design_columns):
+    """Attach the points of the space-filling marginal design to the marginal parameters of its columns."""
+
+    # space-filling marginals: the unit points of each column are mapped to its support by the samplers
+    if args.marginal_design != "iid" and design_columns:
+        points = spaces_utils.design_points(args.n_pairs, len(design_columns), args.marginal_design,
+                                            seed=0 if args.seed is None else args.seed,
+                                            offset=args.design_offset, total=args.design_total)
+        for j, column in enumerate(design_columns):
+            params_marginal[column] = dict(params_marginal[column], unit=points[:, j])
+
+
+def fixed_constants(factors, n_objects):
+    """Values of the columns of all factors of variation that are not in `factors`."""
+
+    objects = range(n_objects)
+    constants = {}
+    if "hue" not in factors:
+        constants.update({"spot_hue_object_0": 0.0, "back_hue_object_0": 1.0})
+        constants.update({f"object_hue_object_{k}": -1.0 for k in objects})
+    if "rotation" not in factors:
+        constants.update({f"rotation_object_alpha_object_{k}": 1.0 for k in objects})
+        constants.update({f"rotation_object_beta_object_{k}": -1.0 for k in objects})
+        constants.update({"rotation_spot_object_0": -0.5})
+    if "position" not in factors:
+        constants.update({f"position_{axis}_object_{k}": 0.0 for axis in ["x", "y", "z"] for k in objects})
+    if "object" not in factors:
+        constants.update({f"object_object_{k}": 0.0 for k in objects})
+    return constants
+
+
+def draw_views(s, params_marginal, params_conditional, size, views, profiler=memory_profile.DISABLED):
+    """Sample the anchors of the first view and the conditional samples of the other views, as NumPy arrays."""
+
+    import torch
+
+    # broadcast zeros: the marginal means do not need an (n_pairs, n_latents) array
+    with profiler.stage("sample marginal"):
+        means = torch.zeros([1, len(s.spaces)]).expand(size, -1)
+        raw_latents_view1 = s.sample_marginal(means=means,params=params_marginal,size=size, device="cpu")
+        sampled = {views[0]: raw_latents_view1.numpy()}
+    # all conditional views of an anchor are drawn at once, as a (K-1, n_pairs, n_latents) tensor
+    if len(views) > 1:
+        with profiler.stage("sample conditional"):
+            raw_latents_views = s.sample_views(means=raw_latents_view1,params=params_conditional,size=size,n_views=len(views)-1,device="cpu")
+            sampled.update({view: raw_latents_views[k].numpy() for k, view in enumerate(views[1:])})
+    return sampled
+
+
+def parse_variant(spec):
+    """Parse a variant given as NAME=factor:block,factor:block,... into its name and the block of each factor."""
+
+    name, _, assignment = spec.partition("=")
+    blocks = {}
+    for item in assignment.split(","):
+        factor, _, part = item.partition(":")
+        if factor not in FACTOR_LATENTS or part not in ["content", "style", "ms"]:
+            raise ValueError(f"Invalid assignment {item!r} in variant {spec!r}: expected factor:block with a factor "
+                             f"in {list(FACTOR_LATENTS)} and a block in content, style or ms")
+        blocks[factor] = part
+    if not name:
+        raise ValueError(f"Variant {spec!r} has no name")
+    return name, blocks
+
+
+def generate_variants(args, views):
+    """Write datasets that only differ in the block of their factors, from shared anchors.
+
+    The first view of every factor that is content or style in some variant
+    is sampled once and shared by all variants, and the conditional views of
+    each factor are sampled once per block. Every sampled column is written
+    once to the column store and referenced by the variants using it; ms and
+    disabled factors are constants.
+    """
+
+    import torch
+    import latent_spaces
+
+    variants = dict(parse_variant(spec) for spec in args.variants)
+    object_dist, object_transition = object_distribution(args)
+    store = os.path.join(args.output_folder, latent_io.COLUMN_STORE_FOLDER)
+    for view in views:
+        os.makedirs(os.path.join(store, view), exist_ok=True)
+    files = {}
+
+    # anchors: content and style factors share the same marginal
+    sampled_factors = [f for f in FACTOR_LATENTS if any(v.get(f) in ["content", "style"] for v in variants.values())]
+    latent_list = {"content": {k: None for f in sampled_factors for k in FACTOR_LATENTS[f]}, "style": {}, "ms": {}}
+    latent_spaces_list, _, params_marginal, _, design_columns = build_model(args, latent_list, object_dist, object_transition)
+    apply_design(args, params_marginal, design_columns)
+    anchor_columns = list(latent_spaces_list.keys())
+    s = latent_spaces.ProductLatentSpace(list(latent_spaces_list.values()))
+    means = torch.zeros([1, len(anchor_columns)]).expand(args.n_pairs, -1)
+    anchors = s.sample_marginal(means=means, params=dict(enumerate(params_marginal.values())), size=args.n_pairs, device="cpu")
+    for j, column in enumerate(anchor_columns):
+        files[(views[0], column, None)] = os.path.join(store, views[0], f"{column}.npy")
+        np.save(files[(views[0], column, None)], anchors[:, j].numpy().astype(np.float32))
+
+    # conditional views: one draw per factor and block, for all variants using it
+    for part in ["content", "style"]:
+        factors = [f for f in FACTOR_LATENTS if any(v.get(f) == part for v in variants.values())]
+        if not factors or len(views) == 1:
+            continue
+        latent_list = {"content": {}, "style": {}, "ms": {}}
+        latent_list[part] = {k: None for f in factors for k in FACTOR_LATENTS[f]}
+        latent_spaces_list, _, _, params_conditional, _ = build_model(args, latent_list, object_dist, object_transition)
+        part_columns = list(latent_spaces_list.keys())
+        s = latent_spaces.ProductLatentSpace(list(latent_spaces_list.values()))
+        part_anchors = anchors[:, [anchor_columns.index(c) for c in part_columns]]
+        drawn = s.sample_views(means=part_anchors, params=dict(enumerate(params_conditional.values())),
+                               size=args.n_pairs, n_views=len(views) - 1, device="cpu")
+        for k, view in enumerate(views[1:]):
+            for j, column in enumerate(part_columns):
+                files[(view, column, part)] = os.path.join(store, view, f"{column}_{part}.npy")
+                np.save(files[(view, column, part)], drawn[k, :, j].numpy().astype(np.float32))
+
+    static_list = latent_io.default_columns(args.n_objects)
+    for name, factor_blocks in variants.items():
+        # ms factors are sampled from deltas at zero in both views
+        constants = fixed_constants(list(factor_blocks), args.n_objects)
+        blocks = [factor_blocks.get(latent_io.column_factor(c), "fixed") for c in static_list]
+        constants.update({c: 0.0 for c, block in zip(static_list, blocks) if block == "ms"})
+        for view in views:
+            folder = os.path.join(args.output_folder, name, view)
+            os.makedirs(folder, exist_ok=True)
+            column_files = [
+                None if block not in ["content", "style"]
+                else os.path.relpath(files[(view, c, None if view == views[0] else block)], folder)
+                for c, block in zip(static_list, blocks)
+            ]
+            latents = latent_io.ColumnLatents(folder, static_list, column_files, constants, args.n_pairs)
+            metadata = latent_io.build_metadata(latents, static_list, args.n_objects, blocks=blocks, constants=constants,
+                                                view=view, views=views, variant=name, seed=torch.initial_seed(), args=vars(args))
+            metadata.update(storage="columns", column_files=column_files)
+            latent_io.save_metadata(folder, metadata)
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -26,6 +231,28 @@ def main():
     parser.add_argument("--n-objects", default=1, type=int)
     parser.add_argument("--output-folder", required=True, type=str)
     parser.add_argument("--causal", action="store_true")
+    parser.add_argument("--n-views", default=2, type=int, help="number of views m1..mK: the anchor sample and K-1 conditional samples")
+    parser.add_argument("--camera", type=str, default=None,
+                        help="camera exported with generate_clevr_dataset_images.py --export-camera: samples whose objects are not all in frame are invalid")
+    parser.add_argument("--frame-margin", default=0.0, type=float, help="minimal distance of the objects to the image border, in pixels")
+    parser.add_argument("--no-overlap", action="store_true", help="samples with intersecting objects are invalid")
+    parser.add_argument("--radii", type=str, default=None,
+                        help="bounding radii of the shapes exported with generate_clevr_dataset_images.py --export-radii")
+    parser.add_argument("--object-radius", default=camera.DEFAULT_OBJECT_RADIUS, type=float, help="bounding radius of the shapes missing from --radii")
+    parser.add_argument("--invalid-policy", default="resample", choices=["resample", "reject"],
+                        help="redraw or drop the invalid samples")
+    parser.add_argument("--variants", nargs="+", default=None,
+                        help="write one dataset per NAME=factor:block,... (e.g. hcps=hue:content,position:style,rotation:ms) "
+                             "from shared anchors, instead of the factors and blocks given by the flags below")
+    parser.add_argument("--seed", default=None, type=int)
+    parser.add_argument("--storage", default="float", choices=["float", "compact"])
+    parser.add_argument("--no-blender-latents", action="store_true")
+    parser.add_argument("--marginal-design", default="iid", choices=spaces_utils.DESIGNS,
+                        help="design of the uniform marginals and object classes: i.i.d., scrambled Sobol or Latin hypercube")
+    parser.add_argument("--design-offset", default=0, type=int, help="first row of the design, to generate shards separately")
+    parser.add_argument("--design-total", default=None, type=int, help="number of rows of the whole design over all shards (Latin hypercube)")
+    parser.add_argument("--profile-memory", default=None, type=str,
+                        help="JSON file to write the time and peak memory of every stage to, see memory_profile.py")
 
     # factors of variations
     parser.add_argument("--object", action="store_true")
@@ -67,66 +294,45 @@ def main():
     parser.add_argument("--uniform-conditional-noise-a", type=float, default=-0.1)
     parser.add_argument("--uniform-conditional-noise-b", type=float, default=0.1)
     parser.add_argument("--multinomial-noise",type=int,default=3)
+    parser.add_argument("--object-weights", type=float, nargs="+", default=None,
+                        help="weights of the object classes in the first view, uniform over n-objects classes if not set")
+    parser.add_argument("--object-transition", type=str, default=None,
+                        help=".npy (K, K) matrix of P(object in view 2 | object in view 1), replacing --multinomial-noise")
 
     args = parser.parse_args()
 
+    # torch and the latent spaces are only imported by the code sampling latents,
+    # so that --help and invalid arguments do not wait for them
+    import torch
+    import latent_spaces
+
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+
+    if args.n_views < 1:
+        raise ValueError("--n-views must be at least 1")
+    views = [latent_io.view_name(k) for k in range(args.n_views)]
+    profiler = memory_profile.StageProfiler(enabled=args.profile_memory is not None)
+    if args.variants is not None:
+        with profiler.stage("variants"):
+            generate_variants(args, views)
+        save_profile(args, profiler)
+        return
     os.makedirs(args.output_folder, exist_ok=True)
-    os.makedirs(os.path.join(args.output_folder,"m1"), exist_ok=True)
-    os.makedirs(os.path.join(args.output_folder,"m2"), exist_ok=True)
+    for view in views:
+        os.makedirs(os.path.join(args.output_folder,view), exist_ok=True)
+    object_dist, object_transition = object_distribution(args)
 
     # create model partition
     latent_list={"content":{},"style":{},"ms":{}}
-    if args.object: 
-        gen_type = ["content","style","ms"][np.argmax(1*[args.object_content,args.object_style,args.object_ms])]
-        latent_list[gen_type]["object"] = None  
-    if args.position: 
-        gen_type = ["content","style","ms"][np.argmax(1*[args.position_content,args.position_style,args.position_ms])]
-        latent_list[gen_type]["position_x"] = None
-        latent_list[gen_type]["position_y"] = None
-        latent_list[gen_type]["position_z"] = None
-    if args.rotation: 
-        gen_type = ["content","style","ms"][np.argmax(1*[args.rotation_content,args.rotation_style,args.rotation_ms])]
-        latent_list[gen_type]["rotation_object_alpha"] = None
-        latent_list[gen_type]["rotation_object_beta"] = None
-        latent_list[gen_type]["rotation_spot"] = None
-    if args.hue: 
-        gen_type = ["content","style","ms"][np.argmax(1*[args.hue_content,args.hue_style,args.hue_ms])]
-        latent_list[gen_type]["object_hue"] = None
-        latent_list[gen_type]["back_hue"] = None
-        latent_list[gen_type]["spot_hue"] = None
+    for factor, keys in FACTOR_LATENTS.items():
+        if getattr(args, factor):
+            gen_type = ["content","style","ms"][np.argmax(1*[getattr(args, f"{factor}_{part}") for part in ["content","style","ms"]])]
+            latent_list[gen_type].update({k: None for k in keys})
 
     # create generative model
-    latent_spaces_list={}
-    params_marginal = {}
-    params_conditional = {}
-    for part in ["content","style","ms"]:
-        if part != "ms": idx_marg, idx_cond = ("normal" if args.continuous_marginal == "normal" else "uniform"), ("normal" if args.continuous_conditional == "normal" else "uniform")
-        else: idx_marg, idx_cond = "delta", "delta"
-        dist = {"normal": lambda space, mean, params, size, device: space.normal(mean, params["std"], size, device),
-                "uniform" : lambda space, mean, params, size, device: space.uniform(mean, params["a"], params["b"], size, device),
-                "multinomial" : lambda space, mean, params, size, device: space.multinomial(mean, params["classes"], size, weights=params["weights"], uniform=params["uniform"],device=device),
-                "delta":lambda space, mean, params, size, device: space.delta(size, device=device),}
-        
-        marginal, conditional = dist[idx_marg], dist[idx_cond]
-
-        for k in list(latent_list[part].keys()):
-            if k != "object":latent_list[part][k]=latent_spaces.LatentSpace(spaces.NBoxSpace(1,min_=args.min,max_=args.max),marginal,conditional)
-            else: latent_list[part][k]=latent_spaces.LatentSpace(
-                                    spaces.NBoxSpace(1,min_=args.min,max_=args.max),
-                                    lambda space, mean, params, size, device: space.multinomial(mean, params["classes"], size, weights=params["weights"], uniform=params["uniform"],device=device),
-                                    lambda space, mean, params, size, device: space.multinomial(mean, params["classes"], size, weights=params["weights"], uniform=params["uniform"],device=device))
-
-            nb_instances = 1 if ((k not in ["object","position_x","position_y","position_z","rotation_object_alpha","rotation_object_beta","object_hue"]) or (args.n_objects ==1)) else args.n_objects
-            for tmp_idx in range(nb_instances):
-                latent_spaces_list[k+"_object_"+str(tmp_idx)]=latent_list[part][k]
-                params_marginal[k+"_object_"+str(tmp_idx)]={"uniform":{"a":args.uniform_marginal_a,"b":args.uniform_marginal_b},
-                                        "normal":{"std":args.normal_marginal_std},
-                                        "multinomial":{"classes":args.n_objects,"uniform":True,"weights":None},
-                                        "delta":{}}[idx_marg if k != "object" else "multinomial"]
-                params_conditional[k+"_object_"+str(tmp_idx)]={"uniform":{"a":args.uniform_conditional_a if part=="content" else args.uniform_conditional_noise_a,"b":args.uniform_conditional_b if part=="content" else args.uniform_conditional_noise_b},
-                                        "normal":{"std":args.normal_conditional_std if part=="content" else args.normal_conditional_noise},
-                                        "multinomial":{"classes":args.multinomial_noise,"uniform":True,"weights":None},
-                                        "delta":{}}[idx_cond if k != "object" else "multinomial"]
+    latent_spaces_list, latent_blocks, params_marginal, params_conditional, design_columns = build_model(args, latent_list, object_dist, object_transition)
+    apply_design(args, params_marginal, design_columns)
 
     # reorder: depending on what's fixed: scene hue, scene rotation, object hue, object rotation, object position, object type
     s = latent_spaces.ProductLatentSpace(list(latent_spaces_list.values())) # add ordered list
@@ -134,71 +340,100 @@ def main():
     params_conditional={k:v for k,v in zip(np.arange(len(list(latent_spaces_list.values()))),list(params_conditional.values()))}
 
     # generating latents - causal dep or not
+    sampled_columns = list(latent_spaces_list.keys())
     if args.causal:
         raise NotImplementedError
     else:
-        raw_latents_view1 = s.sample_marginal(means=torch.zeros([args.n_pairs,len(latent_spaces_list)]),params=params_marginal,size=args.n_pairs, device="cpu")
-        raw_latents_view2 = pd.DataFrame(s.sample_conditional(means=raw_latents_view1,params=params_conditional,size=args.n_pairs, device="cpu").numpy(),columns=list(latent_spaces_list.keys()))
-        raw_latents_view1 = pd.DataFrame(raw_latents_view1.numpy(),columns=list(latent_spaces_list.keys()))
-
-    # add fixed variables 
-    columns=[]
-    fixed_values=[]
-    if not args.hue:
-        columns.extend(["spot_hue_object_0","back_hue_object_0"]+[f"object_hue_object_{k}" for k in range(args.n_objects)])
-        fixed_values.append(0.0*np.ones([args.n_pairs,1]))
-        fixed_values.append(1.0*np.ones([args.n_pairs,1]))
-        for _ in range(args.n_objects):fixed_values.append(-1.0*np.ones([args.n_pairs,1]))
-    if not args.rotation:
-        columns.extend([f"rotation_object_alpha_object_{k}" for k in range(args.n_objects)]+[f"rotation_object_beta_object_{k}" for k in range(args.n_objects)]+["rotation_spot_object_0"])
-        for _ in range(args.n_objects):fixed_values.append(1.0*np.ones([args.n_pairs,1]))
-        for _ in range(args.n_objects):fixed_values.append(-1.0*np.ones([args.n_pairs,1]))
-        for _ in range(args.n_objects):fixed_values.append(-0.5*np.ones([args.n_pairs,1]))
-    if not args.position:
-        columns.extend([f"position_x_object_{k}" for k in range(args.n_objects)]+[f"position_y_object_{k}" for k in range(args.n_objects)]+[f"position_z_object_{k}" for k in range(args.n_objects)])
-        for _ in range(3*args.n_objects):fixed_values.append(np.zeros([args.n_pairs,1]))
-    if not args.object: 
-        columns.extend([f"object_object_{k}" for k in range(args.n_objects)])
-        for _ in range(args.n_objects):fixed_values.append(np.zeros([args.n_pairs,1]))
-    columns, fixed_values = columns, np.asarray(fixed_values)
-    raw_latents_view1=pd.concat([raw_latents_view1,pd.DataFrame(fixed_values,columns)],axis=1)
-    raw_latents_view2=pd.concat([raw_latents_view2,pd.DataFrame(fixed_values,columns)],axis=1)
-
-    # reorder latents
-    static_list=[]
-    static_list.extend(["spot_hue_object_0","back_hue_object_0","rotation_spot_object_0"])
-    static_list.extend(list(filter(lambda x: x.startswith('object_hue'), list(latent_spaces_list.keys()))))
-    static_list.extend(list(filter(lambda x: x.startswith('rotation_object'), list(latent_spaces_list.keys()))))
-    static_list.extend(list(filter(lambda x: x.startswith('position'), list(latent_spaces_list.keys()))))
-    static_list.extend(list(filter(lambda x: x.startswith('object_object'), list(latent_spaces_list.keys()))))
-    raw_latents_view1=raw_latents_view1.reindex(columns=static_list)
-    raw_latents_view2=raw_latents_view2.reindex(columns=static_list)
-
-    # save raw latents 
-    np.save(os.path.join(args.output_folder, "m1","raw_latents.npy"), raw_latents_view1.to_numpy())
-    np.save(os.path.join(args.output_folder, "m2","raw_latents.npy"), raw_latents_view2.to_numpy())
-
-    # raw latents to latents: rotation
-    rot_cols = raw_latents_view1.filter(like='rotation')
-    raw_latents_view1[rot_cols.columns]=np.pi*rot_cols
-    rot_cols = raw_latents_view2.filter(like='rotation')
-    raw_latents_view2[rot_cols.columns]=np.pi*rot_cols
-
-    # raw latents to latents: hues      
-    hue_cols = raw_latents_view1.filter(like='hue')
-    raw_latents_view1[hue_cols.columns]=np.pi*hue_cols
-    hue_cols = raw_latents_view2.filter(like='hue')
-    raw_latents_view2[hue_cols.columns]=np.pi*hue_cols
-
-    # raw latents to latents: position     
-    pos_cols = raw_latents_view1.filter(like='position')
-    raw_latents_view1[pos_cols.columns]=2*pos_cols
-    pos_cols = raw_latents_view2.filter(like='position')
-    raw_latents_view2[pos_cols.columns]=2*pos_cols
-
-    # save Blender latents
-    np.save(os.path.join(args.output_folder, "m1","latents.npy"), raw_latents_view1.to_numpy())
-    np.save(os.path.join(args.output_folder, "m2","latents.npy"), raw_latents_view2.to_numpy())
+        sampled = draw_views(s, params_marginal, params_conditional, args.n_pairs, views, profiler)
+
+    # fixed variables are only stored as column values and materialized when writing
+    constants = fixed_constants([f for f in FACTOR_LATENTS if getattr(args, f)], args.n_objects)
+
+    # order of the columns: scene hue, scene rotation, object hue, object rotation, object position, object type
+    static_list = latent_io.default_columns(args.n_objects)
+    assert set(sampled_columns) <= set(static_list)
+    blocks = [latent_blocks.get(c, "fixed") for c in static_list]
+    blender_scale = [latent_io.BLENDER_SCALE.get(latent_io.column_factor(c), 1.0) for c in static_list]
+
+    # samples that would waste a render, with objects out of frame or intersecting, are redrawn or dropped
+    columns = latent_io.column_indices({"columns": static_list})
+    radii = placement.load_radii(args.radii, default=args.object_radius)
+    checks = {}
+    if args.camera is not None:
+        cam = camera.load_camera(args.camera)
+        checks["out of frame"] = lambda latents, r: ~camera.frame_mask(cam, latents, columns, args.n_objects, r, args.frame_margin)
+    if args.no_overlap:
+        checks["with intersecting objects"] = lambda latents, r: placement.collisions(camera.object_centers(latents, columns, args.n_objects), r)
+    if checks:
+        with profiler.stage("validity checks"):
+            def invalid(sampled, report=False):
+                bad = np.zeros(len(sampled[views[0]]), dtype=bool)
+                for view in views:
+                    latents = latent_io.assemble_columns(static_list, sampled[view], sampled_columns, constants, scale=blender_scale)
+                    r = placement.object_radii(latents, columns, args.n_objects, radii)
+                    for name, check in checks.items():
+                        failed = check(latents, r)
+                        if report:
+                            print(f"{view}: {failed.sum()} / {len(failed)} samples {name}")
+                        bad |= failed
+                return bad
+            bad = np.flatnonzero(invalid(sampled, report=True))
+            if args.invalid_policy == "reject":
+                keep = np.setdiff1d(np.arange(args.n_pairs), bad)
+                sampled = {view: x[keep] for view, x in sampled.items()}
+            else:
+                # only the invalid rows are redrawn, i.i.d.: the points of a marginal design are only used once
+                params_iid = {k: {name: v for name, v in p.items() if name != "unit"} for k, p in params_marginal.items()}
+                for _ in range(MAX_RESAMPLING):
+                    if len(bad) == 0:
+                        break
+                    redrawn = draw_views(s, params_iid, params_conditional, len(bad), views)
+                    for view in views:
+                        sampled[view][bad] = redrawn[view]
+                    bad = bad[invalid(redrawn)]
+                if len(bad):
+                    raise RuntimeError(f"{len(bad)} samples still invalid after {MAX_RESAMPLING} redraws; check the camera and the radii")
+    shape = (len(sampled[views[0]]), len(static_list))
+
+    # concatenation of the fixed columns, reindexing and scaling are fused in assemble_columns
+    for view in views:
+        folder = os.path.join(args.output_folder, view)
+        with profiler.stage("assemble"):
+            if args.storage == "compact":
+                # compact storage: Blender latents are derived from the quantized raw latents on read
+                raw = latent_io.assemble_columns(static_list, sampled[view], sampled_columns, constants)
+            else:
+                raw = np.lib.format.open_memmap(os.path.join(folder, "raw_latents.npy"), mode="w+", dtype=np.float32, shape=shape)
+                latent_io.assemble_columns(static_list, sampled[view], sampled_columns, constants, out=raw)
+                raw.flush()
+
+        # Blender latents are a per-column scaling of the raw latents: latent_io.LatentDataset
+        # derives them on read if they are not written
+        if args.storage != "compact" and not args.no_blender_latents:
+            with profiler.stage("scale"):
+                latents = np.lib.format.open_memmap(os.path.join(folder, "latents.npy"), mode="w+", dtype=np.float32, shape=shape)
+                latent_io.assemble_columns(static_list, sampled[view], sampled_columns, constants, scale=blender_scale, out=latents)
+                latents.flush()
+                del latents
+
+        with profiler.stage("save"):
+            # sidecar header so that consumers can open the dataset without scanning it
+            metadata = latent_io.build_metadata(raw, static_list, args.n_objects, blocks=blocks, constants=constants,
+                                                view=view, views=views, seed=torch.initial_seed(), args=vars(args))
+            if args.storage == "compact":
+                latent_io.save_compact(folder, raw, metadata)
+            del raw
+            latent_io.save_metadata(folder, metadata)
+    save_profile(args, profiler)
+
+
+def save_profile(args, profiler):
+    """Print the memory profile and write it to --profile-memory, if enabled."""
+
+    if args.profile_memory is None:
+        return
+    print(profiler.report())
+    profiler.save(args.profile_memory, n_pairs=args.n_pairs, n_views=args.n_views, args=vars(args))
 
 if __name__ == "__main__":
     main()
@@ -8,6 +8,9 @@ import spaces
 import latent_spaces
 import argparse
 import spaces_utils
+import latent_io
+import memory_profile
+import torch
 
 
 def main():
@@ -33,6 +36,9 @@ def main():
     parser.add_argument("--first_content", action="store_true")
     parser.add_argument("--strength_dependencies",default=0.5,type=float)
     parser.add_argument("--std",default=1.0,type=float)
+    parser.add_argument("--seed", default=None, type=int)
+    parser.add_argument("--profile-memory", default=None, type=str,
+                        help="JSON file to write the time and peak memory of every stage to, see memory_profile.py")
 
     args = parser.parse_args()
 
@@ -41,8 +47,16 @@ def main():
     assert not (
         args.position_only and args.rotation_and_color_only
     ), "Only either position-only or rotation-and-color-only can be set"
+    if args.deterministic and not args.non_periodic_rotation_and_color:
+        parser.error("--deterministic pairs are only defined for --non-periodic-rotation-and-color, "
+                     "the latents on the sphere have no conditional")
+
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+        np.random.seed(args.seed)
 
     os.makedirs(args.output_folder, exist_ok=True)
+    profiler = memory_profile.StageProfiler(enabled=args.profile_memory is not None)
 
     """
     render internally assumes the variables form these value ranges:
@@ -72,13 +86,13 @@ def main():
                 [
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(n_non_angular_variables + n_angular_variables-3),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(3,min_=-1.0,max_=1.0),   # original -0.25, 0.25
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                     ),
                 ]
             )
@@ -86,13 +100,13 @@ def main():
             s = latent_spaces.ProductLatentSpace(
                 [   latent_spaces.LatentSpace(
                         spaces.NBoxSpace(3,min_=-1.0,max_=1.0),   # original -0.25, 0.25
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(n_non_angular_variables + n_angular_variables-3),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                     ),
                 ]
             )
@@ -103,57 +117,57 @@ def main():
                         # Positions
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # Rotations
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),                        
                         ##### rotation angle fixed here
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         # spotlight position
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         # Hues
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                     ]
                 )
@@ -163,58 +177,58 @@ def main():
                         # Positions
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         # Rotations
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),                        
                         ##### rotation angle fixed here
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
 
                         # spotlight position
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # Hues
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                     ]
                 )
@@ -225,57 +239,57 @@ def main():
                         # Positions 
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device),
                         ),                    
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         # Rotations
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),                        
                         ##### rotation angle fixed here
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # spotlight position
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # Hues
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                     ]
                 )
@@ -285,57 +299,57 @@ def main():
                         # Positions 
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device),
                         ),                    
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         # Rotations
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),                        
                         ##### rotation angle fixed here
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         # spotlight position
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         # Hues
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                     ]
                 )
@@ -345,54 +359,54 @@ def main():
                     [
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
                         ),
                         # removed second rotation
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                     ]
                 )
@@ -401,54 +415,54 @@ def main():
                     [
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean,std,size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean,params,size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
                         ),
                         # removed second rotation
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, mean, std, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                     ]
                 )
@@ -460,47 +474,47 @@ def main():
                         # Positions 
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.uniform(size, device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device),
                         ),                    
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         # Rotations
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),                        
                         ##### rotation angle fixed here
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.delta(size, device=device),
-                            lambda space, mean, std, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
+                            lambda space, mean, params, size, device: space.delta(size, device=device),
                         ),
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # spotlight position
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(1),
-                            lambda space, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                         ),
                         # Hues
                         latent_spaces.LatentSpace(
                             spaces.NBoxSpace(3),
-                            lambda space, size, device: space.uniform(size, device=device),
-                            lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                            lambda space, mean, params, size, device: space.uniform(size, device=device),
+                            lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                         ),
                     ]
                 )
@@ -509,28 +523,28 @@ def main():
             #     [
             #         latent_spaces.LatentSpace(
             #             spaces.NBoxSpace(3),
-            #             lambda space, size, device: space.uniform(size, device=device),
-            #             lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+            #             lambda space, mean, params, size, device: space.uniform(size, device=device),
+            #             lambda space, mean, params, size, device: space.normal(mean, params, size, device),
             #         ),
             #         latent_spaces.LatentSpace(
             #             spaces.NBoxSpace(n_non_angular_variables + n_angular_variables-3-3),
-            #             lambda space, size, device: space.uniform(size, device=device),
-            #             lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+            #             lambda space, mean, params, size, device: space.uniform(size, device=device),
+            #             lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
             #         ),
             #         latent_spaces.LatentSpace(
             #             spaces.NBoxSpace(1),
-            #             lambda space, size, device: space.uniform(size, device=device),
-            #             lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+            #             lambda space, mean, params, size, device: space.uniform(size, device=device),
+            #             lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
             #         ),
             #         latent_spaces.LatentSpace(
             #             spaces.NBoxSpace(1),
-            #             lambda space, size, device: space.uniform(size, device=device),
-            #             lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+            #             lambda space, mean, params, size, device: space.uniform(size, device=device),
+            #             lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
             #         ),
             #         latent_spaces.LatentSpace(
             #             spaces.NBoxSpace(1),
-            #             lambda space, size, device: space.uniform(size, device=device),
-            #             lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+            #             lambda space, mean, params, size, device: space.uniform(size, device=device),
+            #             lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
             #         ),
             #     ]
             # )
@@ -541,28 +555,28 @@ def main():
                 [
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(3),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(n_non_angular_variables + n_angular_variables-3-3),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.trunc_normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.trunc_normal(mean, params, size, device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(1),
-                        lambda space, size, device: space.delta(size, device=device),
-                        lambda space, mean, std, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.delta(size, device=device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(1),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.normal(mean, std, size, device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.normal(mean, params, size, device),
                     ),
                     latent_spaces.LatentSpace(
                         spaces.NBoxSpace(1),
-                        lambda space, size, device: space.uniform(size, device=device),
-                        lambda space, mean, std, size, device: space.delta(size, device=device),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        lambda space, mean, params, size, device: space.delta(size, device=device),
                     ),
                 ]
             )
@@ -570,10 +584,14 @@ def main():
 
 
         else:
-            s = latent_spaces.LatentSpace(
-                spaces.NBoxSpace(n_non_angular_variables + n_angular_variables),
-                lambda space, size, device: space.uniform(size, device=device),
-                None,
+            s = latent_spaces.ProductLatentSpace(
+                [
+                    latent_spaces.LatentSpace(
+                        spaces.NBoxSpace(n_non_angular_variables + n_angular_variables),
+                        lambda space, mean, params, size, device: space.uniform(size, device=device),
+                        None,
+                    ),
+                ]
             )
             
 
@@ -582,89 +600,74 @@ def main():
             [
                 latent_spaces.LatentSpace(
                     spaces.NBoxSpace(n_non_angular_variables),
-                    lambda space, size, device: space.uniform(size, device=device),
+                    lambda space, mean, params, size, device: space.uniform(size, device=device),
                     None,
                 ),
                 latent_spaces.LatentSpace(
                     spaces.NSphereSpace(n_angular_variables + 1),
-                    lambda space, size, device: space.uniform(size, device=device),
+                    lambda space, mean, params, size, device: space.uniform(size, device=device),
                     None,
                 ),
             ]
         )
 
-    if args.deterministic: 
-        if args.mi:
-            raw_latents_view1 = s.sample_marginal(int(args.n_points/2), device="cpu")
-            raw_latents_view2 = s.sample_conditional(raw_latents_view1,[0.0,1.0], size=int(args.n_points/2), device="cpu").numpy()   # [1.0,0.5] for mi originally 
-            raw_latents_view1 = raw_latents_view1.numpy()
-            #if args.all_hues: 
-            #    raw_latents_view2[:7] = raw_latents_view1[:7]
-            #else: raise("Other data augmentations are not yet supported")
-
-            raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-        elif args.basic:
-            raw_latents_view1 = s.sample_marginal(int(args.n_points/2), device="cpu")
-            raw_latents_view2 = s.sample_conditional(raw_latents_view1,[1.0,0.0], size=int(args.n_points/2), device="cpu").numpy()   # [1.0,0.5] for mi originally 
-            raw_latents_view1 = raw_latents_view1.numpy()
-            #if args.all_hues: 
-            #    raw_latents_view2[:7] = raw_latents_view1[:7]
-            #else: raise("Other data augmentations are not yet supported")
-
-            raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-
-        elif args.multimodal and args.all_hues:
-            if args.first_content:
-                raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,None,None,None,args.strength_dependencies,args.strength_dependencies,None,None,None],int(args.n_points/2), device="cpu",ms="hues")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[0.0,0.0,0.0,args.std,None,args.std,args.std,None,None,None], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-            else:
-                raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,args.strength_dependencies,None,None,args.strength_dependencies,None,None,None,None],int(args.n_points/2), device="cpu",ms="hues")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[args.std,args.std,args.std,0.0,None,0.0,0.0,None,None,None], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                print(raw_latents_view1.shape,raw_latents_view2.shape)
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-
+    conditional_std = None
+    n_view = int(args.n_points/2)
+    if args.deterministic:
+        with profiler.stage("sample marginal"):
+            if args.mi:
+                raw_latents_view1 = sample_marginal(s, n_view)
+                conditional_std = [0.0,1.0]   # [1.0,0.5] for mi originally
+            elif args.basic:
+                raw_latents_view1 = sample_marginal(s, n_view)
+                conditional_std = [1.0,0.0]
+
+            elif args.multimodal and args.all_hues:
+                if args.first_content:
+                    raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,None,None,None,args.strength_dependencies,args.strength_dependencies,None,None,None],n_view, device="cpu",ms="hues")
+                    conditional_std = [0.0,0.0,0.0,args.std,None,args.std,args.std,None,None,None]
+                else:
+                    raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,args.strength_dependencies,None,None,args.strength_dependencies,None,None,None,None],n_view, device="cpu",ms="hues")
+                    conditional_std = [args.std,args.std,args.std,0.0,None,0.0,0.0,None,None,None]
+
+            elif args.multimodal and args.all_positions:
+                if args.first_content:
+                    raw_latents_view1 = s.sample_marginal_causal([None,None,None,None,None,args.strength_dependencies,None,args.strength_dependencies,None,args.strength_dependencies],n_view, device="cpu",ms="positions")
+                    conditional_std = [None,None,None,0.0,None,0.0,0.0,args.std,args.std,args.std]
+                else:
+                    raw_latents_view1 = s.sample_marginal_causal([None,None,None,None,None,args.strength_dependencies,args.strength_dependencies,args.strength_dependencies,None,None],n_view, device="cpu",ms="positions")
+                    conditional_std = [None,None,None,args.std,None,args.std,args.std,0.0,0.0,0.0]
+
+            elif args.multimodal and args.all_rotations:
+                if args.first_content:
+                    raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,None,None,None,None,None,args.strength_dependencies,None,args.strength_dependencies],n_view, device="cpu",ms="rotations")
+                    conditional_std = [0.0,0.0,0.0,None,None,None,None,args.std,args.std,args.std]
+                else:
+                    raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,args.strength_dependencies,None,None,None,None,args.strength_dependencies,None,None],n_view, device="cpu",ms="rotations")
+                    conditional_std = [args.std,args.std,args.std,None,None,None,None,0.0,0.0,0.0]
 
-        elif args.multimodal and args.all_positions:
-            if args.first_content:
-                raw_latents_view1 = s.sample_marginal_causal([None,None,None,None,None,args.strength_dependencies,None,args.strength_dependencies,None,args.strength_dependencies],int(args.n_points/2), device="cpu",ms="positions")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[None,None,None,0.0,None,0.0,0.0,args.std,args.std,args.std], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-            else:
-                raw_latents_view1 = s.sample_marginal_causal([None,None,None,None,None,args.strength_dependencies,args.strength_dependencies,args.strength_dependencies,None,None],int(args.n_points/2), device="cpu",ms="positions")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[None,None,None,args.std,None,args.std,args.std,0.0,0.0,0.0], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0) 
+            elif args.debug:
+                raw_latents_view1 = sample_marginal(s, n_view)
+                conditional_std = [None,None,None,None,None,0.0,0.0,args.std]
 
+            elif args.debug2:
+                raw_latents_view1 = sample_marginal(s, n_view)
+                conditional_std = [1.0,0.2,None,0.2,None]
 
-        elif args.multimodal and args.all_rotations:
-            if args.first_content:
-                raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,None,None,None,None,None,args.strength_dependencies,None,args.strength_dependencies],int(args.n_points/2), device="cpu",ms="rotations")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[0.0,0.0,0.0,None,None,None,None,args.std,args.std,args.std], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
             else:
-                raw_latents_view1 = s.sample_marginal_causal([args.strength_dependencies,None,args.strength_dependencies,None,None,None,None,args.strength_dependencies,None,None],int(args.n_points/2), device="cpu",ms="rotations")
-                raw_latents_view2 = s.sample_conditional(raw_latents_view1,[args.std,args.std,args.std,None,None,None,None,0.0,0.0,0.0], size=int(args.n_points/2), device="cpu").numpy()
-                raw_latents_view1 = raw_latents_view1.numpy()
-                raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
+                raise NotImplementedError("--deterministic needs one of --mi, --basic, --multimodal, --debug or --debug2")
 
-        elif args.debug:
-            raw_latents_view1 = s.sample_marginal(int(args.n_points/2), device="cpu")
-            raw_latents_view2 = s.sample_conditional(raw_latents_view1,[None,None,None,None,None,0.0,0.0,args.std], size=int(args.n_points/2), device="cpu").numpy()
-            raw_latents_view1 = raw_latents_view1.numpy()
-            raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-        
-        elif args.debug2:
-            raw_latents_view1 = s.sample_marginal(int(args.n_points/2), device="cpu")
-            raw_latents_view2 = s.sample_conditional(raw_latents_view1,[1.0,0.2,None,0.2,None], size=int(args.n_points/2), device="cpu").numpy()
+        with profiler.stage("sample conditional"):
+            raw_latents_view2 = s.sample_conditional(raw_latents_view1,conditional_std, size=n_view, device="cpu").numpy()
             raw_latents_view1 = raw_latents_view1.numpy()
+
+        # both views are stored back to back, and only the copy is kept
+        with profiler.stage("append views"):
             raw_latents = np.append(raw_latents_view1,raw_latents_view2,0)
-         
-        else: raw_latents = s.sample_marginal(args.n_points, device="cpu").numpy()
+            del raw_latents_view1, raw_latents_view2
+    else:
+        with profiler.stage("sample marginal"):
+            raw_latents = sample_marginal(s, args.n_points).numpy()
 
     if args.position_only or args.rotation_and_color_only:
         assert args.n_objects == 1, "Only one object is supported for fixed variables"
@@ -691,27 +694,18 @@ def main():
 
 
         # the raw latents will later be used for the sampling process
-        if args.deterministic:
-            if args.all_hues:
-                np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.all_positions:
-                np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.all_rotations:
-                np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.debug:
-                np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.debug2:
-                np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            else:raise("Other data augmentations are not yet supported")
-        else:np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-
-        # get rotation and color latents from large vector
-        rotation_and_color_latents = raw_latents[:, n_non_angular_variables:]
-        rotation_and_color_latents *= np.pi #/2
-
-        # could change this
-        position_latents = raw_latents[:, :n_non_angular_variables]
-        position_latents *= 2   
+        with profiler.stage("save raw"):
+            np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
+            metadata = causal_metadata(args, s, raw_latents, conditional_std)
+
+        with profiler.stage("scale"):
+            # get rotation and color latents from large vector
+            rotation_and_color_latents = raw_latents[:, n_non_angular_variables:]
+            rotation_and_color_latents *= np.pi #/2
+
+            # could change this
+            position_latents = raw_latents[:, :n_non_angular_variables]
+            position_latents *= 2
     else:
         if args.position_only:
             spherical_fixed_angular_variables = np.array(
@@ -725,55 +719,141 @@ def main():
             fixed_non_angular_variables = np.array([0, 0, 0])
             raw_latents[:, :n_non_angular_variables] = fixed_non_angular_variables
 
-        if args.deterministic:
-            if args.all_hues:np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.all_positions:np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.all_rotations:np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.debug: np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            elif args.debug2: np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-            else:raise("Other data augmentations are not yet supported")
-        else:np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
-
-        # convert angular latents from cartesian to angular representation
-        rotation_and_color_latents = spaces_utils.cartesian_to_spherical(
-            raw_latents[:, n_non_angular_variables:]
-        )[1]
-        # map all but the last latent from [0,pi] to [0, 2pi]
-        rotation_and_color_latents[:, :-1] *= 2
-
-        position_latents = raw_latents[:, :n_non_angular_variables]
-        # map z coordinate from -1,+1 to 0,+1
-        position_latents[:, 2:n_non_angular_variables:3] = (
-            position_latents[:, 2:n_non_angular_variables:3] + 1
-        ) / 2.0
-        position_latents *= 3
-
-    latents = np.concatenate((position_latents, rotation_and_color_latents), 1)
-
-    reordered_transposed_latents = []
-    for n in range(args.n_objects):
-        reordered_transposed_latents.append(latents.T[n * 3 : n * 3 + 3])
-        reordered_transposed_latents.append(latents.T[n_non_angular_variables + n * 6 : n_non_angular_variables + n * 6 + 6])
-
-    reordered_transposed_latents.append(latents.T[-1].reshape(1, -1))
-    reordered_latents = np.concatenate(reordered_transposed_latents, 0).T
+        with profiler.stage("save raw"):
+            np.save(os.path.join(args.output_folder, "raw_latents.npy"), raw_latents)
+            metadata = causal_metadata(args, s, raw_latents, conditional_std)
+
+        with profiler.stage("scale"):
+            # convert angular latents from cartesian to angular representation
+            rotation_and_color_latents = spaces_utils.cartesian_to_spherical(
+                raw_latents[:, n_non_angular_variables:]
+            )[1]
+            # map all but the last latent from [0,pi] to [0, 2pi]
+            rotation_and_color_latents[:, :-1] *= 2
+
+            position_latents = raw_latents[:, :n_non_angular_variables]
+            # map z coordinate from -1,+1 to 0,+1
+            position_latents[:, 2:n_non_angular_variables:3] = (
+                position_latents[:, 2:n_non_angular_variables:3] + 1
+            ) / 2.0
+            position_latents *= 3
+
+    with profiler.stage("assemble"):
+        latents = np.concatenate((position_latents, rotation_and_color_latents), 1)
+
+        reordered_transposed_latents = []
+        for n in range(args.n_objects):
+            reordered_transposed_latents.append(latents.T[n * 3 : n * 3 + 3])
+            reordered_transposed_latents.append(latents.T[n_non_angular_variables + n * 6 : n_non_angular_variables + n * 6 + 6])
+
+        reordered_transposed_latents.append(latents.T[-1].reshape(1, -1))
+        reordered_latents = np.concatenate(reordered_transposed_latents, 0).T
 
     # the latents will be used by the rendering process to generate the images
-    if args.deterministic:
-        if args.all_hues:
-            np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
-        elif args.all_positions:
-            np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
-        elif args.all_rotations:
-            np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
-        elif args.debug: 
-            np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
-        elif args.debug2: 
-            np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
-        else:raise("Other data augmentations are not yet supported")
-    else:np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
+    with profiler.stage("save"):
+        np.save(os.path.join(args.output_folder, "latents.npy"), reordered_latents)
+        latent_io.save_metadata(args.output_folder, add_latent_schema(args, metadata, reordered_latents))
 
     print('Size of the latents', reordered_latents.shape)
+    save_profile(args, profiler)
+
+
+def save_profile(args, profiler):
+    """Print the memory profile and write it to --profile-memory, if enabled."""
+
+    if args.profile_memory is None:
+        return
+    print(profiler.report())
+    # rows per view, which are all the rows without --deterministic
+    n_pairs = int(args.n_points/2) if args.deterministic else args.n_points
+    profiler.save(args.profile_memory, n_pairs=n_pairs, n_points=args.n_points, args=vars(args))
+
+
+def sample_marginal(s, size):
+    """Marginal samples of a product of latent spaces whose marginals take no means or parameters."""
+
+    means = torch.zeros([1, s.dim]).expand(size, -1)
+    return s.sample_marginal(means=means, params=[None] * len(s.spaces), size=size, device="cpu")
+
+
+def causal_metadata(args, s, raw_latents, conditional_std):
+    """Sidecar header of raw_latents.npy, which holds both views back to back if deterministic.
+
+    The raw latents have a layout of their own, recorded as ``raw_columns`` and
+    ``raw_schema``; the columns of latents.npy are added by ``add_latent_schema``.
+    """
+
+    n_angular_variables = args.n_objects * 6 + 1
+    n_non_angular_variables = args.n_objects * 3
+    raw_columns, _, order = causal_columns(args.n_objects, args.non_periodic_rotation_and_color)
+
+    blocks = None
+    if conditional_std is not None:
+        blocks = []
+        for std, space in zip(conditional_std, s.spaces):
+            block = "ms" if std is None else ("content" if std == 0.0 else "style")
+            blocks.extend([block] * space.dim)
+        if len(blocks) != len(raw_columns):
+            blocks = None
+
+    n_view = int(args.n_points/2)
+    views = {"m1": [0, n_view], "m2": [n_view, 2 * n_view]} if args.deterministic else None
+    if args.non_periodic_rotation_and_color:
+        scales = [2.0] * n_non_angular_variables + [np.pi] * n_angular_variables
+    else:
+        scales = [None] * len(raw_columns)
+
+    metadata = latent_io.build_metadata(
+        raw_latents, raw_columns, args.n_objects,
+        blocks=blocks, scales=scales, latent_order=order, views=views,
+        seed=torch.initial_seed(), args=vars(args),
+    )
+    metadata["raw_columns"] = metadata.pop("columns")
+    metadata["raw_schema"] = metadata.pop("schema")
+    return metadata
+
+
+def add_latent_schema(args, metadata, latents):
+    """Describe the columns of latents.npy, reordered and on the Blender support, in the header."""
+
+    _, latent_columns, order = causal_columns(args.n_objects, args.non_periodic_rotation_and_color)
+    raw_blocks = [c["block"] for c in metadata["raw_schema"]]
+    blocks = [None if i is None else raw_blocks[i] for i in order]
+    metadata["columns"] = latent_columns
+    metadata["schema"] = latent_io.build_schema(latents, latent_columns, blocks=blocks, scales=[1.0] * len(latent_columns))
+    return metadata
+
+
+def causal_columns(n_objects, non_periodic):
+    """Names of the columns of raw_latents.npy and latents.npy written by this script.
+
+    Returns the raw column names, the latent column names and, for each latent
+    column, the index of the raw column it is derived from. Angles converted
+    from the coordinates on the sphere depend on all of them and have no index.
+    """
+
+    positions, angles = [], []
+    for k in range(n_objects):
+        positions.extend([f"position_{axis}_object_{k}" for axis in ["x", "y", "z"]])
+        angles.extend([f"rotation_object_{angle}_object_{k}" for angle in ["alpha", "beta", "gamma"]])
+        angles.extend([f"rotation_spot_object_{k}", f"object_hue_object_{k}", f"spot_hue_object_{k}"])
+    angles.append("back_hue_object_0")
+
+    latent_columns = positions + angles
+    if non_periodic:
+        raw_columns = list(latent_columns)
+    else:
+        raw_columns = positions + [f"sphere_{k}" for k in range(len(angles) + 1)]
+
+    # same reordering as applied to the latents before saving
+    order = []
+    n_positions = len(positions)
+    for k in range(n_objects):
+        order.extend(range(k * 3, k * 3 + 3))
+        order.extend(range(n_positions + k * 6, n_positions + k * 6 + 6))
+    order.append(len(latent_columns) - 1)
+    raw_order = order if non_periodic else [i if i < n_positions else None for i in order]
+    return raw_columns, [latent_columns[i] for i in order], raw_order
 
 
 if __name__ == "__main__":
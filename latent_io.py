@@ -0,0 +1,559 @@
+"""Reading and writing of latent files and their sidecar metadata.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import json
+import os
+import numpy as np
+
+METADATA_FILENAME = "latents_meta.json"
+METADATA_VERSION = 1
+
+# latents on the raw support, and on the Blender support read by the renderer
+RAW_LATENTS_FILENAME = "raw_latents.npy"
+LATENTS_FILENAME = "latents.npy"
+
+# files of the compact storage format
+COMPACT_CONTINUOUS_FILENAME = "raw_latents_q16.npy"
+COMPACT_CATEGORICAL_FILENAME = "raw_latents_cat.npy"
+# folder of the columns shared by dataset variants generated together
+COLUMN_STORE_FOLDER = "columns"
+INT16_LEVELS = 32767
+CHUNK_SIZE = 1000000
+
+# factor by which each raw latent in [-1, 1] is scaled to its Blender support
+BLENDER_SCALE = {"hue": np.pi, "rotation": np.pi, "position": 2.0, "object": 1.0}
+
+# shapes rendered for each value of an object column
+SHAPE_NAMES = ["Teapot", "Armardillo", "Bunny", "Cow", "Dragon", "Head", "Horse", "Spot"]
+
+
+def column_factor(name):
+    """Return the information block ("hue", "rotation", "position" or "object") of a column."""
+
+    if name.startswith("object_object"):
+        return "object"
+    for factor in ["hue", "rotation", "position"]:
+        if factor in name:
+            return factor
+    return None
+
+
+def column_object(name):
+    """Return the index of the object a column belongs to (0 for scene-level factors)."""
+
+    suffix = name.rsplit("_object_", 1)
+    return int(suffix[1]) if len(suffix) == 2 and suffix[1].isdigit() else 0
+
+
+def default_columns(n_objects):
+    """Column layout written by generate_clevr_dataset_latents.py for all factors."""
+
+    objects = range(n_objects)
+    columns = ["spot_hue_object_0", "back_hue_object_0", "rotation_spot_object_0"]
+    columns.extend([f"object_hue_object_{k}" for k in objects])
+    columns.extend([f"rotation_object_alpha_object_{k}" for k in objects])
+    columns.extend([f"rotation_object_beta_object_{k}" for k in objects])
+    for axis in ["x", "y", "z"]:
+        columns.extend([f"position_{axis}_object_{k}" for k in objects])
+    columns.extend([f"object_object_{k}" for k in objects])
+    return columns
+
+
+def view_name(k):
+    """Folder name of the k-th view (0-based): m1, m2, ..."""
+    return f"m{k + 1}"
+
+
+def view_names(folder):
+    """Names of the view folders m1..mK found in a dataset folder, in view order."""
+
+    if not os.path.isdir(folder):
+        return []
+    names = [name for name in os.listdir(folder)
+             if name[:1] == "m" and name[1:].isdigit() and os.path.isdir(os.path.join(folder, name))]
+    return sorted(names, key=lambda name: int(name[1:]))
+
+
+def view_folders(root, view):
+    """Return the image and latent folders of a view, in the layout of the generation scripts or of the released datasets."""
+
+    if os.path.isdir(os.path.join(root, "samples", view)):
+        return os.path.join(root, "samples", view), os.path.join(root, "factors", view)
+    return os.path.join(root, view, "images"), os.path.join(root, view)
+
+
+def image_filename(idx):
+    return f"{str(idx).zfill(6)}.png"
+
+
+def column_ranges(latents, chunk_size=CHUNK_SIZE):
+    """Minimum and maximum of every column, read in chunks of rows."""
+
+    n_columns = latents.shape[1]
+    low, high = np.full(n_columns, np.nan), np.full(n_columns, np.nan)
+    for start in range(0, len(latents), chunk_size):
+        chunk = np.asarray(latents[start : start + chunk_size])
+        low = np.fmin(low, chunk.min(axis=0))
+        high = np.fmax(high, chunk.max(axis=0))
+    return low, high
+
+
+def build_schema(latents, columns, blocks=None, scales=None, constants=None):
+    """Describe every column of a raw latent matrix.
+
+    Args:
+        latents: Array-like of shape (n_samples, n_columns), read in chunks of rows.
+        columns: Name of each column.
+        blocks: Block type of each column ("content", "style", "ms" or
+            "fixed"), or None if unknown.
+        scales: Factor mapping each raw column to its Blender support. Taken
+            from ``BLENDER_SCALE`` if None; an entry of None marks a
+            non-linear transform.
+        constants: Value of the columns that are fixed for all samples.
+    """
+
+    assert latents.shape[1] == len(columns)
+    if constants is None:
+        constants = {}
+    if blocks is None:
+        blocks = [None] * len(columns)
+    if scales is None:
+        scales = [BLENDER_SCALE.get(column_factor(c), 1.0) for c in columns]
+
+    low, high = column_ranges(latents)
+
+    schema = []
+    for i, name in enumerate(columns):
+        factor = column_factor(name)
+        schema.append(
+            {
+                "name": name,
+                "factor": factor,
+                "object": column_object(name),
+                "block": blocks[i],
+                "categorical": factor == "object",
+                "range": [float(low[i]), float(high[i])],
+                "scale": None if scales[i] is None else float(scales[i]),
+                "constant": constants.get(name),
+            }
+        )
+    return schema
+
+
+def assemble_columns(columns, sampled, sampled_columns, constants, scale=None, out=None, chunk_size=CHUNK_SIZE):
+    """Assemble the full latent matrix from sampled and constant columns.
+
+    Constant columns are only described by their value and are filled in
+    chunk by chunk, so no per-column array is ever allocated for them.
+
+    Args:
+        columns: Names of the columns of the result, in order.
+        sampled: Array of shape (n_samples, len(sampled_columns)).
+        sampled_columns: Name of each column of ``sampled``.
+        constants: Value of every column that is not sampled.
+        scale: Optional per-column factor applied to the result.
+        out: Buffer of shape (n_samples, len(columns)) to write to, e.g. a
+            memory map opened with ``np.lib.format.open_memmap``. A float32
+            array is allocated if None.
+        chunk_size: Number of rows assembled at once.
+    """
+
+    n = len(sampled)
+    if out is None:
+        out = np.empty((n, len(columns)), dtype=np.float32)
+    sampled_pos = [j for j, c in enumerate(columns) if c in sampled_columns]
+    sampled_src = [sampled_columns.index(columns[j]) for j in sampled_pos]
+    constant_pos = [j for j, c in enumerate(columns) if c not in sampled_columns]
+    constant_values = np.array([constants[columns[j]] for j in constant_pos], dtype=out.dtype)
+    if scale is not None:
+        scale = np.asarray(scale, dtype=out.dtype)
+        constant_values = constant_values * scale[constant_pos]
+
+    for start in range(0, n, chunk_size):
+        block = out[start : start + chunk_size]
+        block[:, sampled_pos] = sampled[start : start + chunk_size][:, sampled_src]
+        if scale is not None:
+            block[:, sampled_pos] *= scale[sampled_pos]
+        block[:, constant_pos] = constant_values
+    return out
+
+
+def describe_file(path):
+    """Shape and dtype of a ``.npy`` file, read from its header only."""
+
+    array = np.load(path, mmap_mode="r")
+    return {"shape": list(array.shape), "dtype": str(array.dtype)}
+
+
+def build_metadata(latents, columns, n_objects, blocks=None, scales=None, constants=None, **info):
+    """Collect the sidecar header describing a raw latent matrix.
+
+    Args:
+        latents: Raw latents of shape (n_samples, n_columns).
+        columns: Name of each column of ``latents``.
+        n_objects: Number of objects per scene.
+        blocks: Block type of each column, see ``build_schema``.
+        scales: Raw to Blender scale of each column, see ``build_schema``.
+        constants: Value of the fixed columns, see ``build_schema``.
+        info: Additional entries to record, e.g. the seed and generation args.
+    """
+
+    schema = build_schema(latents, columns, blocks, scales, constants)
+    object_columns = [i for i, c in enumerate(schema) if c["categorical"]]
+    object_types = set()
+    if object_columns:
+        for start in range(0, len(latents), CHUNK_SIZE):
+            object_types.update(np.unique(np.asarray(latents[start : start + CHUNK_SIZE])[:, object_columns]).tolist())
+
+    metadata = {
+        "version": METADATA_VERSION,
+        "n_samples": int(latents.shape[0]),
+        "n_objects": int(n_objects),
+        "object_types": [int(t) for t in sorted(object_types)],
+        "columns": list(columns),
+        "schema": schema,
+    }
+    metadata.update(info)
+    return metadata
+
+
+def save_metadata(folder, metadata):
+    """Write the sidecar header of a folder, recording the ``.npy`` files it contains."""
+
+    files = {}
+    for fn in sorted(os.listdir(folder)):
+        if fn.endswith(".npy"):
+            files[fn] = describe_file(os.path.join(folder, fn))
+    for fn in [RAW_LATENTS_FILENAME, LATENTS_FILENAME]:
+        if fn in files and len(file_columns(metadata, fn)) != files[fn]["shape"][1]:
+            raise ValueError(f"The header of {folder} names {len(file_columns(metadata, fn))} columns "
+                             f"but {fn} has {files[fn]['shape'][1]}")
+    metadata = dict(metadata, files=files)
+    with open(os.path.join(folder, METADATA_FILENAME), "w") as f:
+        json.dump(metadata, f, indent=4)
+    return metadata
+
+
+def load_metadata(folder):
+    """Read the sidecar header of a latent folder, or None if it was not written."""
+
+    path = os.path.join(folder, METADATA_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def file_columns(metadata, filename=None):
+    """Names of the columns of a latent file, from the header of its folder.
+
+    ``columns`` describes ``latents.npy`` and, unless the header has
+    ``raw_columns`` for a layout of its own, ``raw_latents.npy``.
+    """
+
+    if filename == RAW_LATENTS_FILENAME and "raw_columns" in metadata:
+        return metadata["raw_columns"]
+    return metadata["columns"]
+
+
+def file_schema(metadata, filename=None):
+    """Schema of the columns of a latent file, see ``file_columns``."""
+
+    if filename == RAW_LATENTS_FILENAME and "raw_schema" in metadata:
+        return metadata["raw_schema"]
+    return metadata["schema"]
+
+
+def column_indices(metadata, n_columns=None, filename=LATENTS_FILENAME):
+    """Map column names to positions, from the header or the default layout.
+
+    Args:
+        metadata: Header of the folder, or None for the default layout.
+        n_columns: Number of columns of the file, checked against the header.
+        filename: File the positions refer to, see ``file_columns``.
+    """
+
+    if metadata is not None:
+        columns = file_columns(metadata, filename)
+        if n_columns is not None and len(columns) != n_columns:
+            raise ValueError(f"The header names {len(columns)} columns of {filename} but it has {n_columns}")
+    else:
+        columns = default_columns((n_columns - 3) // 7)
+    return {name: i for i, name in enumerate(columns)}
+
+
+def load_latents(folder, indices=None, blender=True):
+    """Memory-map the latents of a folder and read only the requested rows.
+
+    Args:
+        folder: Folder containing the latents.
+        indices: Row indices to read. The whole ``LatentDataset`` is
+            returned if None.
+        blender: Whether to return latents on the Blender support
+            (``latents.npy``) or on the raw support (``raw_latents.npy``).
+    """
+
+    latents = LatentDataset(folder, blender=blender)
+    if indices is None:
+        return latents
+    return read_rows(latents, indices)
+
+
+def read_rows(latents, indices):
+    """Copy the given rows of a memory-mapped latent array into memory."""
+
+    indices = np.asarray(indices)
+    if len(indices) == 0:
+        return np.empty((0, latents.shape[1]), dtype=latents.dtype)
+    if indices[-1] - indices[0] + 1 == len(indices) and np.all(np.diff(indices) == 1):
+        # contiguous batch: a single slice only touches the needed pages
+        return np.array(latents[indices[0] : indices[-1] + 1])
+    return np.asarray(latents[indices])
+
+
+def save_compact(folder, raw_latents, metadata, chunk_size=CHUNK_SIZE):
+    """Store raw latents in the compact format.
+
+    Continuous columns are quantized to int16 over their observed range and
+    categorical columns are stored losslessly as uint8. The quantization
+    parameters are added to the schema of ``metadata``, which is returned.
+
+    Args:
+        folder: Folder to write the latents to.
+        raw_latents: Raw latents of shape (n_samples, n_columns).
+        metadata: Header built with ``build_metadata`` for ``raw_latents``.
+        chunk_size: Number of rows converted at once.
+    """
+
+    schema = metadata["schema"]
+    continuous = [i for i, c in enumerate(schema) if not c["categorical"]]
+    categorical = [i for i, c in enumerate(schema) if c["categorical"]]
+
+    low = np.array([schema[i]["range"][0] for i in continuous], dtype=np.float64)
+    high = np.array([schema[i]["range"][1] for i in continuous], dtype=np.float64)
+    offset = (high + low) / 2
+    step = (high - low) / (2 * INT16_LEVELS)
+    step[step == 0] = 1.0
+
+    n = len(raw_latents)
+    q16 = np.lib.format.open_memmap(
+        os.path.join(folder, COMPACT_CONTINUOUS_FILENAME), mode="w+",
+        dtype=np.int16, shape=(n, len(continuous)),
+    )
+    cat = np.lib.format.open_memmap(
+        os.path.join(folder, COMPACT_CATEGORICAL_FILENAME), mode="w+",
+        dtype=np.uint8, shape=(n, len(categorical)),
+    )
+    for start in range(0, n, chunk_size):
+        chunk = raw_latents[start : start + chunk_size]
+        q16[start : start + len(chunk)] = np.rint((chunk[:, continuous] - offset) / step)
+        classes = chunk[:, categorical]
+        if np.any(classes != np.rint(classes)) or np.any(classes < 0) or np.any(classes > 255):
+            raise ValueError("Categorical latents must be integers in [0, 255]")
+        cat[start : start + len(chunk)] = classes
+    q16.flush()
+    cat.flush()
+    del q16, cat
+
+    for i, o, st in zip(continuous, offset, step):
+        schema[i]["quantization"] = {"offset": float(o), "step": float(st)}
+    metadata["storage"] = "compact"
+    return metadata
+
+
+class CompactLatents:
+    """Read-only, array-like access to latents stored with ``save_compact``.
+
+    Both files are memory-mapped and only the indexed rows are decoded to
+    float32. If ``blender`` is set, the per-column scale of the schema is
+    folded into the dequantization so that the Blender latents are returned
+    without a ``latents.npy`` file on disk.
+    """
+
+    def __init__(self, folder, metadata=None, blender=False):
+        if metadata is None:
+            metadata = load_metadata(folder)
+        self.folder = folder
+        self.metadata = metadata
+        self.blender = blender
+
+        schema = metadata["schema"]
+        self._continuous = [i for i, c in enumerate(schema) if not c["categorical"]]
+        self._categorical = [i for i, c in enumerate(schema) if c["categorical"]]
+        self._q16 = np.load(os.path.join(folder, COMPACT_CONTINUOUS_FILENAME), mmap_mode="r")
+        self._cat = np.load(os.path.join(folder, COMPACT_CATEGORICAL_FILENAME), mmap_mode="r")
+
+        scale = np.array(
+            [schema[i]["scale"] if blender else 1.0 for i in self._continuous], dtype=np.float32
+        )
+        self._offset = scale * np.array(
+            [schema[i]["quantization"]["offset"] for i in self._continuous], dtype=np.float32
+        )
+        self._step = scale * np.array(
+            [schema[i]["quantization"]["step"] for i in self._continuous], dtype=np.float32
+        )
+
+        self.shape = (len(self._q16), len(schema))
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        q16, cat = self._q16[rows], self._cat[rows]
+        result = np.empty(q16.shape[:-1] + (self.shape[1],), dtype=np.float32)
+        result[..., self._continuous] = q16 * self._step + self._offset
+        result[..., self._categorical] = cat
+        return result[..., cols]
+
+    def __array__(self, dtype=None, copy=None):
+        result = self[:]
+        return result if dtype is None else result.astype(dtype)
+
+
+class ColumnLatents:
+    """Read-only, array-like access to latents whose columns are stored in separate files.
+
+    Columns shared by several datasets, e.g. by dataset variants generated
+    from the same anchors, are stored once and referenced by every dataset.
+    Constant columns are not stored. Only the indexed rows of the
+    memory-mapped column files are read.
+
+    Args:
+        folder: Folder the column files are relative to.
+        columns: Name of each column.
+        column_files: Path of the ``.npy`` file of each column, None for a
+            constant column.
+        constants: Value of the constant columns.
+        n_samples: Number of rows.
+    """
+
+    def __init__(self, folder, columns, column_files, constants, n_samples):
+        self.folder = folder
+        self.columns = list(columns)
+        opened = {}
+        self._files = []
+        for fn in column_files:
+            if fn is not None and fn not in opened:
+                opened[fn] = np.load(os.path.join(folder, fn), mmap_mode="r")
+            self._files.append(None if fn is None else opened[fn])
+        self._constants = np.array(
+            [constants[c] if fn is None else np.nan for c, fn in zip(self.columns, column_files)], dtype=np.float32
+        )
+        self.shape = (int(n_samples), len(self.columns))
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        positions = np.arange(self.shape[1])[cols]
+        if isinstance(rows, slice):
+            row_shape = (len(range(*rows.indices(self.shape[0]))),)
+        else:
+            row_shape = np.shape(rows)
+        result = np.empty(row_shape + (np.size(positions),), dtype=np.float32)
+        for k, j in enumerate(np.atleast_1d(positions)):
+            result[..., k] = self._constants[j] if self._files[j] is None else self._files[j][rows]
+        return result[..., 0] if np.ndim(positions) == 0 else result
+
+    def __array__(self, dtype=None, copy=None):
+        result = self[:]
+        return result if dtype is None else result.astype(dtype)
+
+
+class LatentDataset:
+    """Read-only, array-like access to the latents of a folder.
+
+    Blender latents are read from ``latents.npy`` if it was written and are
+    otherwise derived from the memory-mapped ``raw_latents.npy`` by applying
+    the per-column scale of the schema to each indexed slice only. Slices
+    whose columns all have a scale of 1 are returned as views of the memory
+    map without a copy. Folders in the compact format are read through
+    ``CompactLatents`` and folders referencing shared column files through
+    ``ColumnLatents``.
+
+    Args:
+        folder: Folder containing the latents.
+        blender: Whether to return latents on the Blender support or on the
+            raw support.
+    """
+
+    def __init__(self, folder, blender=True):
+        self.folder = folder
+        self.blender = blender
+        self.metadata = load_metadata(folder)
+        # memory-mapped latent file, None for the compact and column storages
+        self.filename = None
+        self._scale = None
+
+        raw_path = os.path.join(folder, RAW_LATENTS_FILENAME)
+        blender_path = os.path.join(folder, LATENTS_FILENAME)
+        if self.metadata is not None and self.metadata.get("storage") == "compact":
+            self._data = CompactLatents(folder, self.metadata, blender=blender)
+        elif self.metadata is not None and self.metadata.get("storage") == "columns":
+            schema = self.metadata["schema"]
+            self._data = ColumnLatents(
+                folder, self.metadata["columns"], self.metadata["column_files"],
+                {c["name"]: c["constant"] for c in schema}, self.metadata["n_samples"],
+            )
+            if blender:
+                self._scale = self._blender_scale(len(schema))
+        elif blender and os.path.exists(blender_path):
+            self._data = np.load(blender_path, mmap_mode="r")
+            self.filename = LATENTS_FILENAME
+        elif os.path.exists(raw_path):
+            self._data = np.load(raw_path, mmap_mode="r")
+            self.filename = RAW_LATENTS_FILENAME
+            if blender:
+                self._scale = self._blender_scale(self._data.shape[1])
+        else:
+            raise FileNotFoundError(f"No latents found in {folder}")
+
+        self.shape = self._data.shape
+        self.dtype = self._data.dtype
+        if self.metadata is not None:
+            self.columns = file_columns(self.metadata, self.filename)
+            if len(self.columns) != self.shape[1]:
+                raise ValueError(f"The header of {folder} names {len(self.columns)} columns "
+                                 f"but its latents have {self.shape[1]}")
+        else:
+            self.columns = default_columns((self.shape[1] - 3) // 7)
+
+    def _blender_scale(self, n_columns):
+        if self.metadata is not None:
+            scale = [c["scale"] for c in file_schema(self.metadata, self.filename)]
+        else:
+            scale = [BLENDER_SCALE.get(column_factor(c), 1.0) for c in default_columns((n_columns - 3) // 7)]
+        if any(v is None for v in scale):
+            raise ValueError(f"Blender latents of {self.folder} are not a linear scaling of the raw latents")
+        scale = np.array(scale, dtype=self._data.dtype)
+        return None if np.all(scale == 1) else scale
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        data = self._data[rows]
+        full = isinstance(cols, slice) and cols == slice(None)
+        if not full:
+            data = data[..., cols]
+        if self._scale is None:
+            return data
+        scale = self._scale if full else self._scale[cols]
+        if np.all(scale == 1):
+            return data
+        return data * scale
+
+    def __array__(self, dtype=None, copy=None):
+        result = np.asarray(self[:])
+        return result if dtype is None else result.astype(dtype)
+
+    def column(self, name):
+        """All values of the column with the given name."""
+        return self[:, self.columns.index(name)]
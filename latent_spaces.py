@@ -52,18 +52,33 @@ class ProductLatentSpace(LatentSpace):
     def __init__(self, spaces: List[LatentSpace]):
         self.spaces = spaces
 
+    def _split(self, means):
+        """Columns of `means` belonging to each space: a single column for 1-dimensional spaces."""
+
+        start = 0
+        for s in self.spaces:
+            if s.dim == 1:
+                yield means[..., start]
+            else:
+                yield means[..., start : start + s.dim]
+            start += s.dim
+
     def sample_conditional(self, means, params, size, **kwargs):
         x = []
-        for i, s in enumerate(self.spaces):
-            if len(means.shape) == 1:
-                z_s = means[i]
-            else:
-                z_s = means[:, i]
+        for i, (s, z_s) in enumerate(zip(self.spaces, self._split(means))):
             x.append(s.sample_conditional(mean=z_s, params=params[i], size=size, **kwargs))
         return torch.cat(x, -1)
 
+    def sample_views(self, means, params, size, n_views, **kwargs):
+        """Draw `n_views` conditional samples of every row of `means` in a single pass.
+
+        Returns a tensor of shape (n_views, size, D).
+        """
+        means = means.unsqueeze(0).expand(n_views, *means.shape).reshape(n_views * size, -1)
+        return self.sample_conditional(means, params, n_views * size, **kwargs).view(n_views, size, -1)
+
     def sample_marginal(self, means, params, size, **kwargs):
-        x = [s.sample_marginal(means[:,i], params[i], size=size, **kwargs) for i, s in enumerate(self.spaces)]
+        x = [s.sample_marginal(z_s, params[i], size=size, **kwargs) for i, (s, z_s) in enumerate(zip(self.spaces, self._split(means)))]
         return torch.cat(x, -1)
 
     def sample_marginal_causal(self, std, size, first_content, **kwargs):
@@ -0,0 +1,271 @@
+"""Peak memory of the stages of latent generation, and a model of it in the number of pairs.
+
+``StageProfiler`` measures every stage of a script entered with
+``profiler.stage(name)``: the peak of the memory traced by ``tracemalloc``
+(Python objects and NumPy arrays) and the peak resident memory of the
+process, sampled by a background thread (which also covers torch tensors and
+memory maps). ``generate_clevr_dataset_latents.py --profile-memory report.json``
+writes such a report.
+
+Run as a script, this module generates latents for several numbers of pairs
+in fresh processes and fits the peak memory of every stage, and of the whole
+process, as ``intercept + bytes_per_pair * n_pairs``:
+
+    python memory_profile.py --n-pairs 10000 100000 1000000 --latent-args "--n-objects 2 --position --hue" \\
+        --output latents_memory.json
+
+``--causal`` profiles ``generate_clevr_dataset_latents_causal.py`` instead,
+with ``--n-points`` twice the number of pairs.
+
+``predict`` turns such a model into the memory to request for a job.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+import tracemalloc
+
+# seconds between two samples of the resident memory
+RSS_INTERVAL = 0.005
+
+# factor applied to the predicted peak, to leave room for the variance between machines
+SAFETY_MARGIN = 1.2
+
+# default options of the profiled latent generation scripts
+LATENT_ARGS = "--n-objects 1 --position"
+CAUSAL_LATENT_ARGS = "--non-periodic-rotation-and-color --deterministic --debug"
+
+
+def max_rss():
+    """Peak resident memory of the process so far, in bytes."""
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def current_rss():
+    """Resident memory of the process, in bytes, or its peak so far where it cannot be read."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return max_rss()
+
+
+def process_peak_rss(pid):
+    """Peak resident memory of a running process since it started its program, in bytes, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_process(command, interval=RSS_INTERVAL, **kwargs):
+    """Run a command like ``subprocess.run``; return its result and the peak resident memory of its process.
+
+    The peak is read from the process while it runs, since the peak that
+    ``getrusage`` reports for children includes the memory of the process
+    they were forked from. Where it cannot be read, that peak is returned.
+    """
+
+    import subprocess
+
+    process = subprocess.Popen(command, **kwargs)
+    peak = process_peak_rss(process.pid)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=interval)
+            break
+        except subprocess.TimeoutExpired:
+            peak = max(peak or 0, process_peak_rss(process.pid) or 0)
+    if not peak:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr), peak
+
+
+class RSSSampler(threading.Thread):
+    """Background thread recording the peak resident memory until stopped."""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.done = threading.Event()
+        self.start_rss = self.peak = current_rss()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        """Stop sampling; return the resident memory at the start and its peak."""
+        self.done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.start_rss, self.peak
+
+
+class StageProfiler:
+    """Time and peak memory of the stages of a script.
+
+    Stages are entered with ``stage(name)`` and must not be nested. A stage
+    entered several times, e.g. once per view, accumulates its time and keeps
+    the largest of its peaks.
+
+    Args:
+        enabled: Measure the stages; with False, ``stage`` does nothing, so
+            that the profiling calls can stay in the code.
+        interval: Seconds between two samples of the resident memory.
+    """
+
+    def __init__(self, enabled=True, interval=RSS_INTERVAL):
+        self.enabled = enabled
+        self.interval = interval
+        self.stages = {}
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        sampler = RSSSampler(self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss_start, rss_peak = sampler.stop()
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            record = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "traced_peak": 0, "traced_increase": 0,
+                                                   "rss_peak": 0, "rss_increase": 0})
+            record["calls"] += 1
+            record["seconds"] += seconds
+            record["traced_peak"] = max(record["traced_peak"], traced_peak)
+            record["traced_increase"] = max(record["traced_increase"], traced_peak - traced_start)
+            record["rss_peak"] = max(record["rss_peak"], rss_peak)
+            record["rss_increase"] = max(record["rss_increase"], rss_peak - rss_start)
+
+    def report(self):
+        """Table of the stages, in MiB."""
+
+        lines = [f"{'stage':24s} {'time':>9s} {'traced peak':>12s} {'(+stage)':>10s} {'RSS peak':>10s} {'(+stage)':>10s}"]
+        for name, record in self.stages.items():
+            lines.append(f"{name:24s} {record['seconds']:8.2f}s {record['traced_peak'] / 2**20:10.1f}MB "
+                         f"{record['traced_increase'] / 2**20:8.1f}MB {record['rss_peak'] / 2**20:8.1f}MB "
+                         f"{record['rss_increase'] / 2**20:8.1f}MB")
+        lines.append(f"{'process':24s} {'':9s} {'':12s} {'':10s} {max_rss() / 2**20:8.1f}MB")
+        return "\n".join(lines)
+
+    def save(self, path, **info):
+        """Write the stages and the peak memory of the process to a JSON file, with additional information."""
+
+        with open(path, "w") as f:
+            json.dump({**info, "stages": self.stages, "peak_rss": max_rss()}, f, indent=4)
+
+
+# profiler of the calls that are not profiled
+DISABLED = StageProfiler(enabled=False)
+
+
+def fit(reports, key="rss_peak"):
+    """Linear model of the peak memory of every stage and of the process in the number of pairs.
+
+    Args:
+        reports: Reports written by ``StageProfiler.save`` with an ``n_pairs`` entry.
+        key: Measure of the stages to fit, ``rss_peak`` or ``traced_peak``.
+
+    Returns:
+        Dictionary with ``intercept`` and ``bytes_per_pair`` of every stage and of the process (``peak``).
+    """
+
+    import numpy as np
+
+    n_pairs = np.array([report["n_pairs"] for report in reports], dtype=np.float64)
+    measures = {"peak": [report["peak_rss"] for report in reports]}
+    for name in reports[0]["stages"]:
+        measures[name] = [report["stages"][name][key] if name in report["stages"] else 0 for report in reports]
+    model = {}
+    for name, values in measures.items():
+        if len(reports) > 1:
+            slope, intercept = np.polyfit(n_pairs, np.asarray(values, dtype=np.float64), 1)
+        else:
+            slope, intercept = 0.0, float(values[0])
+        model[name] = {"intercept": float(intercept), "bytes_per_pair": float(slope)}
+    return model
+
+
+def predict(model, n_pairs, stage="peak", margin=SAFETY_MARGIN):
+    """Memory in bytes to request for generating `n_pairs` pairs, from a model fitted with ``fit``."""
+    coefficients = model["stages"][stage] if "stages" in model else model[stage]
+    return int(margin * (coefficients["intercept"] + coefficients["bytes_per_pair"] * n_pairs))
+
+
+def profile_latents(n_pairs, latent_args, folder, causal=False):
+    """Generate latents with the memory profile enabled in a fresh process; return its report.
+
+    With `causal`, the latents are generated by ``generate_clevr_dataset_latents_causal.py``
+    with twice `n_pairs` points.
+    """
+
+    import shlex
+    import subprocess
+
+    report = os.path.join(folder, f"memory_{n_pairs}.json")
+    if causal:
+        script, size = "generate_clevr_dataset_latents_causal.py", ["--n-points", str(2 * n_pairs)]
+    else:
+        script, size = "generate_clevr_dataset_latents.py", ["--n-pairs", str(n_pairs)]
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+               "--output-folder", os.path.join(folder, str(n_pairs)), *size,
+               "--profile-memory", report] + shlex.split(latent_args)
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    with open(report, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Fit the peak memory of latent generation in the number of pairs.")
+    parser.add_argument("--n-pairs", nargs="+", type=int, default=[10**4, 10**5, 10**6])
+    parser.add_argument("--latent-args", default=None, type=str,
+                        help="options of the latent generation script, without --n-pairs or --n-points")
+    parser.add_argument("--causal", action="store_true",
+                        help="profile generate_clevr_dataset_latents_causal.py, with --n-points twice the number of pairs")
+    parser.add_argument("--key", default="rss_peak", choices=["rss_peak", "traced_peak"], help="measure of the stages to fit")
+    parser.add_argument("--predict", nargs="*", type=int, default=[10**6, 10**7], help="numbers of pairs to predict the memory of")
+    parser.add_argument("--output", default=None, type=str, help="JSON file to write the model to")
+    args = parser.parse_args()
+    if args.latent_args is None:
+        args.latent_args = CAUSAL_LATENT_ARGS if args.causal else LATENT_ARGS
+
+    reports = []
+    with tempfile.TemporaryDirectory() as folder:
+        for n_pairs in sorted(args.n_pairs):
+            reports.append(profile_latents(n_pairs, args.latent_args, folder, args.causal))
+            stages = reports[-1]["stages"]
+            print(f"{n_pairs} pairs: peak {reports[-1]['peak_rss'] / 2**20:.1f}MB, "
+                  + ", ".join(f"{name} {record[args.key] / 2**20:.1f}MB" for name, record in stages.items()), flush=True)
+
+    model = {"latent_args": args.latent_args, "causal": args.causal, "key": args.key, "n_pairs": sorted(args.n_pairs), "stages": fit(reports, args.key)}
+    print(f"{'stage':24s} {'intercept':>12s} {'bytes/pair':>12s}")
+    for name, coefficients in model["stages"].items():
+        print(f"{name:24s} {coefficients['intercept'] / 2**20:10.1f}MB {coefficients['bytes_per_pair']:12.1f}")
+    for n_pairs in args.predict:
+        print(f"{n_pairs} pairs: request {predict(model, n_pairs) / 2**30:.2f}GB "
+              f"({SAFETY_MARGIN:.1f}x the predicted peak)")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(model, f, indent=4)
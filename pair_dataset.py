@@ -0,0 +1,230 @@
+"""PyTorch datasets for rendered image pairs and their ground-truth factors.
+
+Two folder layouts are supported:
+- the layout written by the generation scripts, ``<root>/m1/images/*.png``
+  next to ``<root>/m1/raw_latents.npy``,
+- the layout of the released datasets, ``<root>/samples/m1/*.png`` and
+  ``<root>/factors/m1/raw_latents.npy``.
+"""
+
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, DataLoader, get_worker_info
+from PIL import Image
+import latent_io
+import resample
+from latent_io import view_folders, image_filename
+
+
+def decode_image(path, uint8=True):
+    """Decode a PNG into a (C, H, W) tensor, either uint8 or float in [0, 1]."""
+
+    with Image.open(path) as img:
+        array = np.array(img.convert("RGB"))
+    image = torch.from_numpy(array).permute(2, 0, 1)
+    if uint8:
+        return image
+    return image.float().div_(255.0)
+
+
+class PairDataset(Dataset):
+    """Map-style dataset returning the images and latents of all views of a sample.
+
+    Each item is a tuple ``(images, latents)`` of shapes (V, C, H, W) and
+    (V, D) for V views. Latents are memory-mapped, so every DataLoader worker
+    only touches the rows it reads. ``__getitems__`` decodes the images of a
+    whole batch with a thread pool, which the DataLoader uses automatically.
+
+    Args:
+        root: Dataset folder.
+        views: Names of the views to read, all views m1..mK found in the
+            folder if None.
+        blender_latents: Return latents on the Blender support instead of
+            the raw support.
+        uint8: Return uint8 images, to defer the conversion and
+            normalization to the GPU.
+        num_threads: Number of threads decoding images in ``__getitems__``.
+        indices: Subset of sample indices to expose, all samples if None.
+        resolution: Read the images downsampled to this size by the
+            renderer (``--resolutions``) instead of the full-resolution images.
+    """
+
+    def __init__(self, root, views=("m1", "m2"), blender_latents=False, uint8=True, num_threads=4, indices=None,
+                 resolution=None):
+        self.root = root
+        if views is None:
+            factors = os.path.join(root, "factors")
+            views = latent_io.view_names(factors if os.path.isdir(factors) else root)
+        self.views = list(views)
+        self.uint8 = uint8
+        self.num_threads = num_threads
+        folders = [view_folders(root, view) for view in self.views]
+        self.image_folders = [f[0] if resolution is None else resample.resolution_folder(f[0], resolution) for f in folders]
+        self.latents = [latent_io.LatentDataset(f[1], blender=blender_latents) for f in folders]
+        n_samples = min(len(latents) for latents in self.latents)
+        self.indices = np.arange(n_samples) if indices is None else np.asarray(indices)
+        self._pool = None
+
+    def __getstate__(self):
+        # thread pools cannot be pickled to DataLoader workers; each worker creates its own
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        return self._pool
+
+    def __len__(self):
+        return len(self.indices)
+
+    def image_paths(self, i):
+        idx = self.indices[i]
+        return [os.path.join(folder, image_filename(idx)) for folder in self.image_folders]
+
+    def _latents(self, i):
+        idx = self.indices[i]
+        return torch.from_numpy(np.stack([np.asarray(latents[idx], dtype=np.float32) for latents in self.latents]))
+
+    def __getitem__(self, i):
+        images = torch.stack([decode_image(path, self.uint8) for path in self.image_paths(i)])
+        return images, self._latents(i)
+
+    def __getitems__(self, items):
+        paths = [path for i in items for path in self.image_paths(i)]
+        images = list(self.pool.map(lambda path: decode_image(path, self.uint8), paths))
+        n_views = len(self.views)
+        return [
+            (torch.stack(images[k * n_views : (k + 1) * n_views]), self._latents(i))
+            for k, i in enumerate(items)
+        ]
+
+
+class ShardedPairDataset(IterableDataset):
+    """Iterable dataset sharding a ``PairDataset`` across DDP ranks and DataLoader workers.
+
+    Every rank receives the same number of samples. Within each worker, the
+    images of the next ``prefetch`` samples are decoded ahead of time by the
+    thread pool of the underlying dataset. The epoch is shared with the
+    DataLoader workers, so that ``set_epoch`` also reshuffles with
+    ``persistent_workers=True``.
+
+    Args:
+        dataset: The ``PairDataset`` to iterate over.
+        shuffle: Shuffle the samples, with a permutation shared by all ranks.
+        seed: Seed of the permutation, combined with the epoch.
+        prefetch: Number of samples decoded ahead in each worker.
+        rank: Rank of this process, read from torch.distributed if None.
+        world_size: Number of processes, read from torch.distributed if None.
+    """
+
+    def __init__(self, dataset, shuffle=True, seed=0, prefetch=64, rank=None, world_size=None):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        self.rank = rank if rank is not None else (torch.distributed.get_rank() if distributed else 0)
+        self.world_size = world_size if world_size is not None else (torch.distributed.get_world_size() if distributed else 1)
+        # shared memory: persistent workers keep their copy of the dataset between epochs
+        self._epoch = multiprocessing.Value("q", 0, lock=False)
+
+    @property
+    def epoch(self):
+        return self._epoch.value
+
+    def set_epoch(self, epoch):
+        """Change the shuffling permutation, to be called at the start of every epoch, before iterating."""
+        self._epoch.value = epoch
+
+    def __len__(self):
+        return len(self.dataset) // self.world_size
+
+    def shard(self):
+        """Positions in the dataset read by the calling rank and worker."""
+
+        n = len(self.dataset)
+        if self.shuffle:
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            order = torch.randperm(n, generator=generator).numpy()
+        else:
+            order = np.arange(n)
+        # equal share for every rank, then split between the workers of the rank
+        order = order[: len(self) * self.world_size][self.rank :: self.world_size]
+        worker = get_worker_info()
+        if worker is not None:
+            order = order[worker.id :: worker.num_workers]
+        return order
+
+    def __iter__(self):
+        order = self.shard()
+        for start in range(0, len(order), self.prefetch):
+            for sample in self.dataset.__getitems__(order[start : start + self.prefetch].tolist()):
+                yield sample
+
+
+def make_synthetic_dataset(root, n_samples, size=224, n_views=2):
+    """Write random images and latents in the generation layout, for benchmarking."""
+
+    rng = np.random.default_rng(0)
+    for v in range(n_views):
+        view = f"m{v + 1}"
+        os.makedirs(os.path.join(root, view, "images"), exist_ok=True)
+        np.save(os.path.join(root, view, "raw_latents.npy"),
+                rng.uniform(-1, 1, size=(n_samples, 10)).astype(np.float32))
+        for idx in range(n_samples):
+            pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(root, view, "images", image_filename(idx)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the image throughput of the pair data loader.")
+    parser.add_argument("--root", required=True, type=str)
+    parser.add_argument("--make-synthetic", default=0, type=int, help="first write this many random sample pairs")
+    parser.add_argument("--batch-size", default=256, type=int)
+    parser.add_argument("--num-workers", default=4, type=int)
+    parser.add_argument("--num-threads", default=4, type=int)
+    parser.add_argument("--n-batches", default=50, type=int)
+    parser.add_argument("--float", action="store_true", help="decode to float instead of uint8")
+    parser.add_argument("--sharded", action="store_true", help="use the iterable, sharded dataset")
+    parser.add_argument("--views", nargs="+", default=None, help="views to load, all views of the dataset if not set")
+    args = parser.parse_args()
+
+    if args.make_synthetic:
+        make_synthetic_dataset(args.root, args.make_synthetic)
+
+    dataset = PairDataset(args.root, views=args.views, uint8=not args.float, num_threads=args.num_threads)
+    if args.sharded:
+        dataset = ShardedPairDataset(dataset)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=not args.sharded,
+        num_workers=args.num_workers,
+        persistent_workers=args.num_workers > 0,
+    )
+
+    def batches():
+        epoch = 0
+        while True:
+            if args.sharded:
+                dataset.set_epoch(epoch)
+            yield from loader
+            epoch += 1
+
+    iterator = batches()
+    next(iterator)  # the start-up of the workers is not counted
+    n_images = 0
+    start = time.perf_counter()
+    for _ in range(args.n_batches):
+        images, latents = next(iterator)
+        n_images += images.shape[0] * images.shape[1]
+    elapsed = time.perf_counter() - start
+    print(f"{n_images} images in {elapsed:.2f}s: {n_images / elapsed:.1f} images/sec")
@@ -0,0 +1,146 @@
+"""Bounding radii of the shapes and collision tests between the objects of scenes, without Blender.
+
+The radii of the shapes are exported once from Blender with
+``generate_clevr_dataset_images.py --export-radii radii.json``; every shape
+has a radius of ``camera.DEFAULT_OBJECT_RADIUS`` otherwise. Scenes with
+intersecting objects are rejected at latent-generation time.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import json
+import numpy as np
+import latent_io
+import camera
+
+# scenes with more objects are tested with a sort-and-sweep instead of all pairs
+SWEEP_MIN_OBJECTS = 8
+
+
+def load_radii(path=None, default=camera.DEFAULT_OBJECT_RADIUS):
+    """Bounding radius of every shape, read from a file written by ``render_utils.export_object_radii``.
+
+    Shapes missing from the file, or all shapes if `path` is None, have the `default` radius.
+    """
+
+    radii = {name: default for name in latent_io.SHAPE_NAMES}
+    if path is not None:
+        with open(path, "r") as f:
+            radii.update(json.load(f))
+    return radii
+
+
+def object_radii(latents, columns, n_objects, radii):
+    """Radius of every object of Blender latents, as an array of shape (N, n_objects)."""
+
+    table = np.array([radii[name] for name in latent_io.SHAPE_NAMES], dtype=np.float64)
+    classes = np.asarray(latents)[:, [columns[f"object_object_{k}"] for k in range(n_objects)]]
+    return table[np.rint(classes).astype(np.int64)]
+
+
+def pairwise_collisions(centers, radii, chunk_size=latent_io.CHUNK_SIZE):
+    """Whether any two spheres of each scene intersect, testing all pairs.
+
+    Args:
+        centers: Array of shape (N, n_objects, 3).
+        radii: Array of shape (N, n_objects).
+        chunk_size: Number of pairs tested at once.
+    """
+
+    n_objects = centers.shape[1]
+    i, j = np.triu_indices(n_objects, k=1)
+    colliding = np.zeros(len(centers), dtype=bool)
+    chunk_size = max(1, chunk_size // max(len(i), 1))
+    for start in range(0, len(centers), chunk_size):
+        c, r = centers[start : start + chunk_size], radii[start : start + chunk_size]
+        distances = np.linalg.norm(c[:, i] - c[:, j], axis=-1)
+        colliding[start : start + chunk_size] = np.any(distances < r[:, i] + r[:, j], axis=1)
+    return colliding
+
+
+def sweep_collisions(centers, radii):
+    """Whether any two spheres of each scene intersect, testing only the pairs that are close along x.
+
+    The objects of every scene are sorted along x and each object is only
+    compared with the following ones until they are further than the
+    largest diameter, for all scenes at once.
+
+    Args:
+        centers: Array of shape (N, n_objects, 3).
+        radii: Array of shape (N, n_objects).
+    """
+
+    n_scenes, n_objects = centers.shape[:2]
+    order = np.argsort(centers[..., 0], axis=1)
+    centers = np.take_along_axis(centers, order[..., None], axis=1)
+    radii = np.take_along_axis(radii, order, axis=1)
+    reach = 2 * radii.max() if radii.size else 0.0
+
+    colliding = np.zeros(n_scenes, dtype=bool)
+    active = np.arange(n_scenes)
+    for shift in range(1, n_objects):
+        # scenes with a collision are settled
+        active = active[~colliding[active]]
+        close = centers[active, shift:, 0] - centers[active, :-shift, 0] < reach
+        if not close.any():
+            break
+        rows, first = np.nonzero(close)
+        rows = active[rows]
+        second = first + shift
+        distances = np.linalg.norm(centers[rows, second] - centers[rows, first], axis=-1)
+        colliding[rows[distances < radii[rows, first] + radii[rows, second]]] = True
+    return colliding
+
+
+def collisions(centers, radii, method=None):
+    """Whether any two spheres of each scene intersect.
+
+    Args:
+        centers: Array of shape (N, n_objects, 3).
+        radii: Array of shape (N, n_objects).
+        method: "pairwise" or "sweep", chosen from the number of objects if None.
+    """
+
+    if method is None:
+        method = "sweep" if centers.shape[1] >= SWEEP_MIN_OBJECTS else "pairwise"
+    if centers.shape[1] < 2:
+        return np.zeros(len(centers), dtype=bool)
+    if method == "pairwise":
+        return pairwise_collisions(centers, radii)
+    if method == "sweep":
+        return sweep_collisions(centers, radii)
+    raise ValueError(f"Unknown collision test {method}, expected pairwise or sweep")
+
+
+def overlap_mask(latents, columns, n_objects, radii, method=None):
+    """Whether any two objects of each row of Blender latents intersect.
+
+    Args:
+        latents: Blender latents of shape (N, n_columns).
+        columns: Map of column names to positions, see ``latent_io.column_indices``.
+        n_objects: Number of objects per scene.
+        radii: Bounding radius of every shape, see ``load_radii``.
+        method: Collision test, see ``collisions``.
+    """
+
+    r = object_radii(latents, columns, n_objects, radii)
+    return collisions(camera.object_centers(latents, columns, n_objects), r, method)
+
+
+if __name__ == "__main__":
+    # compare the collision tests on random scenes in the position box of the renderer
+    import time
+
+    rng = np.random.default_rng(0)
+    for n_scenes, n_objects, radius in [(100000, 2, 0.3), (100000, 8, 0.3), (100000, 32, 0.3), (10000, 128, 0.05), (200, 1024, 0.02)]:
+        centers = rng.uniform(-2, 2, size=(n_scenes, n_objects, 3))
+        radii = rng.uniform(radius / 3, radius, size=(n_scenes, n_objects))
+        timings = {}
+        results = {}
+        for method in ["pairwise", "sweep"]:
+            start = time.perf_counter()
+            results[method] = collisions(centers, radii, method)
+            timings[method] = time.perf_counter() - start
+        assert np.array_equal(results["pairwise"], results["sweep"])
+        print(f"{n_scenes} scenes of {n_objects:4d} objects: {100 * results['sweep'].mean():5.1f}% colliding, "
+              f"pairwise {timings['pairwise']:.3f}s, sweep {timings['sweep']:.3f}s")
@@ -0,0 +1,113 @@
+"""Content-addressed cache of rendered images.
+
+Scenes are identified by a hash of their quantized latents, materials, shapes
+and render settings. Rendered images are stored once under their hash and
+reused through hardlinks, so that identical scenes across views, batches and
+datasets are only rendered once.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+# latents are rounded to this number of decimals before hashing
+QUANTIZATION_DECIMALS = 4
+
+
+def scene_key(latents, material_names, shape_names, settings, decimals=QUANTIZATION_DECIMALS):
+    """Hash of everything that determines a rendered image.
+
+    Args:
+        latents: Latents row of the scene, on the Blender support.
+        material_names: Material of each object.
+        shape_names: Shape of each object.
+        settings: Dictionary of the render settings, e.g. resolution and number of samples.
+        decimals: Number of decimals the latents are rounded to.
+    """
+
+    values = np.round(np.asarray(latents, dtype=np.float64), decimals)
+    values[values == 0] = 0.0  # -0.0 and 0.0 must hash alike
+    description = json.dumps(
+        {"materials": list(material_names), "shapes": list(shape_names), "settings": settings, "decimals": decimals},
+        sort_keys=True,
+    )
+    digest = hashlib.sha256(values.tobytes())
+    digest.update(description.encode())
+    return digest.hexdigest()
+
+
+def _link(source, destination):
+    # hardlink if possible, copy across file systems
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    except OSError:
+        tmp = f"{destination}.{os.getpid()}.tmp"
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, destination)
+
+
+class RenderCache:
+    """Local content-addressed store of rendered images.
+
+    Args:
+        folder: Folder of the store, which can be shared by several datasets
+            and rendering processes.
+        decimals: Number of decimals the latents are rounded to before hashing.
+    """
+
+    def __init__(self, folder, decimals=QUANTIZATION_DECIMALS):
+        self.folder = folder
+        self.decimals = decimals
+        os.makedirs(folder, exist_ok=True)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, latents, material_names, shape_names, settings):
+        return scene_key(latents, material_names, shape_names, settings, self.decimals)
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.png")
+
+    def fetch(self, key, output_filename):
+        """Link the cached image of a scene to `output_filename`; return whether it was cached."""
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        _link(path, output_filename)
+        self.hits += 1
+        return True
+
+    def store(self, key, output_filename):
+        """Add a freshly rendered image to the store."""
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link(output_filename, path)
+
+    def evict(self, key):
+        """Remove the cached image of a scene, e.g. when it is found broken; return whether it was cached."""
+
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        return f"Render cache: {stats['hits']} hits, {stats['misses']} misses ({100 * stats['hit_rate']:.1f}% hit rate)"
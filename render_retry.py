@@ -0,0 +1,147 @@
+"""Bounded retries of render calls and accounting of the samples that keep failing.
+
+A failing render is retried with exponential backoff up to a maximum number
+of attempts. Samples that still fail are appended to a quarantine list (one
+JSON record per line) and skipped, so that a sample failing
+deterministically, e.g. because of a missing asset or running out of memory,
+does not stall the whole batch of a worker.
+
+This module does not depend on Blender, so that the retry logic can be
+exercised with any callable, such as ``FlakyRenderer``.
+"""
+
+import os
+import json
+import time
+
+# number of retries after the first failed attempt
+MAX_RETRIES = 3
+
+# delay before the first retry, in seconds, doubled for every further retry
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Delay before retrying after the given failed attempt, counted from 0."""
+    return min(max_delay, base_delay * 2**attempt)
+
+
+class FailureLog:
+    """Failure accounting of a render worker.
+
+    Args:
+        path: JSONL file the failed samples are appended to, nothing is
+            written if None. The file can be shared by several workers.
+        worker: Name of the worker, recorded with its failures.
+    """
+
+    def __init__(self, path=None, worker=None):
+        self.path = path
+        self.worker = worker if worker is not None else f"pid {os.getpid()}"
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+
+    def record(self, samples, attempts, error):
+        """Quarantine samples whose render failed `attempts` times, the last time with `error`."""
+
+        self.failed += len(samples)
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lines = "".join(
+            json.dumps({"sample": sample, "worker": self.worker, "attempts": attempts,
+                        "error": f"{type(error).__name__}: {error}", "time": time.time()}) + "\n"
+            for sample in samples
+        )
+        # a single append per call, so that concurrent workers do not interleave their lines
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    def stats(self):
+        total = self.succeeded + self.failed
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "failure_rate": self.failed / total if total else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        report = (f"Worker {self.worker}: {stats['failed']} of {stats['succeeded'] + stats['failed']} samples failed "
+                  f"({100 * stats['failure_rate']:.1f}%), {stats['retries']} retries")
+        if stats["failed"] and self.path is not None:
+            report += f", quarantined in {self.path}"
+        return report
+
+
+def render_with_retries(render, samples, failures=None, max_retries=MAX_RETRIES, base_delay=BASE_DELAY,
+                        max_delay=MAX_DELAY, sleep=time.sleep):
+    """Call `render` until it succeeds, at most ``max_retries + 1`` times.
+
+    Args:
+        render: Callable rendering the samples, failing by raising an exception.
+        samples: Identifiers of the samples rendered by the call, recorded if it keeps failing.
+        failures: ``FailureLog`` of the worker, if any.
+        max_retries: Number of retries after the first attempt.
+        base_delay: Delay before the first retry, doubled for every further retry.
+        max_delay: Largest delay between two attempts.
+        sleep: Function waiting for a number of seconds.
+
+    Returns:
+        Whether the render succeeded.
+    """
+
+    failures = failures if failures is not None else FailureLog()
+    for attempt in range(max_retries + 1):
+        try:
+            render()
+        except Exception as e:
+            error = e
+            print(f"Render failed (attempt {attempt + 1} of {max_retries + 1}): {type(e).__name__}: {e}")
+            if attempt < max_retries:
+                failures.retries += 1
+                sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        failures.succeeded += len(samples)
+        return True
+    failures.record(samples, max_retries + 1, error)
+    return False
+
+
+class FlakyRenderer:
+    """Stub renderer failing on demand, to exercise the retry logic without Blender.
+
+    Args:
+        n_failures: Number of calls failing before the first success, or None to always fail.
+        error: Exception type raised by failing calls.
+    """
+
+    def __init__(self, n_failures=0, error=RuntimeError):
+        self.n_failures = n_failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.n_failures is None or self.calls <= self.n_failures:
+            raise self.error(f"stub failure {self.calls}")
+
+
+if __name__ == "__main__":
+    # retries and quarantine with stub renderers: transient failures recover, a poisoned sample is skipped
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as folder:
+        delays = []
+        failures = FailureLog(os.path.join(folder, "quarantine.jsonl"), worker="stub")
+        for sample, renderer in [("000000.png", FlakyRenderer(0)), ("000001.png", FlakyRenderer(2)),
+                                 ("000002.png", FlakyRenderer(None)), ("000003.png", FlakyRenderer(1))]:
+            ok = render_with_retries(renderer, [sample], failures, sleep=delays.append)
+            print(f"{sample}: {'rendered' if ok else 'quarantined'} after {renderer.calls} calls")
+        print(f"Backoff delays: {delays}")
+        print(failures.report())
+        with open(failures.path, "r") as f:
+            print(f.read().strip())
@@ -0,0 +1,44 @@
+"""Stand-in for the Blender renderer, to run the pipeline without Blender.
+
+It takes the command-line options of ``generate_clevr_dataset_images.py``,
+selects the samples of the batch in the same way, and writes a random
+placeholder image for every sample:
+
+    python render_stub.py --output-folder ${OUTPUT_FOLDER} --views all --n-batches 10 --batch-index 0
+
+``--stub-delay`` sets the time spent per image and ``--stub-failure-rate``
+makes the worker crash at random, to exercise ``run_pipeline.py``.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+import latent_io
+import generate_clevr_dataset_images as renderer
+
+
+def main(args):
+    rng = np.random.default_rng()
+    for folder in renderer.view_folders(args):
+        latents = latent_io.LatentDataset(folder)
+        output_image_folder = os.path.join(folder, "images")
+        os.makedirs(output_image_folder, exist_ok=True)
+        for idx in renderer.batch_indices(args, folder, len(latents)):
+            output_filename = os.path.join(output_image_folder, f"{str(idx).zfill(6)}.png")
+            if os.path.exists(output_filename) and args.worklist is None:
+                continue
+            if rng.random() < args.stub_failure_rate:
+                print(f"Stub renderer failing at {output_filename}")
+                sys.exit(1)
+            time.sleep(args.stub_delay)
+            pixels = np.random.default_rng(int(idx)).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(output_filename)
+
+
+if __name__ == "__main__":
+    parser = renderer.build_parser()
+    parser.add_argument("--stub-delay", type=float, default=0.01, help="seconds spent per image")
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0, help="probability to crash before every image")
+    main(parser.parse_args())
@@ -10,6 +10,7 @@
 
 import sys, random, os, json
 import bpy, bpy_extras
+import render_retry
 
 
 """
@@ -72,6 +73,66 @@ def get_camera_coords(cam, pos):
     return (px, py, z)
 
 
+def camera_parameters(cam=None):
+    """
+    Return the parameters needed to reproduce world_to_camera_view outside of
+    Blender, see camera.py.
+
+    Inputs:
+    - cam: Camera object, the scene camera if None
+    """
+    scene = bpy.context.scene
+    if cam is None:
+        cam = scene.camera
+    scale = scene.render.resolution_percentage / 100.0
+    world_to_camera = cam.matrix_world.normalized().inverted()
+    # frame corners in camera space: top right, bottom right, bottom left
+    frame = cam.data.view_frame(scene=scene)[:3]
+    camera = {
+        "type": cam.data.type,
+        "world_to_camera": [list(row) for row in world_to_camera],
+        "view_frame": [list(v) for v in frame],
+        "clip_start": cam.data.clip_start,
+        "clip_end": cam.data.clip_end,
+        "resolution": [int(scale * scene.render.resolution_x), int(scale * scene.render.resolution_y)],
+    }
+    return camera
+
+
+def export_camera(path, cam=None):
+    """
+    Write the camera parameters of camera_parameters to a JSON file.
+
+    Inputs:
+    - path: Output JSON file
+    - cam: Camera object, the scene camera if None
+    """
+    camera = camera_parameters(cam)
+    with open(path, "w") as f:
+        json.dump(camera, f, indent=4)
+    return camera
+
+
+def export_object_radii(path, shape_names):
+    """
+    Write the bounding radius of the objects of the scene to a JSON file, see
+    placement.py. The radius of an object is the largest distance of its
+    vertices to its origin, in world units.
+
+    Inputs:
+    - path: Output JSON file
+    - shape_names: Shape of each object "Object_i" of the scene
+    """
+    radii = {}
+    for i, shape_name in enumerate(shape_names):
+        obj = [o for o in bpy.data.objects if o.name.endswith(f"Object_{i}")][0]
+        origin = obj.matrix_world.translation
+        radii[shape_name] = max((obj.matrix_world @ v.co - origin).length for v in obj.data.vertices)
+    with open(path, "w") as f:
+        json.dump(radii, f, indent=4)
+    return radii
+
+
 def set_layer(obj, layer_idx):
     """ Move an object to a particular layer """
     # Set the target layer to True first because an object must always be on
@@ -133,14 +194,27 @@ def load_materials(material_dir):
         bpy.ops.wm.append(filename=filepath)
 
 
-def change_material(material, **properties):
-    """Update the parameters of a material"""
+def change_material(material, keyframe=None, **properties):
+    """Update the parameters of a material, and keyframe them at the given frame if any"""
     group_node = material.node_tree.nodes[-1]
 
     # Find and set the "Color" input of the new group node
     for inp in group_node.inputs:
         if inp.name in properties:
             inp.default_value = properties[inp.name]
+            if keyframe is not None:
+                inp.keyframe_insert("default_value", frame=keyframe)
+
+
+def constant_interpolation(datablocks):
+    """Hold every keyframe of the given datablocks until the next one, without interpolation"""
+    for datablock in datablocks:
+        animation = datablock.animation_data
+        if animation is None or animation.action is None:
+            continue
+        for fcurve in animation.action.fcurves:
+            for point in fcurve.keyframe_points:
+                point.interpolation = "CONSTANT"
 
 
 def add_material(name, object=None, **properties):
@@ -200,6 +274,122 @@ def add_material(name, object=None, **properties):
     )
 
 
+def copy_to_collection(objects, name):
+    """Copy objects, with their own data and materials, into a new collection of the scene.
+
+    Constraints of the copies targeting one of the copied objects are
+    redirected to its copy, e.g. spotlights tracking their object.
+    """
+    collection = bpy.data.collections.new(name)
+    bpy.context.scene.collection.children.link(collection)
+    copies = {}
+    for obj in objects:
+        copy = obj.copy()
+        if obj.data is not None:
+            copy.data = obj.data.copy()
+            if hasattr(copy.data, "materials"):
+                for k, material in enumerate(copy.data.materials):
+                    copy.data.materials[k] = material.copy()
+        collection.objects.link(copy)
+        copies[obj.name] = copy
+    for copy in copies.values():
+        for constraint in copy.constraints:
+            target = getattr(constraint, "target", None)
+            if target is not None and target.name in copies:
+                constraint.target = copies[target.name]
+    return collection
+
+
+def move_to_collection(objects, name):
+    """Unlink objects from their collections and link them to a new collection of the scene."""
+    collection = bpy.data.collections.new(name)
+    bpy.context.scene.collection.children.link(collection)
+    for obj in objects:
+        for other in list(obj.users_collection):
+            other.objects.unlink(obj)
+        collection.objects.link(obj)
+    return collection
+
+
+def isolated_view_layers(collections, hidden=()):
+    """Add one view layer per collection, in which all other given collections are excluded.
+
+    The collections in `hidden` are excluded from every new layer, and the
+    existing view layers are disabled, so that a render produces one image
+    per collection.
+    """
+    scene = bpy.context.scene
+    for layer in scene.view_layers:
+        layer.use = False
+    names = {c.name for c in collections} | {c.name for c in hidden}
+    layers = []
+    for collection in collections:
+        layer = scene.view_layers.new(collection.name)
+        layer.cycles.use_denoising = True
+        for child in layer.layer_collection.children:
+            child.exclude = child.name in names and child.name != collection.name
+        layers.append(layer)
+    return layers
+
+
+def layer_file_outputs(layers, folder):
+    """Write the image of every view layer to `folder` with the compositor.
+
+    Returns the path of the image of every layer for the current frame.
+    """
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    tree = scene.node_tree
+    settings = scene.render.image_settings
+    paths = []
+    render_layers = []
+    for layer in layers:
+        render_layer = tree.nodes.new("CompositorNodeRLayers")
+        render_layers.append(render_layer)
+        render_layer.layer = layer.name
+        output = tree.nodes.new("CompositorNodeOutputFile")
+        output.base_path = folder
+        output.format.file_format = "PNG"
+        output.format.color_mode = settings.color_mode
+        output.format.color_depth = settings.color_depth
+        output.file_slots[0].path = f"{layer.name}_"
+        tree.links.new(render_layer.outputs["Image"], output.inputs[0])
+        paths.append(os.path.join(folder, f"{layer.name}_{scene.frame_current:04d}.png"))
+
+    # the composite output must exist for the compositor to run
+    if not any(node.type == "COMPOSITE" for node in tree.nodes):
+        composite = tree.nodes.new("CompositorNodeComposite")
+        tree.links.new(render_layers[0].outputs["Image"], composite.inputs["Image"])
+    return paths
+
+
+def load_pixels(path):
+    """Read an image file into a float array of shape (height, width, channels)."""
+    import numpy as np
+
+    image = bpy.data.images.load(path, check_existing=False)
+    width, height = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    bpy.data.images.remove(image)
+    return pixels.reshape(height, width, -1)
+
+
+def save_pixels(path, pixels):
+    """Write a float array of shape (height, width, channels), as read by load_pixels, to a PNG file."""
+    import numpy as np
+
+    height, width, channels = pixels.shape
+    image = bpy.data.images.new(os.path.basename(path), width, height, alpha=channels == 4)
+    if channels == 3:
+        pixels = np.concatenate([pixels, np.ones((height, width, 1), dtype=pixels.dtype)], axis=-1)
+    image.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).ravel())
+    image.filepath_raw = path
+    image.file_format = "PNG"
+    image.save()
+    bpy.data.images.remove(image)
+
+
 def add_texture(obj_name, path):
     o = bpy.data.objects[obj_name]
     mat = bpy.data.materials.new("TextureMat")
@@ -254,13 +444,21 @@ def render_segmentation(objects, segm_mat, segm_color, render_args):
         bpy.data.objects[i - n_obj].data.materials.append(prev_mat[i])
 
 
-def render_img():
-    while True:
-        try:
-            bpy.ops.render.render(write_still=True)
-            break
-        except Exception as e:
-            print(e)
+def render_img(samples=(), failures=None, max_retries=render_retry.MAX_RETRIES,
+               base_delay=render_retry.BASE_DELAY, **render_args):
+    """
+    Render the scene, by default as a still written to the output path, with
+    bounded retries. Samples whose render keeps failing are recorded in the
+    FailureLog `failures`. Returns whether the render succeeded.
+    """
+    render_args = render_args or {"write_still": True}
+
+    def render():
+        result = bpy.ops.render.render(**render_args)
+        if "FINISHED" not in result:
+            raise RuntimeError(f"Render returned {result}")
+
+    return render_retry.render_with_retries(render, list(samples), failures, max_retries, base_delay)
 
 
 def save_additional_struct(scene_struct, output_blendfile, output_scene):
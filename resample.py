@@ -0,0 +1,118 @@
+"""Downsampling of rendered images to several resolutions.
+
+Images are resized with a separable Lanczos filter, widened by the scale
+factor so that it also acts as an antialiasing filter, and applied to the
+whole image at once as two matrix products. Colors are filtered in linear
+light and converted back to sRGB, as the renderer writes them.
+
+This module only depends on NumPy so that it can be imported from inside Blender.
+"""
+
+import functools
+import numpy as np
+
+# number of lobes of the Lanczos filter
+LANCZOS_LOBES = 3
+
+
+@functools.lru_cache(maxsize=None)
+def lanczos_weights(n_in, n_out, lobes=LANCZOS_LOBES):
+    """Matrix of shape (n_out, n_in) resampling a signal of `n_in` samples to `n_out` samples."""
+
+    scale = n_in / n_out
+    stretch = max(scale, 1.0)
+    centers = (np.arange(n_out) + 0.5) * scale - 0.5
+    distance = (np.arange(n_in)[None, :] - centers[:, None]) / stretch
+    weights = np.sinc(distance) * np.sinc(distance / lobes) * (np.abs(distance) < lobes)
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def srgb_to_linear(values):
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+# linear value of every 8-bit sRGB value
+SRGB_TO_LINEAR_UINT8 = srgb_to_linear(np.arange(256) / 255.0).astype(np.float32)
+
+
+def linear_to_srgb(values):
+    values = np.clip(values, 0.0, 1.0)
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+
+
+def resize_many(image, sizes, linear=True, lobes=LANCZOS_LOBES):
+    """Resize an image to several sizes.
+
+    Args:
+        image: Array of shape (height, width, channels), either uint8 or float in [0, 1].
+            A fourth channel is treated as alpha and filtered without color conversion.
+        sizes: Target (width, height) pairs, or ints for square images.
+        linear: Filter colors in linear light instead of directly on the sRGB values.
+        lobes: Number of lobes of the Lanczos filter.
+
+    Returns:
+        List with the image at every size, with the dtype of `image`.
+    """
+
+    uint8 = image.dtype == np.uint8
+    if linear and uint8 and image.shape[-1] == 3:
+        # 8-bit colors are converted with a lookup table
+        pixels = SRGB_TO_LINEAR_UINT8[image]
+    else:
+        pixels = image.astype(np.float32) / 255.0 if uint8 else image.astype(np.float32)
+        if linear:
+            pixels[..., :3] = srgb_to_linear(pixels[..., :3])
+
+    height, width = pixels.shape[:2]
+    resized = []
+    for size in sizes:
+        out_width, out_height = (size, size) if np.isscalar(size) else size
+        rows = lanczos_weights(height, out_height, lobes)
+        columns = lanczos_weights(width, out_width, lobes)
+        out = np.einsum("oh,hwc,pw->opc", rows, pixels, columns, optimize=["einsum_path", (0, 1), (0, 1)])
+        if linear:
+            out[..., :3] = linear_to_srgb(out[..., :3])
+        out = np.clip(out, 0.0, 1.0)
+        resized.append(np.rint(out * 255.0).astype(np.uint8) if uint8 else out)
+    return resized
+
+
+def resize(image, size, linear=True, lobes=LANCZOS_LOBES):
+    """Resize an image to a single size, see ``resize_many``."""
+    return resize_many(image, [size], linear, lobes)[0]
+
+
+def resolution_folder(image_folder, size):
+    """Folder of the images at a lower resolution, next to the folder of the full-resolution images."""
+    return f"{image_folder}_{size}"
+
+
+if __name__ == "__main__":
+    # resampling cost per image compared with the decoding of the full-resolution image
+    import argparse
+    import time
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description="Measure the cost of downsampling rendered images.")
+    parser.add_argument("--image", default="sample_image.png", type=str)
+    parser.add_argument("--resolution", default=224, type=int, help="the image is first resized to the render resolution")
+    parser.add_argument("--sizes", nargs="+", default=[64, 128], type=int)
+    parser.add_argument("--repeats", default=50, type=int)
+    args = parser.parse_args()
+
+    with Image.open(args.image) as img:
+        Image.fromarray(np.asarray(img.convert("RGB"))).resize((args.resolution, args.resolution), Image.LANCZOS).save("/tmp/resample_benchmark.png")
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        with Image.open("/tmp/resample_benchmark.png") as img:
+            image = np.asarray(img.convert("RGB"))
+    decode = (time.perf_counter() - start) / args.repeats
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        resized = resize_many(image, args.sizes)
+    elapsed = (time.perf_counter() - start) / args.repeats
+    print(f"{image.shape[1]}x{image.shape[0]} image: decoding {1000 * decode:.2f}ms, "
+          f"resampling to {args.sizes} {1000 * elapsed:.2f}ms")
+    for size, out in zip(args.sizes, resized):
+        reference = np.asarray(Image.fromarray(image).resize((size, size), Image.LANCZOS), dtype=np.float32)
+        print(f"{size}x{size}: mean absolute difference to PIL Lanczos {np.abs(out - reference).mean():.2f} / 255")
@@ -0,0 +1,270 @@
+"""Generate a dataset end to end on one machine: latents, sharded rendering and verification.
+
+    python run_pipeline.py --output-folder ${OUTPUT_FOLDER} --n-workers 8 \\
+        --latent-args "--n-pairs 100000 --n-objects 1 --position" --render-args "--use-gpu"
+
+1. The latents are generated with ``generate_clevr_dataset_latents.py``,
+   unless the output folder already holds views m1..mK.
+2. All views are split into ``--n-batches`` batches, which are handed out to
+   ``--n-workers`` local render workers whenever one of them is free, so that
+   slow batches do not hold up the others. A batch whose worker exits with an
+   error, leaves images missing or stops making progress is queued again, up
+   to ``--max-attempts`` times.
+3. The images are checked with ``verify_dataset.py`` and the flagged ones are
+   rendered again from a work list, for up to ``--repair-rounds`` rounds.
+
+Progress is tracked from the images on disk, and throughput, ETA and worker
+utilization are printed while rendering. The output of every worker goes to
+``<output folder>/logs``. ``--renderer stub`` replaces Blender with
+``render_stub.py``, to run the whole pipeline without it.
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import subprocess
+from collections import deque
+from multiprocessing import Pool
+import numpy as np
+import latent_io
+import verify_dataset
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class RenderJob:
+    """A batch of a render round, with the images it has left to write.
+
+    Args:
+        name: Name of the batch, used for its log files.
+        command: Command rendering the batch.
+        expected: Map of image folders to the indices of the images of the batch.
+    """
+
+    def __init__(self, name, command, expected):
+        self.name = name
+        self.command = command
+        self.remaining = {folder: np.asarray(indices, dtype=np.int64) for folder, indices in expected.items()}
+        self.attempts = 0
+        self.process = None
+        self.log = None
+        self.started = None
+        self.last_progress = None
+        self.update()
+
+    def __len__(self):
+        return sum(len(indices) for indices in self.remaining.values())
+
+    def update(self):
+        """Drop the images written since the last update; return how many there were."""
+
+        before = len(self)
+        for folder, indices in self.remaining.items():
+            exists = np.array([os.path.exists(os.path.join(folder, f"{str(idx).zfill(6)}.png")) for idx in indices],
+                              dtype=bool)
+            self.remaining[folder] = indices[~exists] if len(indices) else indices
+        return before - len(self)
+
+    def start(self, log_folder):
+        self.attempts += 1
+        self.log = open(os.path.join(log_folder, f"{self.name}_attempt{self.attempts}.log"), "w")
+        self.process = subprocess.Popen(self.command, stdout=self.log, stderr=subprocess.STDOUT, cwd=BASE_PATH)
+        self.started = self.last_progress = time.perf_counter()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.log is not None:
+            self.log.close()
+        self.process = self.log = None
+
+
+def renderer_command(args):
+    if args.renderer == "stub":
+        return [sys.executable, os.path.join(BASE_PATH, "render_stub.py")]
+    return [args.blender, "--background", "--python", os.path.join(BASE_PATH, "generate_clevr_dataset_images.py"), "--"]
+
+
+def run_latents(args):
+    """Generate the latents, unless the output folder already holds views."""
+
+    if len(latent_io.view_names(args.output_folder)) > 0:
+        print(f"[latents] found views {latent_io.view_names(args.output_folder)} in {args.output_folder}, skipping generation")
+        return
+    command = [sys.executable, os.path.join(BASE_PATH, "generate_clevr_dataset_latents.py"),
+               "--output-folder", args.output_folder] + shlex.split(args.latent_args)
+    print(f"[latents] {' '.join(command)}")
+    subprocess.run(command, check=True, cwd=BASE_PATH)
+
+
+def render_jobs(args, views, n_batches, worklist=None, worklist_path=None):
+    """Batches rendering all samples of the views, or the samples of the work list."""
+
+    jobs = []
+    base = renderer_command(args) + ["--output-folder", args.output_folder, "--views"] + views + shlex.split(args.render_args)
+    candidates = {}
+    for view in views:
+        folder = os.path.join(args.output_folder, view)
+        n_samples = len(latent_io.LatentDataset(folder))
+        indices = np.arange(n_samples) if worklist is None else np.array(sorted(worklist.get(view, [])), dtype=np.int64)
+        candidates[os.path.join(folder, "images")] = indices[indices < n_samples]
+    # the same split as generate_clevr_dataset_images.batch_indices
+    splits = {folder: np.array_split(indices, n_batches) for folder, indices in candidates.items()}
+    for b in range(n_batches):
+        command = base + ["--n-batches", str(n_batches), "--batch-index", str(b)]
+        if worklist_path is not None:
+            command += ["--worklist", worklist_path]
+        name = f"batch{b:05d}" if worklist is None else f"repair{b:05d}"
+        job = RenderJob(name, command, {folder: split[b] for folder, split in splits.items()})
+        if len(job) > 0:
+            jobs.append(job)
+    return jobs
+
+
+def run_render(args, jobs, stage="render"):
+    """Run the jobs on a pool of workers until all are done or out of attempts; return the failed jobs."""
+
+    log_folder = os.path.join(args.output_folder, "logs")
+    os.makedirs(log_folder, exist_ok=True)
+    queue = deque(jobs)
+    running = []
+    failed = []
+    total = sum(len(job) for job in jobs)
+    done = 0
+    restarts = 0
+    busy = 0.0
+    start = last_report = time.perf_counter()
+    try:
+        while queue or running:
+            while queue and len(running) < args.n_workers:
+                job = queue.popleft()
+                job.start(log_folder)
+                running.append(job)
+
+            time.sleep(args.poll_interval)
+            now = time.perf_counter()
+            busy += len(running) * args.poll_interval
+            for job in list(running):
+                progress = job.update()
+                done += progress
+                if progress > 0:
+                    job.last_progress = now
+                returncode = job.process.poll()
+                stalled = returncode is None and now - job.last_progress > args.stall_timeout
+                if returncode is None and not stalled:
+                    continue
+
+                # the worker is done: the batch is complete, or it is queued again
+                job.stop()
+                running.remove(job)
+                done += job.update()
+                if len(job) == 0:
+                    continue
+                reason = "stalled" if stalled else f"exited with {returncode}"
+                if job.attempts < args.max_attempts:
+                    restarts += 1
+                    print(f"[{stage}] {job.name} {reason} with {len(job)} images left, queued again")
+                    queue.append(job)
+                else:
+                    print(f"[{stage}] {job.name} {reason} with {len(job)} images left, giving up after {job.attempts} attempts")
+                    failed.append(job)
+
+            if now - last_report >= args.report_interval or not (queue or running):
+                last_report = now
+                elapsed = now - start
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = format_duration((total - done) / rate) if rate > 0 else "-"
+                print(f"[{stage}] {done}/{total} images ({100 * done / max(total, 1):.1f}%), {rate:.1f} images/s, "
+                      f"ETA {eta}, {len(running)}/{args.n_workers} workers busy, {len(queue)} batches queued, "
+                      f"{restarts} restarts", flush=True)
+    finally:
+        for job in running:
+            job.stop()
+
+    elapsed = time.perf_counter() - start
+    print(f"[{stage}] {done} images in {format_duration(elapsed)}, "
+          f"worker utilization {100 * busy / max(args.n_workers * elapsed, 1e-9):.0f}%")
+    return failed
+
+
+def run_verify(args, views, pool):
+    """Check all images; return the work list of flagged images."""
+
+    worklist = {}
+    for view in views:
+        problems = verify_dataset.verify_view(args.output_folder, view, pool, tuple(args.resolution))
+        if problems:
+            worklist[view] = [idx for idx, _ in problems]
+    return worklist
+
+
+def main(args):
+    args.output_folder = os.path.abspath(args.output_folder)
+    timings = {}
+
+    start = time.perf_counter()
+    run_latents(args)
+    timings["latents"] = time.perf_counter() - start
+    views = latent_io.view_names(args.output_folder)
+
+    start = time.perf_counter()
+    n_batches = args.n_batches if args.n_batches is not None else 8 * args.n_workers
+    failed = run_render(args, render_jobs(args, views, n_batches))
+    timings["render"] = time.perf_counter() - start
+
+    with Pool(args.n_workers) as pool:
+        for repair_round in range(args.repair_rounds + 1):
+            start = time.perf_counter()
+            worklist = run_verify(args, views, pool)
+            timings["verify"] = timings.get("verify", 0.0) + time.perf_counter() - start
+            n_flagged = sum(len(indices) for indices in worklist.values())
+            if n_flagged == 0 or repair_round == args.repair_rounds:
+                break
+            # broken images are removed, so that progress can be tracked from the images on disk
+            for view, indices in worklist.items():
+                for idx in indices:
+                    path = os.path.join(args.output_folder, view, "images", f"{str(idx).zfill(6)}.png")
+                    if os.path.exists(path):
+                        os.remove(path)
+            worklist_path = os.path.join(args.output_folder, "worklist.json")
+            with open(worklist_path, "w") as f:
+                json.dump(worklist, f)
+            start = time.perf_counter()
+            failed = run_render(args, render_jobs(args, views, min(args.n_workers, n_flagged), worklist, worklist_path),
+                                stage="repair")
+            timings["repair"] = timings.get("repair", 0.0) + time.perf_counter() - start
+
+    total = sum(timings.values())
+    print(", ".join(f"{stage} {format_duration(t)} ({100 * t / max(total, 1e-9):.0f}%)" for stage, t in timings.items()))
+    if n_flagged > 0 or failed:
+        print(f"{n_flagged} images are still missing or broken, see {os.path.join(args.output_folder, 'logs')}")
+        sys.exit(1)
+    print(f"Dataset complete in {args.output_folder}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the latents, render and verify a dataset on this machine.")
+    parser.add_argument("--output-folder", required=True, type=str)
+    parser.add_argument("--latent-args", default="", type=str, help="options of generate_clevr_dataset_latents.py")
+    parser.add_argument("--render-args", default="", type=str, help="options of generate_clevr_dataset_images.py")
+    parser.add_argument("--renderer", default="blender", choices=["blender", "stub"])
+    parser.add_argument("--blender", default="blender", type=str, help="Blender executable")
+    parser.add_argument("--n-workers", default=os.cpu_count(), type=int, help="number of render workers")
+    parser.add_argument("--n-batches", default=None, type=int, help="number of render batches, 8 per worker by default")
+    parser.add_argument("--max-attempts", default=3, type=int, help="attempts at rendering a batch")
+    parser.add_argument("--stall-timeout", default=1800.0, type=float,
+                        help="seconds without a new image after which a worker is restarted")
+    parser.add_argument("--repair-rounds", default=1, type=int, help="rounds of rendering the images flagged by the verification")
+    parser.add_argument("--resolution", nargs=2, type=int, default=[224, 224], help="width and height of the renders")
+    parser.add_argument("--poll-interval", default=2.0, type=float, help="seconds between checks of the workers")
+    parser.add_argument("--report-interval", default=30.0, type=float, help="seconds between progress reports")
+    main(parser.parse_args())
@@ -3,9 +3,7 @@
 from abc import ABC, abstractmethod
 import torch
 import numpy as np
-import vmf
 import spaces_utils as sut
-from scipy.stats import wishart, truncnorm
 
 
 class Space(ABC):
@@ -120,142 +118,150 @@ class Space(ABC):
 #         return result
 
 
-# class NSphereSpace(Space):
-#     """N-dimensional hypersphere, i.e. {x | |x| = r and x € R^N}."""
+class NSphereSpace(Space):
+    """N-dimensional hypersphere, i.e. {x | |x| = r and x € R^N}.
 
-#     def __init__(self, n, r=1):
-#         self.n = n
-#         self._n_sub = n - 1
-#         self.r = r
-
-#     @property
-#     def dim(self):
-#         return self.n
-
-#     def uniform(self, size, device="cpu"):
-#         x = torch.randn((size, self.n), device=device)
-#         x /= torch.sqrt(torch.sum(x ** 2, dim=-1, keepdim=True))
-
-#         return x
+    All samplers are batched in torch and stay on the given device. Means can
+    be given per row (shape (size, N)) and concentration parameters per row
+    (shape (size,) or (size, 1)).
+    """
 
-#     def normal(self, mean, std, size, device="cpu"):
-#         """Sample from a Normal distribution in R^N and then project back on the sphere.
-
-#         Args:
-#             mean: Value(s) to sample around.
-#             std: Concentration parameter of the distribution (=standard deviation).
-#             size: Number of samples to draw.
-#             device: torch device identifier
-#         """
-
-#         assert len(mean.shape) == 1 or (len(mean.shape) == 2 and len(mean) == size)
-#         assert mean.shape[-1] == self.n
-
-#         if len(mean.shape) == 1:
-#             mean = mean.unsqueeze(0)
-
-#         mean = mean.to(device)
-#         if not torch.is_tensor(std):
-#             std = torch.ones(self.n) * std
-#         std = std.to(device)
-
-#         assert mean.shape[1] == self.n
-#         assert torch.allclose(
-#             torch.sqrt((mean ** 2).sum(-1)), torch.Tensor([self.r]).to(device)
-#         )
+    def __init__(self, n, r=1):
+        self.n = n
+        self._n_sub = n - 1
+        self.r = r
 
-#         result = torch.randn((size, self.n), device=device) * std + mean
-#         # project back on sphere
-#         result /= torch.sqrt(torch.sum(result ** 2, dim=-1, keepdim=True))
+    @property
+    def dim(self):
+        return self.n
 
-#         return result
+    def _mean(self, mean, size, device):
+        assert len(mean.shape) == 1 or (len(mean.shape) == 2 and len(mean) == size)
+        assert mean.shape[-1] == self.n
 
-#     def laplace(self, mean, lbd, size, device="cpu"):
-#         """Sample from a Laplace distribution in R^N and then project back on the sphere.
+        mean = torch.as_tensor(mean, dtype=torch.float32, device=device)
+        if len(mean.shape) == 1:
+            mean = mean.unsqueeze(0)
+        assert torch.allclose(
+            torch.linalg.vector_norm(mean, dim=-1),
+            torch.tensor(float(self.r), device=device),
+            atol=1e-4,
+        )
+        return mean
 
-#         Args:
-#             mean: Value(s) to sample around.
-#             lbd: Concentration parameter of the distribution.
-#             size: Number of samples to draw.
-#             device: torch device identifier
-#         """
+    def _parameter(self, value, size, device):
+        """Scalars are kept, per-row parameters become (size, 1) columns."""
 
-#         assert len(mean.shape) == 1 or (len(mean.shape) == 2 and len(mean) == size)
-#         assert mean.shape[-1] == self.n
+        if not (torch.is_tensor(value) or isinstance(value, np.ndarray)):
+            return value
+        value = torch.as_tensor(value, dtype=torch.float32, device=device)
+        if len(value.shape) == 1 and len(value) == size and size != self.n:
+            value = value.unsqueeze(-1)
+        return value
 
-#         if len(mean.shape) == 1:
-#             mean = mean.unsqueeze(0)
+    def _project(self, x):
+        """Project points of R^N back on the sphere, in place."""
+        return x.div_(torch.linalg.vector_norm(x, dim=-1, keepdim=True)).mul_(self.r)
 
-#         mean = mean.to(device)
+    def uniform(self, size, device="cpu"):
+        return self._project(torch.randn((size, self.n), device=device))
 
-#         assert mean.shape[1] == self.n
-#         assert torch.allclose(
-#             torch.sqrt((mean ** 2).sum(-1)), torch.Tensor([self.r]).to(device)
-#         )
+    def normal(self, mean, std, size, device="cpu"):
+        """Sample from a Normal distribution in R^N and then project back on the sphere.
 
-#         result = NRealSpace(self.n).laplace(mean, lbd, size, device)
-#         # project back on sphere
-#         result /= torch.sqrt(torch.sum(result ** 2, dim=-1, keepdim=True))
+        Args:
+            mean: Value(s) to sample around.
+            std: Concentration parameter of the distribution (=standard deviation).
+            size: Number of samples to draw.
+            device: torch device identifier
+        """
 
-#         return result
+        mean = self._mean(mean, size, device)
+        std = self._parameter(std, size, device)
 
-#     def generalized_normal(self, mean, lbd, p, size, device="cpu"):
-#         """Sample from a Generalized Normal distribution in R^N and then project back on the sphere.
+        result = torch.randn((size, self.n), device=device).mul_(std).add_(mean)
+        return self._project(result)
 
-#         Args:
-#             mean: Value(s) to sample around.
-#             lbd: Concentration parameter of the distribution.
-#             p: Exponent of the distribution.
-#             size: Number of samples to draw.
-#             device: torch device identifier
-#         """
+    def laplace(self, mean, lbd, size, device="cpu"):
+        """Sample from a Laplace distribution in R^N and then project back on the sphere.
 
-#         assert len(mean.shape) == 1 or (len(mean.shape) == 2 and len(mean) == size)
-#         assert mean.shape[-1] == self.n
+        Args:
+            mean: Value(s) to sample around.
+            lbd: Concentration parameter of the distribution.
+            size: Number of samples to draw.
+            device: torch device identifier
+        """
 
-#         if len(mean.shape) == 1:
-#             mean = mean.unsqueeze(0)
+        mean = self._mean(mean, size, device)
+        lbd = self._parameter(lbd, size, device)
 
-#         mean = mean.to(device)
+        # inverse CDF of the standard Laplace distribution
+        u = torch.rand((size, self.n), device=device).sub_(0.5)
+        result = u.sign().mul_(torch.log1p(u.abs().mul_(-2)).neg_()).mul_(lbd).add_(mean)
+        return self._project(result)
 
-#         assert mean.shape[1] == self.n
-#         assert torch.allclose(
-#             torch.sqrt((mean ** 2).sum(-1)), torch.Tensor([self.r]).to(device)
-#         )
+    def generalized_normal(self, mean, lbd, p, size, device="cpu"):
+        """Sample from a Generalized Normal distribution in R^N and then project back on the sphere.
 
-#         result = NRealSpace(self.n).generalized_normal(
-#             mean=mean, lbd=lbd, p=p, size=size, device=device
-#         )
-#         # project back on sphere
-#         result /= torch.sqrt(torch.sum(result ** 2, dim=-1, keepdim=True))
+        Args:
+            mean: Value(s) to sample around.
+            lbd: Concentration parameter of the distribution.
+            p: Exponent of the distribution.
+            size: Number of samples to draw.
+            device: torch device identifier
+        """
 
-#         return result
+        mean = self._mean(mean, size, device)
 
-#     def von_mises_fisher(self, mean, kappa, size, device="cpu"):
-#         """Sample from a von Mises-Fisher distribution (=Normal distribution on a hypersphere).
+        result = sut.sample_generalized_normal(mean, lbd, p, (size, self.n))
+        return self._project(result)
 
-#         Args:
-#             mean: Value(s) to sample around.
-#             kappa: Concentration parameter of the distribution.
-#             size: Number of samples to draw.
-#             device: torch device identifier
-#         """
+    def von_mises_fisher(self, mean, kappa, size, device="cpu"):
+        """Sample from a von Mises-Fisher distribution (=Normal distribution on a hypersphere).
 
-#         assert len(mean.shape) == 1 or (len(mean.shape) == 2 and len(mean) == size)
-#         assert mean.shape[-1] == self.n
+        Uses Wood's (1994) rejection sampler for the component along the mean,
+        vectorized over rows so that each row can have its own mean and
+        concentration.
 
-#         mean = mean.cpu().detach().numpy()
+        Args:
+            mean: Value(s) to sample around.
+            kappa: Concentration parameter of the distribution.
+            size: Number of samples to draw.
+            device: torch device identifier
+        """
 
-#         if len(mean.shape) == 1:
-#             mean = np.repeat(np.expand_dims(mean, 0), size, axis=0)
+        mean = self._mean(mean, size, device) / self.r
+        kappa = torch.as_tensor(kappa, dtype=torch.float32, device=device).reshape(-1)
+        kappa = kappa.expand(size) if len(kappa) == 1 else kappa
+        assert len(kappa) == size
+
+        # sample the component w of each point along its mean
+        dim = self._n_sub
+        b = dim / (torch.sqrt(4.0 * kappa ** 2 + dim ** 2) + 2 * kappa)
+        x = (1.0 - b) / (1.0 + b)
+        c = kappa * x + dim * torch.log(1 - x ** 2)
+        beta = torch.distributions.Beta(
+            torch.tensor(dim / 2.0, device=device), torch.tensor(dim / 2.0, device=device)
+        )
 
-#         assert mean.shape[1] == self.n
-#         assert np.allclose(np.sqrt((mean ** 2).sum(-1)), self.r)
+        w = torch.empty(size, device=device)
+        pending = torch.arange(size, device=device)
+        while len(pending) > 0:
+            z = beta.sample((len(pending),))
+            b_p, x_p, c_p, kappa_p = b[pending], x[pending], c[pending], kappa[pending]
+            w_p = (1.0 - (1.0 + b_p) * z) / (1.0 - (1.0 - b_p) * z)
+            u = torch.rand(len(pending), device=device)
+            accept = kappa_p * w_p + dim * torch.log(1.0 - x_p * w_p) - c_p >= torch.log(u)
+            w[pending[accept]] = w_p[accept]
+            pending = pending[~accept]
 
-#         samples_np = vmf.sample_vMF(mean, kappa, size)
-#         samples = torch.Tensor(samples_np).to(device)
+        # sample a direction orthogonal to the mean
+        v = torch.randn((size, self.n), device=device)
+        v.sub_((v * mean).sum(-1, keepdim=True) * mean)
+        v.div_(torch.linalg.vector_norm(v, dim=-1, keepdim=True))
 
-#         return samples
+        w = w.unsqueeze(-1)
+        return v.mul_(torch.sqrt((1.0 - w ** 2).clamp_(min=0.0))).add_(w * mean).mul_(self.r)
 
 
 class NBoxSpace(Space):
@@ -266,20 +272,52 @@ class NBoxSpace(Space):
         self.n = n
         self.min_ = min_
         self.max_ = max_
+        self._samplers = {}
 
     @property
     def dim(self):
         return self.n
 
     def delta(self, size, device="cpu"):
-        return (0.0*torch.rand(size=(size, self.n), device=device))
+        # stride-0 view: no random draw and no (size, n) allocation
+        return torch.zeros((1, self.n), device=device).expand(size, self.n)
 
-    def uniform(self, size, device="cpu"):
-        return (
-            torch.rand(size=(size, self.n), device=device) * (self.max_ - self.min_)
-            + self.min_
+    def uniform(self, size, device="cpu", mean=None, a=None, b=None, unit=None):
+        """Sample uniformly in the box, or in [mean + a, mean + b] restricted to the box.
+
+        Args:
+            size: Number of samples to draw.
+            device: torch device identifier
+            mean: Optional value(s) to sample around.
+            a: Lower limit of the samples relative to `mean`, the box limit if None.
+            b: Upper limit of the samples relative to `mean`, the box limit if None.
+            unit: Optional (size, n) points in [0, 1)^n, e.g. from a
+                low-discrepancy design, used instead of random draws.
+                Rows falling outside of the box are redrawn at random.
+        """
+
+        a = self.min_ if a is None else a
+        b = self.max_ if b is None else b
+        if unit is not None:
+            unit = torch.as_tensor(unit, dtype=torch.float32, device=device).reshape(size, self.n)
+        if mean is None and a >= self.min_ and b <= self.max_:
+            u = torch.rand(size=(size, self.n), device=device) if unit is None else unit
+            return u * (b - a) + a
+
+        mean = torch.zeros(1, device=device) if mean is None else mean.to(device)
+        if len(mean.shape) == 1:
+            mean = mean.unsqueeze(-1)
+
+        draws = [unit]
+        def sampler(s):
+            u = draws.pop() if draws and draws[-1] is not None else torch.rand((s, self.n), device=device)
+            return u * (b - a) + a + mean
+        values = sut.truncated_rejection_resampling(
+            sampler, self.min_, self.max_, size, self.n, device=device
         )
 
+        return values.view((size, self.n))
+
     def normal(self, mean, std, size, device="cpu"):
         """Sample from a Normal distribution in R^N and then restrict the samples to a box.
 
@@ -325,8 +363,10 @@ class NBoxSpace(Space):
         mean_np = mean.detach().cpu().numpy()
         a = (self.min_ - mean_np) / std
         b = (self.max_ - mean_np) / std
+        # SciPy is only imported by the truncated normal sampler
+        from scipy.stats import truncnorm
+
         unnormalised_samples = truncnorm.rvs(a, b, size=(size, self.n))
-        print(std,mean_np)
         samples = torch.FloatTensor(std * unnormalised_samples + mean_np, device=device)
         return samples
 
@@ -355,18 +395,44 @@ class NBoxSpace(Space):
 
         return values.view((size, self.n))
     
-    def multinomial(self, mean, classes, size, weights=None, uniform=True, device=None):
-
-        if uniform:
-            weights = (1/classes)*torch.ones([classes])
-        else: assert weights != None, "Provide weights for object distribution"
-        
-        changes = torch.reshape(
-                    torch.multinomial(weights, size * 1, replacement=True),
-                    [size,],
-                )
-        return (mean + changes).unsqueeze(-1)
+    def categorical_sampler(self, weights, generator=None):
+        """Return the alias-table sampler of the given weights, built on first use."""
+
+        key = (tuple(np.shape(weights)), tuple(np.asarray(weights, dtype=np.float64).ravel().tolist()), generator)
+        if key not in self._samplers:
+            self._samplers[key] = sut.CategoricalSampler(weights, generator=generator)
+        return self._samplers[key]
+
+    def multinomial(self, mean, classes, size, weights=None, uniform=True, transition=None,
+                    max_classes=None, generator=None, unit=None, device=None):
+        """Sample object classes, as offsets around `mean` or from a transition matrix.
+
+        Args:
+            mean: Class(es) to sample around or to condition on.
+            classes: Number of offsets, drawn uniformly if `uniform` is set.
+            size: Number of samples to draw.
+            weights: Weights of the offsets if `uniform` is not set.
+            uniform: Draw the offsets uniformly.
+            transition: Optional (K, K) matrix of P(class | class of `mean`) replacing the offsets.
+            max_classes: Number of available classes; offsets past the last class wrap around to the first.
+            generator: Optional torch.Generator for reproducible draws.
+            unit: Optional points in [0, 1) mapped to the offsets by inverse CDF.
+            device: torch device identifier
+        """
 
+        if transition is not None:
+            mean = torch.as_tensor(mean).reshape(-1).expand(size)
+            sampler = self.categorical_sampler(transition, generator)
+            result = sampler.sample(size, given=mean).to(mean.dtype)
+        else:
+            if not uniform:
+                assert weights is not None, "Provide weights for object distribution"
+            sampler = self.categorical_sampler(classes if uniform else weights, generator)
+            result = mean + sampler.sample(size, unit=unit)
+
+        if max_classes is not None:
+            result = torch.remainder(result, max_classes)
+        return result.unsqueeze(-1)
 
     def generalized_normal(self, mean, lbd, p, size, device=None):
         """Sample from a Generalized Normal distribution in R^N and then restrict the samples to a box.
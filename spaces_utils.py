@@ -1,85 +1,138 @@
-"""Utility functions for spaces."""
+"""Utility functions for spaces.
 
-import torch
+torch is imported by the samplers that need it, so that the coordinate
+transforms and the design names can be used without it.
+"""
+
+import sys
 import numpy as np
 from typing import Callable
 
 
-def spherical_to_cartesian(r, phi):
-    """Convert spherical coordinates to cartesian coordinates."""
-
-    must_convert_to_torch = False
-    if isinstance(phi, np.ndarray):
-        must_convert_to_torch = True
-        phi = torch.Tensor(phi)
+CHUNK_SIZE = 65536
 
-    if isinstance(r, (int, float)):
-        r = torch.ones((len(phi))) * r
-
-    must_flatten = False
-    if len(phi.shape) == 1:
-        phi = phi.reshape(1, -1)
-        must_flatten = True
 
-    a = torch.cat((torch.ones((len(phi), 1), device=phi.device) * 2 * np.pi, phi), 1)
-    si = torch.sin(a)
-    si[:, 0] = 1
-    si = torch.cumprod(si, dim=1)
-    co = torch.cos(a)
-    co = torch.roll(co, -1, dims=1)
+def _is_tensor(x):
+    # a tensor cannot exist before torch is imported, NumPy inputs do not import it
+    torch = sys.modules.get("torch")
+    return torch is not None and torch.is_tensor(x)
 
-    result = si * co * r.unsqueeze(-1)
 
-    if must_flatten:
-        result = result[0]
+def _empty(like, shape):
+    if _is_tensor(like):
+        return like.new_empty(shape)
+    return np.empty(shape, dtype=like.dtype)
 
-    if must_convert_to_torch:
-        result = result.numpy()
 
-    return result
+def _as_float(x):
+    if _is_tensor(x):
+        return x if x.is_floating_point() else x.float()
+    x = np.asarray(x)
+    return x if np.issubdtype(x.dtype, np.floating) else x.astype(np.float64)
 
 
-def cartesian_to_spherical(x):
-    """Convert cartesian to spherical coordinates."""
+def spherical_to_cartesian(r, phi, out=None, chunk_size=CHUNK_SIZE):
+    """Convert spherical coordinates to cartesian coordinates.
 
-    must_convert_to_torch = False
-    if isinstance(x, np.ndarray):
-        must_convert_to_torch = True
-        x = torch.Tensor(x)
+    Works natively on NumPy arrays and torch tensors, in chunks of rows so
+    that temporaries stay bounded for large inputs.
 
-    must_flatten = False
-    if len(x.shape) == 1:
-        x = x.reshape(1, -1, 1)
-        must_flatten = True
+    Args:
+        r: Radius, a scalar or one value per row.
+        phi: Angles of shape (N, d-1) or (d-1,).
+        out: Optional buffer of shape (N, d) to write the result to.
+        chunk_size: Number of rows converted at once.
+    """
 
-    T = np.triu(np.ones((x.shape[1], x.shape[1])))
-    T = torch.Tensor(T).to(x.device)
+    phi = _as_float(phi)
+    must_flatten = len(phi.shape) == 1
+    if must_flatten:
+        phi = phi.reshape(1, -1)
+    n, d = phi.shape[0], phi.shape[1] + 1
+    if out is None:
+        out = _empty(phi, (n, d))
+    elif must_flatten:
+        out = out.reshape(1, -1)
+
+    for start in range(0, n, chunk_size):
+        p = phi[start : start + chunk_size]
+        o = out[start : start + chunk_size]
+        # x_k = r * sin(phi_1) ... sin(phi_k) * cos(phi_{k+1}), the last coordinate has no cosine
+        o[:, -1] = 1
+        if _is_tensor(p):
+            o[:, :-1].copy_(p).cos_()
+            o[:, 1:] *= p.sin().cumprod_(dim=1)
+        else:
+            np.cos(p, out=o[:, :-1])
+            sin = np.sin(p)
+            o[:, 1:] *= np.cumprod(sin, axis=1, out=sin)
+        if isinstance(r, (int, float)):
+            o *= r
+        else:
+            o *= r[start : start + chunk_size, None]
 
-    rs = torch.matmul(T, (x.unsqueeze(-1) ** 2)).reshape(x.shape)
-    rs = torch.sqrt(rs)
+    if must_flatten:
+        out = out[0]
+    return out
 
-    rs[rs == 0] = 1
 
-    phi = torch.acos(torch.clamp(x / rs, -1, 1))[:, :-1]
+def cartesian_to_spherical(x, out=None, chunk_size=CHUNK_SIZE):
+    """Convert cartesian to spherical coordinates.
 
-    # if x.shape[-1] > 2:
-    phi[:, -1] = phi[:, -1] + (2 * np.pi - 2 * phi[:, -1]) * (x[:, -1] <= 0).float()
+    The radii of the trailing coordinates are computed with a reverse
+    cumulative sum of squares, i.e. in O(d) per row. Works natively on
+    NumPy arrays and torch tensors, in chunks of rows so that temporaries
+    stay bounded for large inputs.
 
-    rs = rs[:, 0]
+    Args:
+        x: Points of shape (N, d) or (d,).
+        out: Optional tuple of buffers (r, phi) of shapes (N,) and (N, d-1).
+        chunk_size: Number of rows converted at once.
 
-    if must_convert_to_torch:
-        rs = rs.numpy()
-        phi = phi.numpy()
+    Returns:
+        The radius and the angles of each point.
+    """
 
+    x = _as_float(x)
+    must_flatten = len(x.shape) == 1
+    if must_flatten:
+        x = x.reshape(1, -1)
+    n, d = x.shape
+    if out is None:
+        out = (_empty(x, (n,)), _empty(x, (n, d - 1)))
+    rs_out, phi_out = out
     if must_flatten:
-        result = rs[0], phi[0]
-    else:
-        result = rs, phi
+        rs_out, phi_out = rs_out.reshape(1), phi_out.reshape(1, -1)
+
+    for start in range(0, n, chunk_size):
+        c = x[start : start + chunk_size]
+        phi = phi_out[start : start + chunk_size]
+        if _is_tensor(c):
+            # tail sums of squares: rs_k = sqrt(sum_{j >= k} x_j^2)
+            rs = c.flip(1).square_().cumsum_(dim=1).flip(1).sqrt_()
+            rs[rs == 0] = 1
+            phi.copy_(c[:, :-1]).div_(rs[:, :-1])
+            phi.clamp_(-1, 1).acos_()
+        else:
+            rs = np.square(c[:, ::-1])
+            np.cumsum(rs, axis=1, out=rs)
+            rs = np.sqrt(rs, out=rs)[:, ::-1]
+            rs[rs == 0] = 1
+            np.divide(c[:, :-1], rs[:, :-1], out=phi)
+            np.arccos(np.clip(phi, -1, 1, out=phi), out=phi)
+
+        # the last angle covers the full circle
+        last = phi[:, -1]
+        flip = c[:, -1] <= 0
+        last[flip] = 2 * np.pi - last[flip]
+        rs_out[start : start + chunk_size] = rs[:, 0]
 
-    return result
+    if must_flatten:
+        return rs_out[0], phi_out[0]
+    return rs_out, phi_out
 
 
-def sample_generalized_normal(mean: torch.Tensor, lbd: float, p: int, shape):
+def sample_generalized_normal(mean: "torch.Tensor", lbd: float, p: int, shape):
     """Sample from a generalized Normal distribution.
     Modified according to:
     https://www.tensorflow.org/probability/api_docs/python/tfp/distributions/GeneralizedNormal
@@ -91,6 +144,8 @@ def sample_generalized_normal(mean: torch.Tensor, lbd: float, p: int, shape):
         shape: Shape of the samples to generate.
     """
 
+    import torch
+
     assert isinstance(lbd, float)
 
     ipower = 1.0 / p
@@ -124,6 +179,8 @@ def truncated_rejection_resampling(
         device: Torch device.
     """
 
+    import torch
+
     result = torch.ones((size, n), device=device) * np.nan
     finished_mask = ~torch.isnan(result)
     while torch.sum(finished_mask).item() < n * size:
@@ -140,3 +197,165 @@ def truncated_rejection_resampling(
             finished_mask[copy_mask] = True
 
     return result
+
+
+DESIGNS = ["iid", "sobol", "lhs"]
+
+
+def design_points(size, dim, design="iid", seed=0, offset=0, total=None):
+    """Draw points in the unit cube [0, 1)^dim from an i.i.d. or space-filling design.
+
+    Rows ``offset .. offset + size`` of the design are returned, so that
+    shards generated separately with the same seed form a single design.
+
+    Args:
+        size: Number of points to draw.
+        dim: Dimensionality of the points.
+        design: "iid", "sobol" (scrambled Sobol sequence) or "lhs" (Latin hypercube).
+        seed: Seed of the design, shared by all shards.
+        offset: Index of the first point in the design.
+        total: Number of points of the whole design, needed to stratify a
+            sharded Latin hypercube; offset + size if None.
+    """
+
+    import torch
+
+    generator = torch.Generator().manual_seed(seed)
+    if design == "iid":
+        # skip the draws of the previous shards
+        for start in range(0, offset, CHUNK_SIZE):
+            torch.rand((min(CHUNK_SIZE, offset - start), dim), generator=generator)
+        return torch.rand((size, dim), generator=generator)
+    if design == "sobol":
+        engine = torch.quasirandom.SobolEngine(dim, scramble=True, seed=seed)
+        if offset:
+            engine.fast_forward(offset)
+        return engine.draw(size)
+    if design == "lhs":
+        total = offset + size if total is None else total
+        if offset + size > total:
+            raise ValueError(f"Rows {offset} to {offset + size} exceed the design of {total} points")
+        # one point per stratum of width 1 / total along every dimension
+        strata = torch.stack([torch.randperm(total, generator=generator) for _ in range(dim)], dim=1)
+        jitter = torch.rand((total, dim), generator=generator)
+        return (strata[offset : offset + size] + jitter[offset : offset + size]) / total
+    raise ValueError(f"Unknown design {design}, expected one of {DESIGNS}")
+
+
+class CategoricalSampler:
+    """Sampler of categorical variables with precomputed Walker alias tables.
+
+    The tables are built once, after which every draw costs one integer and
+    one uniform variate, whatever the number of classes. Uniform weights skip
+    the tables and use ``torch.randint`` directly.
+
+    Args:
+        weights: Number of classes for a uniform distribution, class weights
+            of shape (K,), or a transition matrix of shape (K, K) whose row i
+            holds the weights of P(class | given class = i).
+        generator: Optional ``torch.Generator`` for reproducible draws.
+    """
+
+    def __init__(self, weights, generator=None):
+        import torch
+
+        self.generator = generator
+        if isinstance(weights, int):
+            weights = torch.ones(weights, dtype=torch.float64)
+        weights = torch.as_tensor(weights, dtype=torch.float64).cpu()
+        if weights.dim() not in (1, 2) or weights.shape[-1] == 0:
+            raise ValueError(f"Expected class weights of shape (K,) or (K, K), got {tuple(weights.shape)}")
+        if weights.dim() == 2 and weights.shape[0] != weights.shape[1]:
+            raise ValueError(f"A transition matrix must be square, got {tuple(weights.shape)}")
+        if (weights < 0).any() or not torch.isfinite(weights).all() or (weights.sum(-1) <= 0).any():
+            raise ValueError("Class weights must be non-negative, finite and not all zero")
+
+        self.conditional = weights.dim() == 2
+        self.n_classes = weights.shape[-1]
+        rows = weights.reshape(-1, self.n_classes)
+        self.probabilities = rows / rows.sum(-1, keepdim=True)
+        self.uniform = bool((rows == rows[:, :1]).all())
+        if not self.uniform:
+            tables = [self._alias_table(p) for p in self.probabilities.numpy()]
+            # flat tables, looked up with a single gather per draw
+            self.accept = torch.from_numpy(np.concatenate([t[0] for t in tables])).float()
+            self.alias = torch.from_numpy(np.concatenate([t[1] for t in tables]))
+
+    @staticmethod
+    def _alias_table(probabilities):
+        # Vose's construction: pair every under-full bin with an over-full one
+        n = len(probabilities)
+        scaled = probabilities * n
+        accept = np.ones(n)
+        alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            accept[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # leftovers are full up to rounding errors
+        return accept, alias
+
+    def sample(self, size, given=None, device="cpu", unit=None):
+        """Draw ``size`` classes as a long tensor.
+
+        Args:
+            size: Number of samples to draw.
+            given: Class of each row conditioned on, required for a transition matrix.
+            device: torch device identifier
+            unit: Optional points in [0, 1) mapped to classes by inverse CDF
+                instead of random draws, e.g. from ``design_points``.
+        """
+
+        import torch
+
+        if unit is not None:
+            if self.conditional:
+                raise ValueError("Unit points can only be mapped through class weights, not a transition matrix")
+            cdf = self.probabilities[0].cumsum(0).float()
+            classes = torch.searchsorted(cdf, torch.as_tensor(unit, dtype=torch.float32).reshape(-1).contiguous(), right=True)
+            return classes.clamp_(max=self.n_classes - 1).to(device)
+
+        if self.conditional:
+            if given is None:
+                raise ValueError("A transition matrix needs the classes to condition on")
+            given = torch.as_tensor(given).reshape(-1).long().cpu()
+            if len(given) != size:
+                raise ValueError(f"Expected {size} classes to condition on, got {len(given)}")
+            if len(given) and (given.min() < 0 or given.max() >= self.n_classes):
+                raise ValueError(f"Classes to condition on must lie in [0, {self.n_classes})")
+
+        columns = torch.randint(self.n_classes, (size,), generator=self.generator)
+        if not self.uniform:
+            bins = columns + given * self.n_classes if self.conditional else columns
+            u = torch.rand(size, generator=self.generator)
+            keep = u < self.accept.index_select(0, bins)
+            columns = torch.where(keep, columns, self.alias.index_select(0, bins))
+        return columns.to(device)
+
+
+if __name__ == "__main__":
+    # coverage of the unit cube by the marginal designs, for a 9-dimensional factor box
+    import itertools
+    from scipy.stats import qmc
+
+    dim, bins, target = 9, 16, 0.99
+    pairs = list(itertools.combinations(range(dim), 2))
+
+    def coverage(points):
+        # mean fraction of occupied cells over all 2-d projections of a bins x bins grid
+        cells = (points.numpy() * bins).astype(int)
+        return np.mean([len(np.unique(cells[:, i] * bins + cells[:, j])) / bins ** 2 for i, j in pairs])
+
+    for design in DESIGNS:
+        for size in [256, 1024, 4096]:
+            points = design_points(size, dim, design, seed=0)
+            print(f"{design:5s} n={size:5d}: centered L2 discrepancy {qmc.discrepancy(points.double().numpy()):.5f}, "
+                  f"2-d coverage {coverage(points):.3f}")
+        size = 64
+        while coverage(design_points(size, dim, design, seed=0)) < target:
+            size = int(size * 1.25)
+        print(f"{design:5s}: {size} points reach {target:.0%} coverage of the {bins}x{bins} projections")
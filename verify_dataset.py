@@ -0,0 +1,119 @@
+"""Check the rendered images of a dataset and list the samples to render again.
+
+Every image of every view is decoded in a process pool and flagged if it is
+missing, cannot be decoded (e.g. a PNG left half-written by an interrupted
+render), does not have the resolution of the renderer or is blank. The
+flagged indices are written to a work list for
+``generate_clevr_dataset_images.py --worklist``, which renders them again:
+
+    python verify_dataset.py --root ${OUTPUT_FOLDER} --worklist worklist.json
+    blender -b -P generate_clevr_dataset_images.py -- --output-folder ${OUTPUT_FOLDER} --views all --worklist worklist.json
+
+Indices are checked in chunks and only the flagged ones are kept, so that
+memory stays bounded for millions of images.
+"""
+
+import os
+import json
+import time
+import argparse
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image
+import latent_io
+from latent_io import view_folders, image_filename
+
+# images whose pixel standard deviation is below this value, in [0, 255], are considered blank
+BLANK_STD = 1.0
+
+STATUSES = ["missing", "corrupted", "wrong size", "blank"]
+
+
+def check_image(path, resolution=(224, 224), blank_std=BLANK_STD):
+    """Return the problem of an image, one of ``STATUSES``, or None if it is valid."""
+
+    if not os.path.exists(path):
+        return "missing"
+    try:
+        # the header and chunk checksums first, then the pixels, which catches truncated files
+        with Image.open(path) as img:
+            img.verify()
+        with Image.open(path) as img:
+            size = img.size
+            pixels = np.asarray(img.convert("RGB"))
+    except Exception:
+        return "corrupted"
+    if tuple(size) != tuple(resolution):
+        return "wrong size"
+    # a subsample of the pixels is enough to tell a blank frame
+    if pixels[::2, ::2].std() < blank_std:
+        return "blank"
+    return None
+
+
+def _check_chunk(task):
+    image_folder, indices, resolution, blank_std = task
+    problems = []
+    for idx in indices:
+        status = check_image(os.path.join(image_folder, image_filename(idx)), resolution, blank_std)
+        if status is not None:
+            problems.append((int(idx), status))
+    return len(indices), problems
+
+
+def verify_view(root, view, pool, resolution=(224, 224), blank_std=BLANK_STD, chunk_size=256):
+    """Check all images of a view; return the flagged indices with their status."""
+
+    image_folder, latent_folder = view_folders(root, view)
+    n_samples = len(latent_io.LatentDataset(latent_folder))
+    tasks = (
+        (image_folder, range(start, min(start + chunk_size, n_samples)), resolution, blank_std)
+        for start in range(0, n_samples, chunk_size)
+    )
+    problems = []
+    n_checked = 0
+    start = time.perf_counter()
+    for n, chunk_problems in pool.imap_unordered(_check_chunk, tasks):
+        problems.extend(chunk_problems)
+        n_checked += n
+    elapsed = time.perf_counter() - start
+    print(f"{view}: checked {n_checked} images in {elapsed:.1f}s ({n_checked / max(elapsed, 1e-9):.0f} images/sec), "
+          f"{len(problems)} to render again")
+    return sorted(problems)
+
+
+def main(args):
+    views = args.views if args.views is not None else latent_io.view_names(
+        os.path.join(args.root, "factors") if os.path.isdir(os.path.join(args.root, "factors")) else args.root
+    )
+    if len(views) == 0:
+        raise ValueError(f"No view folders m1..mK found in {args.root}")
+
+    worklist = {}
+    counts = {status: 0 for status in STATUSES}
+    with Pool(args.num_workers) as pool:
+        for view in views:
+            problems = verify_view(args.root, view, pool, tuple(args.resolution), args.blank_std, args.chunk_size)
+            for idx, status in problems:
+                counts[status] += 1
+            worklist[view] = [idx for idx, _ in problems]
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+    if args.worklist is not None:
+        with open(args.worklist, "w") as f:
+            json.dump(worklist, f)
+        print(f"Wrote the work list of {sum(len(v) for v in worklist.values())} images to {args.worklist}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the rendered images of a dataset and list the samples to render again.")
+    parser.add_argument("--root", required=True, type=str, help="dataset folder holding the views m1..mK")
+    parser.add_argument("--views", nargs="+", default=None, help="views to check, all views of the dataset if not set")
+    parser.add_argument("--resolution", nargs=2, type=int, default=[224, 224], help="width and height of the renders")
+    parser.add_argument("--blank-std", type=float, default=BLANK_STD,
+                        help="images with a lower pixel standard deviation, in [0, 255], are flagged as blank")
+    parser.add_argument("--num-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=256, help="number of images checked per task")
+    parser.add_argument("--worklist", type=str, default=None,
+                        help="write the flagged indices of every view to this JSON file")
+    main(parser.parse_args())
@@ -135,25 +135,27 @@ def _sample_orthonormal_to(mu):
 
 
 if __name__ == "__main__":
+    # compare with the batched torch sampler of spaces.NSphereSpace
     import timeit
+    import torch
+    import spaces
 
     def setup_mu(num_samples, n):
         mu = np.random.normal(0.0, 1.0, size=(num_samples, n))
         mu /= np.sqrt(np.sum(mu ** 2, -1, keepdims=True))
         return mu
 
-    print(
-        timeit.timeit(
-            "n=1000; sample_vMF(mu=setup_mu(n, 10), kappa=1, num_samples=n)",
-            setup="from __main__ import setup_mu, sample_vMF, sample_vMF_p",
-            number=1000,
-        )
-    )
+    n, dim, number = 10 ** 6, 8, 3
+    mu = setup_mu(n, dim)
+    mu_torch = torch.as_tensor(mu, dtype=torch.float32)
+    sphere = spaces.NSphereSpace(dim)
+
+    for kappa in [1.0, 10.0]:
+        t_numpy = timeit.timeit(lambda: sample_vMF(mu=mu, kappa=kappa, num_samples=n), number=number) / number
+        t_torch = timeit.timeit(lambda: sphere.von_mises_fisher(mu_torch, kappa, n), number=number) / number
+        print(f"n={n} dim={dim} kappa={kappa}: numpy {t_numpy:.3f}s, torch {t_torch:.3f}s ({t_numpy / t_torch:.1f}x)")
 
-    print(
-        timeit.timeit(
-            "n=1000; sample_vMF_p(mu=setup_mu(n, 10), kappa=1, num_samples=n)",
-            setup="from __main__ import setup_mu, sample_vMF, sample_vMF_p",
-            number=1000,
-        )
-    )
\ No newline at end of file
+    # per-row concentrations are only supported by the torch sampler
+    kappas = torch.rand(n) * 10
+    t_torch = timeit.timeit(lambda: sphere.von_mises_fisher(mu_torch, kappas, n), number=number) / number
+    print(f"n={n} dim={dim} per-row kappa: torch {t_torch:.3f}s")